@@ -0,0 +1,77 @@
+"""
+Benchmark the metrics over synthetic data, or compare two benchmark runs. Run from the repository root (the ML metrics'
+models are found relative to it), eg
+
+    python -m app.benchmarks run --rows 10000 100000 --output before.json
+    python -m app.benchmarks compare before.json after.json
+"""
+import argparse
+import sys
+import pandas as pd
+from .runner import METRICS, SOURCES, BenchmarkSuite, compare_results, read_results, write_results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="time metrics over synthetic mortgage tables")
+    run.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    run.add_argument("--metrics", nargs="+", choices=list(METRICS), default=None)
+    run.add_argument("--sources", nargs="+", choices=SOURCES, default=SOURCES)
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--extra-columns", type=int, default=0)
+    run.add_argument("--null-rate", type=float, default=0.02)
+    run.add_argument("--cardinality", type=int, default=10)
+    run.add_argument("--duplicate-rate", type=float, default=0.01)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--no-isolate", action="store_true", help="run every case in this process")
+    run.add_argument("--work-dir", default=None, help="where the generated tables are written")
+    run.add_argument("--output", default="benchmark_results.json")
+
+    compare = commands.add_parser("compare", help="compare two runs")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1)
+    compare.add_argument("--fail-on-regression", action="store_true", help="exit with 1 if any case got slower")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        suite = BenchmarkSuite(
+            rows=args.rows,
+            metrics=args.metrics,
+            sources=args.sources,
+            repeat=args.repeat,
+            isolate=not args.no_isolate,
+            work_dir=args.work_dir,
+            seed=args.seed,
+            n_extra_columns=args.extra_columns,
+            null_rate=args.null_rate,
+            cardinality=args.cardinality,
+            duplicate_rate=args.duplicate_rate,
+        )
+
+        def report(record):
+            if record["status"] == "ok":
+                print(
+                    "{rows:>10} {source:<10} {metric:<18} {seconds:9.3f}s {rows_per_sec:14,.0f} rows/s".format(**record)
+                    + ("" if record["peak_rss_mb"] is None else " {0:9.1f}MB peak".format(record["peak_rss_mb"]))
+                )
+            else:
+                print("{rows:>10} {source:<10} {metric:<18} {status} {error}".format(**record))
+            sys.stdout.flush()
+
+        write_results(suite.run(on_done=report), args.output)
+        print("Results written to " + args.output)
+        return 0
+
+    comparison = compare_results(read_results(args.baseline), read_results(args.current), args.threshold)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(comparison.round(3).to_string(index=False))
+    if args.fail_on_regression and (comparison["change"] == "slower").any():
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
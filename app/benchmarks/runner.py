@@ -0,0 +1,313 @@
+import datetime
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+from ..profiler.data_sources import InMemoryDataSource, SQLDataSource
+from ..profiler.tabular_readers import DataFrameReader
+from ..profiler.sql_connectors import SQLViewConnector
+from ..profiler.metric_cache import metric_cache
+from ..profiler.metrics import (
+    BasicProfile,
+    TotalBlankCells,
+    TotalRowsCols,
+    DuplicateRows,
+    DetectBadAddress,
+    ClassifyClientNotes,
+    ExtractPIIAttributes,
+    ExtractDataRules,
+    ExtractBadPostcode,
+    ValidateFormats,
+    GroupedZScore,
+)
+from ..profiler.instrumentation import peak_rss_bytes
+from .synthetic import SyntheticMortgageData
+
+# name -> (metric class, metric_args over the synthetic mortgage table)
+METRICS = {
+    "basic_profile": (BasicProfile, {}),
+    "total_rows_cols": (TotalRowsCols, {}),
+    "total_blank_cells": (TotalBlankCells, {"pc": False}),
+    "duplicate_rows": (DuplicateRows, {}),
+    "grouped_z_score": (
+        GroupedZScore,
+        {"id_col": "user_id", "group_key": "card_type", "group_value": "credit_rate"},
+    ),
+    "bad_postcode": (ExtractBadPostcode, {"id_col": "user_id", "postcd_col": "PostCode"}),
+    "validate_formats": (ValidateFormats, {"rules": {"PostCode": "uk_postcode", "Email_Address": "email"}}),
+    "data_rules": (ExtractDataRules, {}),
+    "pii_attributes": (ExtractPIIAttributes, {}),
+    "bad_address": (DetectBadAddress, {"id_col": "user_id", "address_col": ["address", "city"]}),
+    "client_notes": (ClassifyClientNotes, {"id_col": "user_id", "notes_col": "client_notes"}),
+}
+SOURCES = ["in_memory", "sql"]
+TABLE_NAME = "mortgage"
+
+
+def current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # no procfs; the peak so far is the closest available
+        return peak_rss_bytes()
+
+
+def write_benchmark_data(df: pd.DataFrame, data_dir: str, sources: List[str]):
+    """
+    Write a generated table where the benchmarked data sources read it: a pickle for in-memory sources and a SQLite
+    database for SQL ones
+    """
+    if "in_memory" in sources:
+        df.to_pickle(os.path.join(data_dir, TABLE_NAME + ".pkl"), protocol=4)
+    if "sql" in sources:
+        with sqlite3.connect(os.path.join(data_dir, TABLE_NAME + ".db")) as con:
+            df.to_sql(TABLE_NAME, con, index=False, chunksize=100000)
+
+
+def _load_source(source: str, data_dir: str):
+    if source == "in_memory":
+        return InMemoryDataSource(DataFrameReader(pd.read_pickle(os.path.join(data_dir, TABLE_NAME + ".pkl"))))
+    if source == "sql":
+        connector = SQLViewConnector(
+            "sqlite", {"path": os.path.join(data_dir, TABLE_NAME + ".db"), "dbname": "main"}, table_name=TABLE_NAME
+        )
+        return SQLDataSource(connector)
+    raise ValueError("Unknown data source " + str(source) + ", expected one of " + ", ".join(SOURCES))
+
+
+def run_case(metric_name: str, source: str, data_dir: str, repeat: int = 3) -> Dict:
+    """
+    Time one metric over one data source, repeat times (each with a new metric, so nothing is reused between runs)
+
+    Returns:
+        Dict:the metric and source, status ("ok", "unsupported" where the metric has no implementation for the source,
+            or "error"), the time of each run, their median and minimum, the peak resident memory of the process
+            and how far the metric raised it above the memory held before it ran (both in MB, None where the
+            platform doesn't record them)
+    """
+    # results must be calculated every time, not read from the cache the web app configures
+    metric_cache.configure(enabled=False)
+    metric_cls, metric_args = METRICS[metric_name]
+    record = {"metric": metric_name, "source": source, "status": "ok", "error": None, "times": []}
+    data_source = _load_source(source, data_dir)
+    rss_before = current_rss_bytes()
+    try:
+        if source == "sql":
+            # stubs (which only raise NotImplementedError) don't take the metric's arguments
+            try:
+                inspect.signature(metric_cls.calculate_sql_tbl).bind(None, **metric_args)
+            except TypeError:
+                raise NotImplementedError
+        for _ in range(repeat):
+            metric = metric_cls(data_source, dict(metric_args))
+            start = time.perf_counter()
+            metric()
+            record["times"].append(time.perf_counter() - start)
+    except NotImplementedError:
+        record["status"] = "unsupported"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = type(e).__name__ + ": " + str(e)
+    peak = peak_rss_bytes()
+    record["seconds"] = float(np.median(record["times"])) if record["times"] else None
+    record["min_seconds"] = min(record["times"]) if record["times"] else None
+    record["peak_rss_mb"] = None if peak is None else peak / 1024 ** 2
+    record["metric_rss_mb"] = None if peak is None or rss_before is None else max(peak - rss_before, 0) / 1024 ** 2
+    return record
+
+
+def environment_metadata() -> Dict:
+    """
+    What a run's numbers depend on besides the code: versions, platform and commit
+    """
+    import sklearn
+    import sqlalchemy
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sqlalchemy": sqlalchemy.__version__,
+            "scikit-learn": sklearn.__version__,
+        },
+    }
+
+
+class BenchmarkSuite(object):
+    """
+    Times metrics over synthetic mortgage tables (see SyntheticMortgageData) of each size, through each data source,
+    recording wall time, rows per second and peak memory. Each table is generated once and written where the data
+    sources read it; each (metric, source) case then runs in a fresh process so its peak memory isn't inflated by
+    the cases before it.
+
+    Parameters:
+        rows (List[int]):table sizes
+        metrics (List[str]):names of the metrics to time (see METRICS; by default all)
+        sources (List[str]):data sources to time them through, "in_memory" and/or "sql" (a SQLite stand-in)
+        repeat (int):runs of each case; the median time is reported
+        isolate (bool):run each case in its own process (otherwise in this one, when peak memory is cumulative)
+        work_dir (str):directory the generated tables are written under (by default the system's temporary one)
+        seed (int):seed of the generated tables
+        **data_args:further SyntheticMortgageData arguments, eg n_extra_columns, null_rate and cardinality
+    """
+
+    def __init__(
+        self,
+        rows: List[int] = [10000, 100000],
+        metrics: List[str] = None,
+        sources: List[str] = SOURCES,
+        repeat: int = 3,
+        isolate: bool = True,
+        work_dir: str = None,
+        seed: int = 0,
+        **data_args
+    ):
+        unknown = [m for m in metrics or [] if m not in METRICS] + [s for s in sources if s not in SOURCES]
+        if unknown:
+            raise ValueError("Unknown metrics or data sources: " + ", ".join(unknown))
+        self.rows = rows
+        self.metrics = list(METRICS) if metrics is None else metrics
+        self.sources = sources
+        self.repeat = repeat
+        self.isolate = isolate
+        self.work_dir = work_dir
+        self.seed = seed
+        self.data_args = data_args
+
+    def _run_case(self, metric_name: str, source: str, data_dir: str) -> Dict:
+        if not self.isolate:
+            return run_case(metric_name, source, data_dir, self.repeat)
+        # forked where possible, so the app needn't be imported again for each case
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(method)) as pool:
+            try:
+                return pool.submit(run_case, metric_name, source, data_dir, self.repeat).result()
+            except BrokenProcessPool as e:
+                # eg killed for running out of memory
+                return {
+                    "metric": metric_name,
+                    "source": source,
+                    "status": "error",
+                    "error": "BrokenProcessPool: " + str(e),
+                    "times": [],
+                    "seconds": None,
+                    "min_seconds": None,
+                    "peak_rss_mb": None,
+                    "metric_rss_mb": None,
+                }
+
+    def run(self, on_done: Callable[[Dict], None] = None) -> Dict:
+        """
+        Parameters:
+            on_done (Callable):called with each case's record as it finishes (eg to report progress)
+
+        Returns:
+            Dict:"metadata" (the environment and the suite's settings) and "results", one record per (table size,
+                source, metric) as returned by run_case plus the table's rows and columns and the rows per second
+        """
+        records = []
+        for n_rows in self.rows:
+            with tempfile.TemporaryDirectory(dir=self.work_dir) as data_dir:
+                df = SyntheticMortgageData(n_rows, seed=self.seed, **self.data_args).generate()
+                n_columns = len(df.columns)
+                write_benchmark_data(df, data_dir, self.sources)
+                # not held while the cases run, so it isn't counted in their memory
+                del df
+                for source in self.sources:
+                    for metric_name in self.metrics:
+                        record = self._run_case(metric_name, source, data_dir)
+                        record["rows"] = n_rows
+                        record["columns"] = n_columns
+                        record["rows_per_sec"] = n_rows / record["seconds"] if record["seconds"] else None
+                        records.append(record)
+                        if on_done is not None:
+                            on_done(record)
+        metadata = environment_metadata()
+        metadata["settings"] = {
+            "rows": self.rows,
+            "metrics": self.metrics,
+            "sources": self.sources,
+            "repeat": self.repeat,
+            "isolate": self.isolate,
+            "seed": self.seed,
+            **self.data_args,
+        }
+        return {"metadata": metadata, "results": records}
+
+
+def write_results(results: Dict, path: str):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def read_results(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict, current: Dict, threshold: float = 0.1) -> pd.DataFrame:
+    """
+    Compare two runs case by case (cases in only one run are left out)
+
+    Parameters:
+        baseline (Dict):results of the earlier run (see BenchmarkSuite.run)
+        current (Dict):results of the later run
+        threshold (float):relative change in median time below which a case counts as unchanged
+
+    Returns:
+        pd.DataFrame:per case the median time and peak memory of both runs, the ratio of the times and whether the
+            case got "slower", "faster", stayed the "same" or changed status (eg started failing)
+    """
+    key = ["metric", "source", "rows"]
+    columns = key + ["status", "seconds", "peak_rss_mb"]
+    merged = pd.merge(
+        pd.DataFrame(baseline["results"], columns=columns),
+        pd.DataFrame(current["results"], columns=columns),
+        on=key,
+        suffixes=("_baseline", "_current"),
+    )
+    merged["time_ratio"] = merged["seconds_current"] / merged["seconds_baseline"]
+    change = np.where(
+        merged["time_ratio"] > 1 + threshold,
+        "slower",
+        np.where(merged["time_ratio"] < 1 / (1 + threshold), "faster", "same"),
+    )
+    # cases without times (unsupported or failing in both runs) are labelled with their status
+    change = np.where(merged["status_current"] == "ok", change, merged["status_current"])
+    status_changed = merged["status_baseline"] != merged["status_current"]
+    merged["change"] = np.where(
+        status_changed, merged["status_baseline"] + " -> " + merged["status_current"], change
+    )
+    return merged[
+        key
+        + [
+            "seconds_baseline",
+            "seconds_current",
+            "time_ratio",
+            "peak_rss_mb_baseline",
+            "peak_rss_mb_current",
+            "change",
+        ]
+    ]
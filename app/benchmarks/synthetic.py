@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from typing import List
+
+FIRST_NAMES = ["Ann", "Bob", "Cara", "Dev", "Eve", "Finn", "Gita", "Hugh", "Isla", "Jack"]
+SURNAMES = ["Smith", "Jones", "Patel", "Brown", "Taylor", "Wilson", "Evans", "Khan", "Walker", "Wright"]
+CITIES = ["London", "Bristol", "Leeds", "Edinburgh", "Cardiff", "Glasgow", "Leicester", "Norwich", "York", "Bath"]
+STREET_TYPES = ["Road", "Street", "Lane", "Avenue", "Close"]
+CARD_TYPES = ["Gold Card", "Classic Credit Card", "Student Credit Card"]
+MORTGAGE_TYPES = ["Interest-only Mortgage", "Fixed-rate Mortgage"]
+CLIENT_NOTES = ["changed address", "customer called", "notification of death received"]
+BAD_POSTCODES = ["BAD", "12", "453", "SW1A"]
+_NUMBERS = np.array([str(i) for i in range(200)], dtype=object)
+_SYLLABLES = ["ba", "co", "di", "fe", "ga", "hu", "ki", "lo", "ma", "ne", "pi", "ro", "sa", "tu", "ve", "wy"]
+
+
+def _pool(base: List[str], size: int) -> np.ndarray:
+    # base values first, then made-up words (letters only, so they still look like names) up to size
+    words = list(base[:size])
+    i = 0
+    while len(words) < size:
+        word, j = "", i
+        while True:
+            word += _SYLLABLES[j % len(_SYLLABLES)]
+            j //= len(_SYLLABLES)
+            if not j:
+                break
+        words.append(word.capitalize() + ("ton" if len(word) < 4 else ""))
+        i += 1
+    return np.array(words, dtype=object)
+
+
+class SyntheticMortgageData(object):
+    """
+    Seeded generator of tables shaped like the mortgage demo data (app/files/mortgage_data_v4.csv): the same columns,
+    types and kinds of values (names, emails, dates of birth, addresses, valid and malformed postcodes, card and
+    mortgage details, sparse client notes), at any size. The same arguments always give the same table.
+
+    Parameters:
+        n_rows (int):number of rows
+        n_extra_columns (int):further columns, alternately numeric and categorical, widening the table
+        null_rate (float):share of values left null in each column other than user_id
+        cardinality (int):distinct values of the name, city, street and extra categorical columns
+        duplicate_rate (float):share of rows that repeat an earlier row in full
+        outlier_rate (float):share of credit rates far from their card type's mean
+        bad_postcode_rate (float):share of postcodes in no valid format
+        seed (int):seed of the random generator
+    """
+
+    def __init__(
+        self,
+        n_rows: int = 10000,
+        n_extra_columns: int = 0,
+        null_rate: float = 0.02,
+        cardinality: int = 10,
+        duplicate_rate: float = 0.01,
+        outlier_rate: float = 0.02,
+        bad_postcode_rate: float = 0.1,
+        seed: int = 0,
+    ):
+        self.n_rows = n_rows
+        self.n_extra_columns = n_extra_columns
+        self.null_rate = null_rate
+        self.cardinality = cardinality
+        self.duplicate_rate = duplicate_rate
+        self.outlier_rate = outlier_rate
+        self.bad_postcode_rate = bad_postcode_rate
+        self.seed = seed
+
+    def _postcodes(self, rng: np.random.Generator, n: int) -> np.ndarray:
+        letters = np.array(list("ABCDEFGHJKLMNPRSTUWY"), dtype=object)
+        outward = letters[rng.integers(0, len(letters), n)] + letters[rng.integers(0, len(letters), n)]
+        outward = outward + _NUMBERS[rng.integers(1, 30, n)]
+        inward = _NUMBERS[rng.integers(0, 10, n)] + letters[rng.integers(0, len(letters), n)]
+        postcodes = outward + " " + inward + letters[rng.integers(0, len(letters), n)]
+        bad = rng.random(n) < self.bad_postcode_rate
+        postcodes[bad] = np.array(BAD_POSTCODES, dtype=object)[rng.integers(0, len(BAD_POSTCODES), bad.sum())]
+        return postcodes
+
+    def generate(self) -> pd.DataFrame:
+        rng = np.random.default_rng(self.seed)
+        n = self.n_rows
+        card_codes = rng.integers(0, len(CARD_TYPES), n)
+        credit_rate = rng.normal(18 + card_codes, 1.0)
+        outliers = rng.random(n) < self.outlier_rate
+        credit_rate[outliers] += rng.choice([-1, 1], outliers.sum()) * rng.uniform(8, 15, outliers.sum())
+        # each possible date is formatted once
+        birth_dates = pd.date_range("1940-01-01", periods=60 * 365, freq="D").strftime("%d/%m/%Y")
+        birth_dates = birth_dates.to_numpy(dtype=object)
+        cities = _pool(CITIES, self.cardinality)
+        streets = _pool(SURNAMES, self.cardinality)
+        addresses = (
+            _NUMBERS[rng.integers(1, 200, n)]
+            + " "
+            + streets[rng.integers(0, len(streets), n)]
+            + " "
+            + np.array(STREET_TYPES, dtype=object)[rng.integers(0, len(STREET_TYPES), n)]
+        )
+        addresses[rng.random(n) < 0.02] = "No address found"
+        loan_amount = rng.integers(50000, 500000, n)
+        columns = {
+            "user_id": np.array(["U%07d" % i for i in range(1, n + 1)], dtype=object),
+            "first_name": _pool(FIRST_NAMES, self.cardinality)[rng.integers(0, self.cardinality, n)],
+            "surname": _pool(SURNAMES, self.cardinality)[rng.integers(0, self.cardinality, n)],
+            "Email_Address": np.array(["user%d@example.com" % i for i in range(n)], dtype=object),
+            "dob": birth_dates[rng.integers(0, len(birth_dates), n)],
+            "gender": np.array(["M", "F"], dtype=object)[rng.integers(0, 2, n)],
+            "address": addresses,
+            "city": cities[rng.integers(0, len(cities), n)],
+            "PostCode": self._postcodes(rng, n),
+            "card_type": np.array(CARD_TYPES, dtype=object)[card_codes],
+            "credit_rate": credit_rate.round(2),
+            "mortgage_type": np.array(MORTGAGE_TYPES, dtype=object)[rng.integers(0, 2, n)],
+            "mortgage_rate": rng.normal(3.0, 0.15, n).round(3),
+            "loan_amount": loan_amount,
+            "term_years": rng.choice([15, 20, 25, 30], n),
+            "balance": (loan_amount * rng.uniform(0.2, 1.0, n)).round(2),
+            "country": np.array(["ENGLAND", "SCOTLAND"], dtype=object)[rng.integers(0, 2, n)],
+            "country_code": np.full(n, "GB", dtype=object),
+            "product_start_date": np.where(rng.random(n) < 0.1, "01/01/2020", None),
+            "client_notes": np.where(
+                rng.random(n) < 0.6, np.array(CLIENT_NOTES, dtype=object)[rng.integers(0, 3, n)], None
+            ),
+        }
+        extra_pool = _pool([], self.cardinality)
+        for k in range(self.n_extra_columns):
+            if k % 2:
+                columns["extra_cat_" + str(k)] = extra_pool[rng.integers(0, len(extra_pool), n)]
+            else:
+                columns["extra_num_" + str(k)] = rng.normal(100, 15, n).round(2)
+
+        if self.null_rate:
+            for col in list(columns)[1:]:
+                nulls = rng.random(n) < self.null_rate
+                if nulls.any():
+                    values = columns[col]
+                    if values.dtype == object:
+                        values[nulls] = None
+                    else:
+                        # numeric columns with nulls are floats, as pandas reads them
+                        values = values.astype(np.float64)
+                        values[nulls] = np.nan
+                    columns[col] = values
+        df = pd.DataFrame(columns)
+        if self.duplicate_rate and n > 1:
+            # each duplicate copies a random earlier row (following chains of duplicates back to an original)
+            duplicates = np.flatnonzero(rng.random(n) < self.duplicate_rate)
+            duplicates = duplicates[duplicates > 0]
+            rows = np.arange(n)
+            rows[duplicates] = (rng.random(len(duplicates)) * duplicates).astype(np.int64)
+            while True:
+                followed = rows[rows]
+                if np.array_equal(followed, rows):
+                    break
+                rows = followed
+            df = df.iloc[rows].reset_index(drop=True)
+        return df
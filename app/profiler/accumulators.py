@@ -0,0 +1,290 @@
+from abc import ABC, abstractmethod
+import logging
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Union
+from .column_stats import ApproximateColumnProfile
+from .format_validators import ValidationSuite
+from .group_stats import critical_value, clean_group_keys, group_moments, merge_group_moments, group_std, value_columns
+from .row_hashing import RECORD, HashCounter, hash_rows
+
+
+class MetricAccumulator(ABC):
+    """
+    Incremental form of a metric for data that arrives in chunks. The accumulator is initialised with the metric's
+    arguments, updated with each chunk in turn, and finalised into the same result the in-memory metric would return.
+    Accumulators built over different parts of the data can be merged, so partitions can be processed separately
+    """
+
+    @abstractmethod
+    def update(self, chunk: pd.DataFrame):
+        pass
+
+    @abstractmethod
+    def merge(self, other: "MetricAccumulator"):
+        pass
+
+    @abstractmethod
+    def finalize(self):
+        pass
+
+
+class TotalBlankCellsAccumulator(MetricAccumulator):
+    def __init__(self, pc: bool = True, dp: int = 2):
+        self.pc = pc
+        self.dp = dp
+        self.blanks = 0
+        self.rows = 0
+        self.cols = 0
+
+    def update(self, chunk: pd.DataFrame):
+        self.blanks += pd.isna(chunk).sum().sum()
+        self.rows += len(chunk)
+        self.cols = len(chunk.columns)
+        return self
+
+    def merge(self, other: "TotalBlankCellsAccumulator"):
+        self.blanks += other.blanks
+        self.rows += other.rows
+        self.cols = max(self.cols, other.cols)
+        return self
+
+    def finalize(self):
+        if not self.pc:
+            return self.blanks
+        return round(self.blanks / (self.rows * self.cols), self.dp)
+
+
+class TotalRowsColsAccumulator(MetricAccumulator):
+    def __init__(self):
+        self.rows = 0
+        self.cols = 0
+
+    def update(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        self.cols = len(chunk.columns)
+        return self
+
+    def merge(self, other: "TotalRowsColsAccumulator"):
+        self.rows += other.rows
+        self.cols = max(self.cols, other.cols)
+        return self
+
+    def finalize(self):
+        return self.rows, self.cols
+
+
+class BasicProfileAccumulator(MetricAccumulator):
+    """
+    Streaming basic profile. Distinct counts and quartiles come from sketches (see ApproximateColumnProfile) as exact
+    values can't be kept in bounded memory. Graphs need the raw column values so are not drawn; asking for either
+    raises a ValueError
+    """
+
+    def __init__(
+        self,
+        incl_graph: bool = False,
+        approximate: bool = True,
+        sketch_k: int = 200,
+        hll_precision: int = 14,
+    ):
+        if incl_graph:
+            raise ValueError("Graphs can't be drawn from a streamed profile, set incl_graph to False")
+        if not approximate:
+            raise ValueError("Exact profiles can't be streamed in bounded memory, set approximate to True")
+        self.profile = ApproximateColumnProfile(sketch_k, hll_precision)
+
+    def update(self, chunk: pd.DataFrame):
+        self.profile.update(chunk)
+        return self
+
+    def merge(self, other: "BasicProfileAccumulator"):
+        self.profile.merge(other.profile)
+        return self
+
+    def finalize(self):
+        profile = self.profile.finalize()
+        return profile[profile.columns.sort_values()]
+
+
+class ChunkResultsAccumulator(MetricAccumulator):
+    """
+    For row-level metrics whose result for the whole table is the concatenation of their results on each chunk
+    (eg listing the invalid rows). Memory grows with the size of the result, not the input. If no chunks arrive, func
+    is run on an empty frame of input_columns so the result still has its usual columns
+    """
+
+    def __init__(self, func: Callable, input_columns: List[str] = None, **kwargs):
+        self.func = func
+        self.input_columns = input_columns
+        self.kwargs = kwargs
+        self.results = []
+
+    def update(self, chunk: pd.DataFrame):
+        self.results.append(self.func(chunk, **self.kwargs))
+        return self
+
+    def merge(self, other: "ChunkResultsAccumulator"):
+        self.results.extend(other.results)
+        return self
+
+    def finalize(self):
+        if not self.results:
+            return self.func(pd.DataFrame(columns=self.input_columns), **self.kwargs)
+        return pd.concat(self.results)
+
+
+class DuplicateRowsAccumulator(MetricAccumulator):
+    """
+    Counts rows repeating an earlier row (or its subset columns) from their hashes, which are spilled to disk beyond
+    max_memory_bytes (see HashCounter). Only the hashes are kept, not the rows, so groups of duplicates are identified
+    by the position of their first row. Memory for the groups grows with the number of them, not the input
+    """
+
+    def __init__(
+        self,
+        subset: List[str] = None,
+        return_groups: bool = False,
+        max_memory_bytes: int = None,
+        spill_dir: str = None,
+    ):
+        self.subset = subset
+        self.return_groups = return_groups
+        self.counter = HashCounter(max_memory_bytes, spill_dir=spill_dir)
+
+    def update(self, chunk: pd.DataFrame):
+        self.counter.add(hash_rows(chunk if self.subset is None else chunk[self.subset]))
+        return self
+
+    def merge(self, other: "DuplicateRowsAccumulator"):
+        # the other accumulator's rows are treated as following this one's
+        self.counter.merge(other.counter)
+        return self
+
+    def finalize(self):
+        duplicates = 0
+        groups = [np.empty(0, dtype=RECORD)]
+        for records in self.counter.iter_counts():
+            repeated = records[records["count"] > 1]
+            duplicates += int((repeated["count"] - 1).sum())
+            if self.return_groups:
+                groups.append(repeated)
+        if not self.return_groups:
+            return np.int64(duplicates)
+        groups = np.concatenate(groups)
+        groups = groups[np.lexsort((groups["first_row"], -groups["count"]))]
+        return pd.DataFrame(
+            {"group_size": groups["count"]}, index=pd.Index(groups["first_row"], name="first_row")
+        )
+
+
+class FormatValidationAccumulator(MetricAccumulator):
+    def __init__(self, rules: Dict = {}, n_samples: int = 5, ignore_nulls: bool = True):
+        self.suite = ValidationSuite(rules, n_samples, ignore_nulls)
+
+    def update(self, chunk: pd.DataFrame):
+        self.suite.update(chunk)
+        return self
+
+    def merge(self, other: "FormatValidationAccumulator"):
+        self.suite.merge(other.suite)
+        return self
+
+    def finalize(self):
+        return self.suite.finalize()
+
+
+class GroupedZScoreAccumulator(MetricAccumulator):
+    """
+    Single pass grouped z-score. Per-group count, mean and sum of squared deviations are merged chunk by chunk; since
+    the flagged rows of a group are always its most extreme values, only the `max_candidates` highest and lowest
+    values of each group are retained to be scored once the final mean and std are known. Each value column has its
+    own moments and candidates
+    """
+
+    def __init__(
+        self,
+        id_col: str = "id",
+        group_key: str = "card_type",
+        group_value: Union[str, List[str]] = "credit_rate",
+        conf: float = 0.99,
+        max_candidates: int = 1000,
+    ):
+        self.id_col = id_col
+        self.group_key = group_key
+        self.group_value = group_value
+        self.value_cols = value_columns(group_value)
+        self.conf = conf
+        self.crit_value = critical_value(conf)
+        self.max_candidates = max_candidates
+        self.moments = {
+            col: pd.DataFrame(columns=["count", "mean", "m2"], dtype=np.float64)
+            for col in self.value_cols
+        }
+        self.candidates = {col: pd.DataFrame() for col in self.value_cols}
+        self.rows_seen = 0
+
+    def update(self, chunk: pd.DataFrame):
+        df = chunk[[self.id_col, self.group_key, *self.value_cols]].copy()
+        df.index = pd.RangeIndex(self.rows_seen, self.rows_seen + len(df))
+        self.rows_seen += len(df)
+        codes, labels = clean_group_keys(df[self.group_key])
+        df[self.group_key] = labels[codes]
+        for col in self.value_cols:
+            chunk_moments = group_moments(codes, len(labels), df[col].to_numpy(dtype=np.float64))
+            chunk_moments.index = pd.Index(labels, dtype=object)
+            chunk_moments = chunk_moments[chunk_moments["count"] > 0]
+            self.moments[col] = merge_group_moments(self.moments[col], chunk_moments)
+            values = df[[self.id_col, self.group_key, col]].dropna(subset=[col])
+            self._keep_candidates(col, pd.concat([self.candidates[col], values]))
+        return self
+
+    def _keep_candidates(self, col: str, values: pd.DataFrame):
+        ordered = values.sort_values(col, kind="mergesort")
+        grouped = ordered.groupby(self.group_key)
+        kept = pd.concat(
+            [grouped.head(self.max_candidates), grouped.tail(self.max_candidates)]
+        )
+        self.candidates[col] = kept[~kept.index.duplicated()]
+
+    def merge(self, other: "GroupedZScoreAccumulator"):
+        for col in self.value_cols:
+            self.moments[col] = merge_group_moments(self.moments[col], other.moments[col])
+            # the other accumulator's rows are treated as following this one's
+            other_candidates = other.candidates[col].copy()
+            other_candidates.index = other_candidates.index + self.rows_seen
+            self._keep_candidates(col, pd.concat([self.candidates[col], other_candidates]))
+        self.rows_seen += other.rows_seen
+        return self
+
+    def _finalize_column(self, col: str) -> pd.DataFrame:
+        df = self.candidates[col].sort_index()
+        if not len(df):
+            return pd.DataFrame(columns=[self.id_col, self.group_key, "avg", col])
+        group_stats = self.moments[col].reindex(df[self.group_key])
+        avg = group_stats["mean"].to_numpy()
+        std = group_std(group_stats)
+        df["avg"] = avg
+        with np.errstate(invalid="ignore", divide="ignore"):
+            df["above_cv"] = np.abs((df[col].to_numpy(dtype=np.float64) - avg) / std) > self.crit_value
+        # if every retained value in a tail is an anomaly there may be more than were kept
+        flagged = df.loc[df["above_cv"]].groupby(self.group_key).size()
+        if (flagged >= self.max_candidates).any():
+            logging.warning(
+                "Some groups have more than %d anomalies in a tail; increase max_candidates for a complete list",
+                self.max_candidates,
+            )
+        df["avg"] = df["avg"].round(2)
+        return df.loc[df["above_cv"]][[self.id_col, self.group_key, "avg", col]]
+
+    def finalize(self):
+        if isinstance(self.group_value, str):
+            return self._finalize_column(self.group_value)
+        return pd.concat(
+            [
+                self._finalize_column(col)
+                .rename(columns={col: "Value"})
+                .assign(Column=col)[[self.id_col, self.group_key, "Column", "avg", "Value"]]
+                for col in self.value_cols
+            ]
+        )
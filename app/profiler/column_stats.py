@@ -0,0 +1,309 @@
+import numpy as np
+import pandas as pd
+from typing import Dict
+from .sketches import HyperLogLog, KLLSketch
+
+# the quantiles reported by the basic profile, matching pd.DataFrame.describe()
+PROFILE_QUANTILES = {"11. 25%": 0.25, "12. 50%": 0.5, "13. 75%": 0.75}
+
+
+def _is_fusable(dtype) -> bool:
+    # anything that converts losslessly enough to float64 goes through the fused kernel. Other "number" dtypes
+    # (complex, timedelta) are rare and are left to pandas
+    return pd.api.types.is_numeric_dtype(dtype) and not (
+        pd.api.types.is_bool_dtype(dtype)
+        or pd.api.types.is_complex_dtype(dtype)
+        or pd.api.types.is_timedelta64_dtype(dtype)
+    )
+
+
+def _lerp(a: float, b: float, t: float) -> float:
+    # same formulation as numpy's linear percentile so results agree bit for bit with describe()
+    diff_b_a = b - a
+    return b - diff_b_a * (1 - t) if t >= 0.5 else a + diff_b_a * t
+
+
+def _valid_values(values: pd.Series) -> np.ndarray:
+    # integer columns (numpy or nullable) keep their native dtype: a float64 cast merges distinct values above 2**53
+    if pd.api.types.is_integer_dtype(values.dtype):
+        if isinstance(values.dtype, np.dtype):
+            return values.to_numpy()
+        return values.dropna().to_numpy(dtype=values.dtype.numpy_dtype)
+    floats = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return floats[~np.isnan(floats)]
+
+
+def numeric_column_stats(values: np.ndarray) -> Dict[str, float]:
+    """
+    Calculate all numeric statistics for one column's non-null values from a single sort
+
+    Parameters:
+        values (np.ndarray):the column's non-null values, integer columns in their native dtype
+
+    Returns:
+        Dict[str, float]:count, distinct count, mean, std, min, max and quartiles
+    """
+    count = len(values)
+    stats = {"count": float(count), "distinct": 0, "mean": np.nan, "std": np.nan, "min": np.nan, "max": np.nan}
+    stats.update({name: np.nan for name in PROFILE_QUANTILES})
+    if not count:
+        return stats
+
+    # distinct values are counted on the native dtype; only the moments and quantiles are taken in float64
+    ordered = np.sort(values)
+    stats["distinct"] = 1 + int(np.count_nonzero(ordered[1:] != ordered[:-1]))
+    total = values.sum(dtype=np.float64)
+    mean = total / count
+    stats["mean"] = mean
+    if count > 1:
+        deviations = values - mean
+        stats["std"] = float(np.sqrt(np.dot(deviations, deviations) / (count - 1)))
+    stats["min"] = float(ordered[0])
+    stats["max"] = float(ordered[-1])
+    last = count - 1
+    for name, q in PROFILE_QUANTILES.items():
+        pos = q * last
+        lo = int(np.floor(pos))
+        hi = min(lo + 1, last)
+        stats[name] = _lerp(float(ordered[lo]), float(ordered[hi]), pos - lo)
+    return stats
+
+
+def fused_column_profile(inp: pd.DataFrame) -> pd.DataFrame:
+    """
+    Single pass equivalent of the basic profile's separate isna/count/nunique/describe scans
+
+    Numeric columns are processed one at a time, so only a few column sized temporaries are alive at once. Each column's
+    non-null values are sorted once and counts, distinct values, extremes and quartiles are read straight off the sorted
+    values; integer columns stay in their native dtype so distinct values above 2**53 are not merged. Every other
+    column is factorized once, which gives both its null count and its distinct count.
+
+    Parameters:
+        inp (pd.DataFrame):input data
+
+    Returns:
+        pd.DataFrame:one row per input column with the "01." - "13." profile columns (and describe's "count")
+    """
+    n_rows = inp.shape[0]
+    n_cols = inp.shape[1]
+    dtypes = inp.dtypes.values
+    numeric_cols = inp.select_dtypes(include=["number"]).columns
+    is_numeric = inp.columns.isin(numeric_cols)
+    fusable = np.array([is_numeric[i] and _is_fusable(dtypes[i]) for i in range(n_cols)], dtype=bool)
+
+    nulls = np.zeros(n_cols, dtype=np.int64)
+    distinct = np.zeros(n_cols, dtype=np.int64)
+    stat_names = ["count", "07. Average Value", "08. Standard Deviation", "09. Minimum", "10. Maximum"] + list(
+        PROFILE_QUANTILES
+    )
+    stats = pd.DataFrame(np.nan, index=range(n_cols), columns=stat_names)
+
+    stat_keys = {
+        "count": "count",
+        "07. Average Value": "mean",
+        "08. Standard Deviation": "std",
+        "09. Minimum": "min",
+        "10. Maximum": "max",
+    }
+    stat_keys.update({name: name for name in PROFILE_QUANTILES})
+    for i in np.flatnonzero(fusable):
+        column_stats = numeric_column_stats(_valid_values(inp.iloc[:, i]))
+        nulls[i] = n_rows - int(column_stats["count"])
+        distinct[i] = column_stats["distinct"]
+        stats.iloc[i] = [column_stats[stat_keys[name]] for name in stat_names]
+
+    for i in np.flatnonzero(~fusable):
+        codes, uniques = pd.factorize(inp.iloc[:, i])
+        nulls[i] = (codes == -1).sum()
+        distinct[i] = len(uniques)
+        if is_numeric[i]:
+            described = inp.iloc[:, i].describe()
+            stats.loc[i, "count"] = described["count"]
+            for name, key in [
+                ("07. Average Value", "mean"),
+                ("08. Standard Deviation", "std"),
+                ("09. Minimum", "min"),
+                ("10. Maximum", "max"),
+                ("11. 25%", "25%"),
+                ("12. 50%", "50%"),
+                ("13. 75%", "75%"),
+            ]:
+                stats.loc[i, name] = described[key]
+
+    profile = pd.DataFrame(
+        {
+            "01. Column Name": inp.columns,
+            "02. Data Type": [str(dt) for dt in dtypes],
+            "04. Nulls": nulls,
+            "05. Non-Nulls": n_rows - nulls,
+            "03. Row Count": np.full(n_cols, n_rows, dtype=np.int64),
+            "06. No. Unique Values": distinct,
+        }
+    )
+    # describe() raises when there are no numeric columns at all, so the original profile had no stats columns then
+    if len(numeric_cols):
+        profile = pd.concat([profile, stats], axis=1)
+    return profile
+
+
+class _ColumnSketch(object):
+    """
+    Mergeable summary of one column: exact null counts and moments, HyperLogLog distinct count and KLL quantiles
+    """
+
+    def __init__(self, dtype: str, numeric: bool, k: int, precision: int):
+        self.dtype = dtype
+        self.numeric = numeric
+        self.nulls = 0
+        self.distinct = HyperLogLog(precision)
+        self.quantiles = KLLSketch(k)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values: pd.Series):
+        self.nulls += int(values.isna().sum())
+        self.distinct.update(values)
+        if self.numeric:
+            block = values.to_numpy(dtype=np.float64, na_value=np.nan)
+            block = block[~np.isnan(block)]
+            if len(block):
+                mean = block.mean()
+                self._merge_moments(len(block), mean, ((block - mean) ** 2).sum())
+            self.quantiles.update(block)
+
+    def reconcile(self, dtype: str, numeric: bool):
+        # chunks or partitions of the same column can be inferred differently (eg ints then floats once a null appears,
+        # or object where a partition has text). Moments and quantiles of only some of the values would be wrong, so a
+        # column that isn't numeric throughout is profiled as object
+        if self.dtype == dtype:
+            return
+        self.dtype = "float64" if self.numeric and numeric else "object"
+        if self.numeric and not numeric:
+            self.numeric = False
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            self.quantiles = KLLSketch(self.quantiles.k)
+
+    def _merge_moments(self, count: int, mean: float, m2: float):
+        # Chan et al. parallel update so chunks (or partitions) can be combined in any order
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def merge(self, other: "_ColumnSketch"):
+        self.reconcile(other.dtype, other.numeric)
+        self.nulls += other.nulls
+        self.distinct.merge(other.distinct)
+        if self.numeric:
+            self._merge_moments(other.count, other.mean, other.m2)
+            self.quantiles.merge(other.quantiles)
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "dtype": self.dtype,
+            "numeric": self.numeric,
+            "nulls": self.nulls,
+            "distinct": self.distinct.to_dict(),
+            "quantiles": self.quantiles.to_dict(),
+            "moments": [self.count, self.mean, self.m2],
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "_ColumnSketch":
+        sketch = cls(state["dtype"], state["numeric"], state["quantiles"]["k"], state["distinct"]["precision"])
+        sketch.nulls = state["nulls"]
+        sketch.distinct = HyperLogLog.from_dict(state["distinct"])
+        sketch.quantiles = KLLSketch.from_dict(state["quantiles"])
+        sketch.count, sketch.mean, sketch.m2 = state["moments"]
+        return sketch
+
+
+class ApproximateColumnProfile(object):
+    """
+    Approximate version of fused_column_profile built from mergeable sketches. Memory is bounded per column, so it
+    copes with high-cardinality columns, and profiles of separate chunks or partitions can be merged (or serialised
+    with to_dict and combined elsewhere) into the profile of the whole table.
+
+    Parameters:
+        k (int):KLL accuracy parameter for quantiles
+        precision (int):HyperLogLog precision for distinct counts
+    """
+
+    def __init__(self, k: int = 200, precision: int = 14):
+        self.k = k
+        self.precision = precision
+        self.n_rows = 0
+        self.columns = {}
+
+    def update(self, inp: pd.DataFrame):
+        numeric_cols = inp.select_dtypes(include=["number"]).columns
+        for col in inp.columns:
+            dtype = inp[col].dtype
+            numeric = col in numeric_cols and _is_fusable(dtype)
+            if col not in self.columns:
+                self.columns[col] = _ColumnSketch(str(dtype), numeric, self.k, self.precision)
+            sketch = self.columns[col]
+            sketch.reconcile(str(dtype), numeric)
+            sketch.update(inp[col])
+        self.n_rows += len(inp)
+        return self
+
+    def merge(self, other: "ApproximateColumnProfile"):
+        for col, sketch in other.columns.items():
+            if col in self.columns:
+                self.columns[col].merge(sketch)
+            else:
+                self.columns[col] = sketch
+        self.n_rows += other.n_rows
+        return self
+
+    def to_dict(self) -> Dict:
+        return {
+            "k": self.k,
+            "precision": self.precision,
+            "n_rows": self.n_rows,
+            "columns": [[col, sketch.to_dict()] for col, sketch in self.columns.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "ApproximateColumnProfile":
+        profile = cls(state["k"], state["precision"])
+        profile.n_rows = state["n_rows"]
+        profile.columns = {col: _ColumnSketch.from_dict(s) for col, s in state["columns"]}
+        return profile
+
+    def finalize(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame:the same columns as the exact profile plus "14. Distinct Count Error" (relative standard
+            error of the distinct count) and "15. Quantile Rank Error" (normalised rank error of the quartiles)
+        """
+        rows = []
+        for col, sketch in self.columns.items():
+            row = {
+                "01. Column Name": col,
+                "02. Data Type": sketch.dtype,
+                "03. Row Count": self.n_rows,
+                "04. Nulls": sketch.nulls,
+                "05. Non-Nulls": self.n_rows - sketch.nulls,
+                "06. No. Unique Values": sketch.distinct.count(),
+                "14. Distinct Count Error": sketch.distinct.relative_error,
+            }
+            if sketch.numeric:
+                row["count"] = float(sketch.count)
+                row["07. Average Value"] = sketch.mean if sketch.count else np.nan
+                row["08. Standard Deviation"] = (
+                    np.sqrt(sketch.m2 / (sketch.count - 1)) if sketch.count > 1 else np.nan
+                )
+                row["09. Minimum"] = sketch.quantiles.min
+                row["10. Maximum"] = sketch.quantiles.max
+                for name, q in PROFILE_QUANTILES.items():
+                    row[name] = sketch.quantiles.quantile(q)
+                row["15. Quantile Rank Error"] = sketch.quantiles.rank_error
+            rows.append(row)
+        return pd.DataFrame(rows)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import pandas as pd
+from typing import Callable, List, Optional
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # the cache is optional; readers parse the source file every time without it
+    feather = None
+
+
+class ColumnarCache(object):
+    """
+    On-disk cache of parsed tables in Feather (Arrow IPC) format, keyed by a hash of the source file's contents.
+
+    The first read of a file parses it as usual and writes the resulting frame, with the dtypes pandas inferred, to the
+    cache. Later reads of the same content memory-map the uncompressed Feather copy instead of parsing text again, and
+    can load just a subset of columns. Entries older than max_age_seconds are dropped and, beyond max_bytes, the least
+    recently used entries are evicted.
+
+    Parameters:
+        cache_dir (str):directory holding the cached files
+        max_bytes (int):total size the cache may grow to (None for no limit)
+        max_age_seconds (float):how long an entry may go unused before it is evicted (None for no limit)
+    """
+
+    suffix = ".feather"
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: Optional[int] = 2 * 1024 ** 3,
+        max_age_seconds: Optional[float] = 7 * 24 * 3600,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_available() -> bool:
+        return feather is not None
+
+    def content_hash(self, filepath: str) -> str:
+        """
+        sha256 of the file's contents. Remembered against the file's size and mtime so an unchanged file is only
+        hashed once per process
+        """
+        stat = os.stat(filepath)
+        stamp = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+        if stamp not in self._hashes:
+            sha = hashlib.sha256()
+            with open(filepath, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(block)
+            self._hashes[stamp] = sha.hexdigest()
+        return self._hashes[stamp]
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def get(self, key: str, columns: List[str] = None) -> Optional[pd.DataFrame]:
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = feather.read_table(path, columns=columns, memory_map=True)
+        except (OSError, ValueError):
+            # a missing or corrupt entry behaves like a miss
+            return None
+        # keeps recently used entries from being evicted first
+        os.utime(path)
+        return table.to_pandas()
+
+    def put(self, key: str, df: pd.DataFrame):
+        path = self._entry_path(key)
+        tmp_path = path + ".{0}.tmp".format(threading.get_ident())
+        try:
+            feather.write_feather(
+                df.reset_index(drop=True), tmp_path, compression="uncompressed"
+            )
+            os.replace(tmp_path, path)
+        except Exception as e:
+            # eg mixed-type object columns Arrow can't represent. Not worth failing the read over
+            logging.warning("Could not cache table %s: %s", key, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def get_or_read(
+        self, filepath: str, kind: str, read_fn: Callable[[], pd.DataFrame], columns: List[str] = None
+    ) -> pd.DataFrame:
+        """
+        Return the table parsed from filepath, from the cache when possible
+
+        Parameters:
+            filepath (str):the source file
+            kind (str):identifies how the file is parsed (eg "csv") so different readers of one file don't collide
+            read_fn (Callable):parses the source file when there is no cached copy
+            columns (List[str]):only load these columns from a cached copy
+        """
+        if not self.is_available():
+            df = read_fn()
+            return df if columns is None else df[columns]
+        key = "{0}-{1}".format(kind, self.content_hash(filepath))
+        df = self.get(key, columns)
+        if df is None:
+            df = read_fn()
+            self.put(key, df)
+            if columns is not None:
+                df = df[columns]
+        return df
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            now = time.time()
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for used, size, path in entries:
+                expired = (
+                    self.max_age_seconds is not None
+                    and now - used > self.max_age_seconds
+                )
+                too_big = self.max_bytes is not None and total > self.max_bytes
+                if not (expired or too_big):
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -1,10 +1,25 @@
 from .metrics import Metric
-from typing import List
+from .executors import MetricExecutor, MetricRun, SerialExecutor
+from .data_sources import InMemoryDataSource
+from .metric_cache import metric_cache
+from .instrumentation import instrumentation
+from typing import Callable, Dict, List
+import time
 
 
 class Dashboard(object):
-    def __init__(self):
+    """
+    A collection of metrics calculated together. The executor decides how the metrics are run (serially, in a thread
+    pool or in a process pool); timings and errors from the last calculation are kept on the dashboard. If set,
+    progress_callback is called with each MetricRun as its metric finishes
+    """
+
+    def __init__(self, executor: MetricExecutor = None):
         self.metrics = []
+        self.executor = executor or SerialExecutor()
+        self.metric_runs = []
+        self.calculation_seconds = None
+        self.progress_callback: Callable[[MetricRun], None] = None
 
     def add_metrics(self, metric: List[Metric]):
         if isinstance(metric, list):
@@ -14,9 +29,120 @@ class Dashboard(object):
         else:
             raise ValueError("Please pass either a Metric of a list of Metrics")
 
-    def calculate_all_metrics(self):
+    def declare_required_columns(self):
+        # let in-memory sources know the union of columns every metric needs before any of them loads its data
+        for m in self.metrics:
+            if isinstance(m.data_source, InMemoryDataSource):
+                m.data_source.require_columns(
+                    m.get_required_columns(**m.resolve_args())
+                )
+
+    def preload_data(self):
+        # in-memory sources load lazily, so without this every forked worker would read and parse the data itself
+        for m in self.metrics:
+            if isinstance(m.data_source, InMemoryDataSource):
+                m.data_source.data
+
+    def calculate_all_metrics(self, raise_errors: bool = True):
+        start = time.perf_counter()
+        self.declare_required_columns()
+        if self.executor.forks_workers:
+            self.preload_data()
+        # metrics a source can batch (eg over the same streaming source, or SQL aggregates over the same table) share
+        # a single pass over the data
+        runs = {}
+        # batched metrics are looked up in the metric cache here (others look themselves up when called), so only
+        # those without a cached result are calculated
+        cache_keys = {}
+        for m in self.metrics:
+            if not m.data_source.can_batch(m):
+                continue
+            with instrumentation.span() as stats:
+                key = m.cache_key()
+                found, result = (False, None) if key is None else metric_cache.get(key)
+            if found:
+                m.result = result
+                stats.update(cache_hit=True, batched=True)
+                runs[id(m)] = MetricRun(m, result=result, seconds=stats["seconds"], stats=stats)
+                instrumentation.record_metric(
+                    type(m).__name__, type(m.data_source).__name__, "cached", stats
+                )
+                if self.progress_callback is not None:
+                    self.progress_callback(runs[id(m)])
+            else:
+                cache_keys[id(m)] = key
+        batch_sources = []
         for m in self.metrics:
-            m()
+            if id(m) in cache_keys and m.data_source not in batch_sources:
+                batch_sources.append(m.data_source)
+        for source in batch_sources:
+            metrics = [m for m in self.metrics if m.data_source is source and id(m) in cache_keys]
+            with instrumentation.span() as scan:
+                batch_runs = source.run_metrics(metrics)
+            # the pass is recorded once; each metric's stats show the rows and queries of the pass it shared
+            instrumentation.record_batch(type(source).__name__, scan)
+            for m, run in zip(metrics, batch_runs):
+                run.stats = dict(scan, seconds=run.seconds, cache_hit=False, batched=True)
+                instrumentation.record_metric(
+                    type(m).__name__, type(source).__name__, "ok" if run.succeeded else "error", run.stats
+                )
+                runs[id(m)] = run
+                if run.succeeded and cache_keys[id(m)] is not None:
+                    metric_cache.put(cache_keys[id(m)], run.result)
+                if self.progress_callback is not None:
+                    self.progress_callback(run)
+        others = [m for m in self.metrics if id(m) not in runs]
+        for m, run in zip(others, self.executor.run(others, on_done=self.progress_callback)):
+            runs[id(m)] = run
+        self.metric_runs = [runs[id(m)] for m in self.metrics]
+        self.calculation_seconds = time.perf_counter() - start
+        instrumentation.observe(
+            "profiler_dashboard_duration_seconds", self.calculation_seconds, dashboard=type(self).__name__
+        )
+        if raise_errors:
+            for run in self.metric_runs:
+                if not run.succeeded:
+                    raise run.error
+
+    def get_metric_timings(self):
+        return [(type(run.metric).__name__, run.seconds) for run in self.metric_runs]
+
+    def get_timing_breakdown(self) -> Dict:
+        """
+        Where the last calculation's time went, to find slow metrics
+
+        Returns:
+            breakdown (Dict):the dashboard's total seconds and, slowest first, each metric's status ("ok", "error" or
+                "cached"), seconds, rows read, queries run and their seconds and whether it shared a pass over the
+                data with other metrics (when the rows and queries are those of the shared pass)
+        """
+        metrics = []
+        for run in self.metric_runs:
+            stats = run.stats or {}
+            if not run.succeeded:
+                status = "error"
+            else:
+                status = "cached" if stats.get("cache_hit") else "ok"
+            metrics.append(
+                {
+                    "metric": type(run.metric).__name__,
+                    "status": status,
+                    "seconds": run.seconds,
+                    "rows": stats.get("rows"),
+                    "queries": stats.get("queries"),
+                    "query_seconds": stats.get("query_seconds"),
+                    "batched": stats.get("batched", False),
+                }
+            )
+        metrics.sort(key=lambda m: m["seconds"], reverse=True)
+        return {"seconds": self.calculation_seconds, "metrics": metrics}
+
+    def get_metric_errors(self):
+        return [
+            (type(run.metric).__name__, run.error)
+            for run in self.metric_runs
+            if not run.succeeded
+        ]
 
     def add_metric(self, metric: Metric):
         self.metrics.append(metric)
@@ -53,8 +179,9 @@ class StandardDashboard(Dashboard):
         ml_address: Metric,
         headline_metrics: List[Metric],
         ml_client_notes: Metric,
+        executor: MetricExecutor = None,
     ):
-        super().__init__()
+        super().__init__(executor)
         self.headline_metrics = headline_metrics
         self.column_views = column_views
         self.anomaly_detect = anomaly_detect
@@ -83,7 +210,7 @@ class StandardDashboard(Dashboard):
             label = m.get_label()
             icon = m.get_icon()
             colour = m.get_colour()
-            result = m.get_result()
+            result = m.get_headline_result()
             if isinstance(label, list):
                 self.headline_metric_labels.extend(label)
                 self.headline_metric_icons.extend(icon)
@@ -121,8 +248,8 @@ class StandardDashboard(Dashboard):
             self.headline_metric_colours,
         )
 
-    def get_columnwise_view(self, col_name):
-        return self.column_views.get_result_for_column(col_name)
+    def get_columnwise_view(self, col_name, incl_graph=True):
+        return self.column_views.get_result_for_column(col_name, incl_graph=incl_graph)
 
     def get_tabular_view(self):
         return self.column_views.get_tabular_view()
@@ -1,9 +1,17 @@
 from abc import ABC, abstractmethod
 import pandas as pd
 import os
-from typing import Callable
-from .tabular_readers import TabularDataReader
+import threading
+import time
+from sqlalchemy.sql import text
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from .tabular_readers import TabularDataReader, ChunkedDataReader
 from .sql_connectors import SQLViewConnector
+from .sql_planner import SQLAggregatePlanner
+from .executors import MetricRun
+from .incremental import IncrementalStateStore
+from .metric_cache import MetricResultCache
+from .instrumentation import instrumentation
 
 
 class DataSource(ABC):
@@ -14,39 +22,392 @@ class DataSource(ABC):
     def run_metric(self, func: Callable, **kwargs):
         pass
 
+    def can_batch(self, metric) -> bool:
+        """
+        Whether the metric can be calculated together with others in one pass over this source (see run_metrics)
+        """
+        return False
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Cheaply identifies the source's data and how metrics are calculated over it, so results can be cached (see
+        metric_cache). None if the data can't be identified, in which case results aren't cached
+        """
+        return None
+
+    def run_metrics(self, metrics: List) -> List[MetricRun]:
+        raise NotImplementedError
+
 
 class InMemoryDataSource(DataSource):
     """
     Generic data source that's reads a table into memory for processing
+
+    The table is read when the first metric runs rather than up front. Metrics declare the columns they need through
+    require_columns and only the union of those is loaded; a metric that doesn't say (None) needs every column
     """
 
     def __init__(self, data_reader: TabularDataReader):
         self.data_reader = data_reader
-        self.data = self.data_reader.get_data()
+        self.required_columns = set()
+        self.needs_all_columns = False
+        self.column_names = None
+        self._load_lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled (dashboards are kept in the session and returned from job workers)
+        state = self.__dict__.copy()
+        del state["_load_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._load_lock = threading.Lock()
+
+    def require_columns(self, columns: Optional[List[str]]):
+        if columns is None:
+            self.needs_all_columns = True
+        else:
+            self.required_columns.update(columns)
+
+    def get_projection(self) -> Optional[List[str]]:
+        if self.needs_all_columns or not self.required_columns:
+            return None
+        return [c for c in self.get_column_names() if c in self.required_columns]
+
+    @property
+    def data(self) -> pd.DataFrame:
+        with self._load_lock:
+            return self.data_reader.get_data(self.get_projection())
 
     def get_column_names(self):
-        return self.data.columns
+        if self.column_names is None:
+            self.column_names = self.data_reader.get_column_names()
+        return self.column_names
+
+    def fingerprint(self) -> Optional[str]:
+        fingerprint = self.data_reader.fingerprint()
+        return None if fingerprint is None else "in_memory:" + fingerprint
 
     def run_metric(self, func: Callable, **kwargs):
+        data = self.data
+        instrumentation.add("rows", len(data))
         if kwargs:
-            return func(self.data, **kwargs)
+            return func(data, **kwargs)
         else:
-            return func(self.data)
+            return func(data)
 
 
 class SQLDataSource(DataSource):
     """
     Generic data source where processing occurs in some SQL database
+
+    Tables that are only ever appended to can be profiled incrementally. Given a watermark_column (one whose value
+    grows with each row appended, eg an auto-increment key or an insertion timestamp) and a state_store, metrics that
+    support it (see Metric.incremental) only read the rows with a watermark above the one stored with their partial
+    aggregates, merge the new rows' aggregates into them and store the result. A refresh then costs time in proportion
+    to the rows appended rather than the size of the table. Rows with a null watermark are never read. A metric's
+    state is rebuilt from the whole table when the table's columns change or its highest watermark goes backwards
+    (eg the table was reloaded)
+
+    The watermark must be strictly increasing in the order rows become visible: a row committed after a refresh must
+    have a higher watermark than every row that refresh read, or it is never counted. A coarse timestamp (eg to the
+    second) that rows committed later can share, or an auto-increment key allocated by transactions that commit out of
+    order, breaks this; use a sequence assigned at commit, or refresh only once the latest watermark value is complete
+
+    Parameters:
+        sql_view_connector (SQLViewConnector):the table or query to profile
+        watermark_column (str):column marking the order rows were appended in (None to always scan the whole table)
+        state_store (IncrementalStateStore):where watermarks and partial aggregates are persisted between runs
     """
 
-    def __init__(self, sql_view_connector: SQLViewConnector):
+    def __init__(
+        self,
+        sql_view_connector: SQLViewConnector,
+        watermark_column: str = None,
+        state_store: IncrementalStateStore = None,
+    ):
+        if watermark_column is not None:
+            if sql_view_connector.table_name is None:
+                raise ValueError("Incremental profiling needs a table name rather than custom SQL")
+            if watermark_column not in sql_view_connector.column_names:
+                raise ValueError("Watermark column " + str(watermark_column) + " is not in the table")
+            if state_store is None:
+                raise ValueError("Incremental profiling needs a state_store to persist watermarks in")
         self.sql_view_connector = sql_view_connector
+        self.watermark_column = watermark_column
+        self.state_store = state_store
 
     def get_column_names(self):
         return self.sql_view_connector.column_names
 
+    def fingerprint(self) -> Optional[str]:
+        # push-down results can differ slightly from in-memory ones (see GroupedZScore), so they're kept apart
+        fingerprint = self.sql_view_connector.fingerprint()
+        return None if fingerprint is None else "sql:" + fingerprint
+
+    def is_incremental(self, metric) -> bool:
+        return self.watermark_column is not None and metric.incremental
+
+    def can_batch(self, metric) -> bool:
+        return metric.aggregate_pushdown or self.is_incremental(metric)
+
+    def run_metrics(self, metrics: List) -> List[MetricRun]:
+        """
+        Calculate aggregate push-down and incremental metrics, storing each result on its metric
+        """
+        incremental = [m for m in metrics if self.is_incremental(m)]
+        runs = dict(zip(map(id, incremental), self.run_incremental(incremental)))
+        others = [m for m in metrics if id(m) not in runs]
+        runs.update(zip(map(id, others), self.run_aggregates(others)))
+        return [runs[id(m)] for m in metrics]
+
+    def state_key(self, metric, metric_args: Dict = None) -> str:
+        """
+        Key of a metric's incremental state: the table (and its columns, so the state is rebuilt if they change), the
+        watermark column, the metric class and its resolved arguments
+        """
+        conn = self.sql_view_connector.sql_connector
+        table = "{0}:{1}.{2}:{3}:{4}".format(
+            conn.engine.url.render_as_string(hide_password=True),
+            conn.db_creds["dbname"],
+            self.sql_view_connector.table_name,
+            self.watermark_column,
+            ",".join(self.sql_view_connector.column_names),
+        )
+        return MetricResultCache.make_key(table, type(metric), metric.resolve_args(metric_args))
+
+    def high_watermark(self):
+        """
+        The table's highest watermark (None while it has no rows with one)
+        """
+        conn = self.sql_view_connector.sql_connector
+        query = text(
+            "select max({0}) from {1}".format(
+                conn.quote(self.watermark_column), self.sql_view_connector.get_from_clause()
+            )
+        )
+        # read through the driver rather than a DataFrame so the value keeps the type it's bound back as
+        start = time.perf_counter()
+        with conn.engine.connect() as c:
+            high = c.execute(query).scalar()
+        instrumentation.record_query(time.perf_counter() - start, 1)
+        return high
+
+    def increment_condition(self, low, high) -> Tuple[str, Dict]:
+        """
+        Condition (and its bound parameters) selecting the rows with a watermark above low (None for every row) up to
+        high. Rows with a watermark equal to low were read by the previous refresh, so are not read again (see the
+        class docstring on why the watermark must be strictly increasing)
+        """
+        column = self.sql_view_connector.sql_connector.quote(self.watermark_column)
+        if low is None:
+            return column + " <= :wm_high", {"wm_high": high}
+        return column + " > :wm_low and " + column + " <= :wm_high", {"wm_low": low, "wm_high": high}
+
+    def run_incremental(self, metrics: List, metric_args: List[Dict] = None) -> List[MetricRun]:
+        """
+        Refresh incremental metrics from the rows appended since each last ran, storing each result on its metric and
+        each new state in the state store. The new rows are read up to the highest watermark at the start, so rows
+        appended meanwhile are left for the next refresh. Aggregate push-down metrics needing the same rows share a
+        single select over them
+
+        Parameters:
+            metrics (List[Metric]):metrics supporting incremental calculation
+            metric_args (List[Dict]):arguments of each metric (by default their metric_args)
+        """
+        if metric_args is None:
+            metric_args = [m.metric_args for m in metrics]
+        runs = [MetricRun(m) for m in metrics]
+        if not runs:
+            return runs
+        start = time.perf_counter()
+        try:
+            high = self.high_watermark()
+        except Exception as e:
+            for run in runs:
+                run.error = e
+            return runs
+        pending = []
+        for run, args in zip(runs, metric_args):
+            try:
+                key = self.state_key(run.metric, args)
+                stored = self.state_store.get(key)
+            except Exception as e:
+                run.error = e
+                continue
+            low, state = (None, None) if stored is None else stored
+            if low is not None and (high is None or high < low):
+                # the table was emptied or reloaded
+                low, state = None, None
+            pending.append((run, args, key, low, state))
+        overhead_seconds = (time.perf_counter() - start) / len(runs)
+        for run in runs:
+            run.seconds += overhead_seconds
+
+        lows = []
+        for _, _, _, low, _ in pending:
+            if low not in lows:
+                lows.append(low)
+        for low in lows:
+            group = [p for p in pending if p[3] == low]
+            partials = {}
+            if low is None or low != high:
+                where, params = self.increment_condition(low, high)
+                partials = self._scan_increment(group, where, params)
+            for run, args, key, low, state in group:
+                if not run.succeeded:
+                    continue
+                start = time.perf_counter()
+                try:
+                    if id(run) in partials:
+                        state = run.metric.store_increment(
+                            self.state_store, key, high, None if low is None else state, partials[id(run)]
+                        )
+                    run.result = run.metric.finalize_increment(state, self.sql_view_connector, **args)
+                    run.metric.result = run.result
+                except Exception as e:
+                    run.error = e
+                run.seconds += time.perf_counter() - start
+        return runs
+
+    def _scan_increment(self, group: List[Tuple], where: str, params: Dict) -> Dict:
+        # partial aggregates of the selected rows for each run (by id); aggregate push-down metrics share one select
+        partials = {}
+        aggregate = [(run, args) for run, args, _, _, _ in group if run.metric.aggregate_pushdown]
+        if aggregate:
+            planner = SQLAggregatePlanner(self.sql_view_connector)
+            for run, args in aggregate:
+                try:
+                    planner.add(id(run), run.metric.sql_aggregates(self.sql_view_connector, **args))
+                except Exception as e:
+                    run.error = e
+            start = time.perf_counter()
+            try:
+                partials.update(planner.execute(where, params))
+            except Exception as e:
+                for run, _ in aggregate:
+                    if run.succeeded:
+                        run.error = e
+            scan_seconds = (time.perf_counter() - start) / len(aggregate)
+            for run, _ in aggregate:
+                run.seconds += scan_seconds
+        for run, args, _, _, _ in group:
+            if run.metric.aggregate_pushdown or not run.succeeded:
+                continue
+            start = time.perf_counter()
+            try:
+                partials[id(run)] = run.metric.scan_increment(self.sql_view_connector, where, params, **args)
+            except Exception as e:
+                run.error = e
+            run.seconds += time.perf_counter() - start
+        return partials
+
+    def run_aggregates(self, metrics: List) -> List[MetricRun]:
+        """
+        Calculate aggregate push-down metrics with a single combined select, storing each result on its metric.
+        The time of the shared scan is split evenly between the metrics
+        """
+        planner = SQLAggregatePlanner(self.sql_view_connector)
+        runs = []
+        for i, m in enumerate(metrics):
+            run = MetricRun(m)
+            try:
+                planner.add(i, m.sql_aggregates(self.sql_view_connector, **m.metric_args))
+            except Exception as e:
+                run.error = e
+            runs.append(run)
+        start = time.perf_counter()
+        try:
+            values = planner.execute()
+        except Exception as e:
+            values = {}
+            for run in runs:
+                if run.succeeded:
+                    run.error = e
+        scan_seconds = (time.perf_counter() - start) / max(len(runs), 1)
+        for i, run in enumerate(runs):
+            run.seconds += scan_seconds
+            if not run.succeeded:
+                continue
+            start = time.perf_counter()
+            try:
+                run.result = run.metric.finalize_sql_aggregates(
+                    values[i], self.sql_view_connector, **run.metric.metric_args
+                )
+                run.metric.result = run.result
+            except Exception as e:
+                run.error = e
+            run.seconds += time.perf_counter() - start
+        return runs
+
     def run_metric(self, func: Callable, **kwargs):
         if kwargs:
             return func(self.sql_view_connector, **kwargs)
         else:
             return func(self.sql_view_connector)
+
+
+class StreamingDataSource(DataSource):
+    """
+    Data source that is read chunk by chunk so tables larger than memory can be profiled. Metrics run against it
+    through their accumulators (see Metric.create_accumulator)
+    """
+
+    def __init__(self, data_reader: ChunkedDataReader):
+        self.data_reader = data_reader
+
+    def get_column_names(self):
+        return self.data_reader.get_column_names()
+
+    def fingerprint(self) -> Optional[str]:
+        # streamed results can differ from in-memory ones (eg approximate quantiles), so they're kept apart
+        fingerprint = self.data_reader.fingerprint()
+        return None if fingerprint is None else "streaming:" + fingerprint
+
+    def can_batch(self, metric) -> bool:
+        return True
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        for chunk in self.data_reader.iter_chunks():
+            instrumentation.add("rows", len(chunk))
+            yield chunk
+
+    def run_metric(self, func: Callable, **kwargs):
+        return func(self.iter_chunks(), **kwargs)
+
+    def run_metrics(self, metrics: List) -> List[MetricRun]:
+        """
+        Calculate several metrics in a single pass over the data, storing each result on its metric
+        """
+        runs = []
+        accumulators = []
+        for m in metrics:
+            run = MetricRun(m)
+            try:
+                accumulators.append(m.create_accumulator(**m.metric_args))
+            except Exception as e:
+                run.error = e
+                accumulators.append(None)
+            runs.append(run)
+        for chunk in self.iter_chunks():
+            for run, acc in zip(runs, accumulators):
+                if not run.succeeded:
+                    continue
+                start = time.perf_counter()
+                try:
+                    acc.update(chunk)
+                except Exception as e:
+                    run.error = e
+                run.seconds += time.perf_counter() - start
+        for run, acc in zip(runs, accumulators):
+            if not run.succeeded:
+                continue
+            start = time.perf_counter()
+            try:
+                run.result = acc.finalize()
+                run.metric.result = run.result
+            except Exception as e:
+                run.error = e
+            run.seconds += time.perf_counter() - start
+        return runs
@@ -0,0 +1,107 @@
+import atexit
+import os
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from typing import Dict, Optional
+
+
+class EngineRegistry(object):
+    """
+    Process-wide store of SQLAlchemy engines keyed by connection string. Connectors built for the same database share
+    one engine, and so one connection pool, instead of each opening (and discarding) their own.
+
+    Parameters:
+        pool_size (int):connections kept open in each pool
+        max_overflow (int):extra connections allowed beyond pool_size under load
+        pool_pre_ping (bool):test connections before handing them out so dropped connections are replaced
+        pool_recycle (int):seconds after which a connection is replaced, to stay inside server idle timeouts
+            (-1 to never recycle)
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_pre_ping: bool = True,
+        pool_recycle: int = 3600,
+    ):
+        self.settings = {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_pre_ping": pool_pre_ping,
+            "pool_recycle": pool_recycle,
+        }
+        self.engines: Dict[str, Engine] = {}
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # forked children (executor, job and inference workers) mustn't use the parent's pooled connections
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # a child forked while another thread holds the lock would otherwise never get it
+        self._lock = threading.Lock()
+        for engine in self.engines.values():
+            # the child gets new, empty pools, leaving the parent's sockets open for the parent
+            try:
+                engine.dispose(close=False)
+            except TypeError:
+                # SQLAlchemy before 1.4.33, where this is what dispose(close=False) does
+                engine.pool = engine.pool.recreate()
+
+    def configure(self, **settings):
+        """
+        Change the pool settings used for engines created from now on
+        """
+        unknown = set(settings) - set(self.settings)
+        if unknown:
+            raise ValueError("Unknown pool settings: " + ", ".join(sorted(unknown)))
+        self.settings.update(settings)
+
+    def get_engine(self, conn_str: str, **engine_kwargs) -> Engine:
+        """
+        Return the engine for a connection string, creating it on first use
+
+        Parameters:
+            conn_str (str):SQLAlchemy connection string
+            engine_kwargs:further create_engine arguments, only used when the engine is created
+        """
+        with self._lock:
+            if conn_str not in self.engines:
+                kwargs = dict(self.settings)
+                kwargs.update(engine_kwargs)
+                kwargs.setdefault("poolclass", QueuePool)
+                self.engines[conn_str] = create_engine(conn_str, **kwargs)
+            return self.engines[conn_str]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Pool usage for each engine, keyed by connection string with the password masked
+        """
+        stats = {}
+        with self._lock:
+            for engine in self.engines.values():
+                pool = engine.pool
+                stats[repr(engine.url)] = {
+                    "size": pool.size(),
+                    "checked_in": pool.checkedin(),
+                    "checked_out": pool.checkedout(),
+                    "overflow": pool.overflow(),
+                }
+        return stats
+
+    def dispose(self, conn_str: Optional[str] = None):
+        """
+        Close the pooled connections of one engine (or of every engine) and forget it
+        """
+        with self._lock:
+            conn_strs = list(self.engines) if conn_str is None else [conn_str]
+            for c in conn_strs:
+                engine = self.engines.pop(c, None)
+                if engine is not None:
+                    engine.dispose()
+
+
+engine_registry = EngineRegistry()
+atexit.register(engine_registry.dispose)
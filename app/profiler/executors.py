@@ -0,0 +1,177 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from .instrumentation import instrumentation
+
+
+class MetricRun(object):
+    """
+    Outcome of running a single metric: the result (if successful), the exception (if not), the wall time taken and
+    the stats the instrumentation collected (see Instrumentation.span)
+    """
+
+    def __init__(
+        self, metric, result=None, error: Exception = None, seconds: float = 0.0, stats: Dict = None
+    ):
+        self.metric = metric
+        self.result = result
+        self.error = error
+        self.seconds = seconds
+        self.stats = stats
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def _timed_call(metric) -> MetricRun:
+    start = time.perf_counter()
+    try:
+        result = metric()
+    except Exception as e:
+        run = MetricRun(metric, error=e, seconds=time.perf_counter() - start)
+    else:
+        run = MetricRun(metric, result=result, seconds=time.perf_counter() - start)
+    run.stats = getattr(metric, "last_call_stats", None)
+    return run
+
+
+def _instrumented_call(metric) -> Tuple[MetricRun, Dict]:
+    # run in a worker process: what the call recorded there is sent back for the parent to merge
+    before = instrumentation.snapshot()
+    run = _timed_call(metric)
+    return run, instrumentation.diff(before)
+
+
+class MetricExecutor(ABC):
+    """
+    Strategy for running a collection of independent metrics. Every metric reads the same (read-only) input, so
+    the executors are free to run them in any order and at the same time. Executors with forks_workers set run
+    metrics in processes forked from the caller, which inherit whatever data it has already loaded
+    """
+
+    forks_workers = False
+
+    @abstractmethod
+    def run(self, metrics: List, on_done: Callable[[MetricRun], None] = None) -> List[MetricRun]:
+        """
+        Run every metric, storing each result on its metric so get_result() behaves as it would after a plain call.
+        Returns one MetricRun per metric, in the same order as the metrics passed in. If given, on_done is called in
+        the calling thread with each run as it finishes (eg to report progress); an exception it raises abandons the
+        remaining metrics
+        """
+        pass
+
+
+class SerialExecutor(MetricExecutor):
+    """
+    Runs metrics one after another in the calling thread
+    """
+
+    def run(self, metrics: List, on_done: Callable[[MetricRun], None] = None) -> List[MetricRun]:
+        runs = []
+        for m in metrics:
+            runs.append(_timed_call(m))
+            if on_done is not None:
+                on_done(runs[-1])
+        return runs
+
+
+class ThreadPoolMetricExecutor(MetricExecutor):
+    """
+    Runs metrics in a pool of threads. The input frame is shared directly; most of the heavy lifting in pandas,
+    numpy and sklearn releases the GIL so this gives real concurrency for the larger metrics
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+
+    def run(self, metrics: List, on_done: Callable[[MetricRun], None] = None) -> List[MetricRun]:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(_timed_call, m) for m in metrics]
+            try:
+                if on_done is not None:
+                    for future in as_completed(futures):
+                        on_done(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            return [future.result() for future in futures]
+
+
+# metrics of the run a forked worker belongs to, set by its pool's initializer. With fork the initializer's
+# arguments aren't pickled, so each child inherits the metrics (and the data they reference) copy-on-write
+_forked_metrics: List = []
+
+
+def _init_forked_worker(metrics: List):
+    global _forked_metrics
+    _forked_metrics = metrics
+
+
+def _run_forked_metric(i: int) -> Tuple[MetricRun, Dict]:
+    run, recorded = _instrumented_call(_forked_metrics[i])
+    # only the outcome travels back to the parent, never the metric and its data source
+    run.metric = None
+    return run, recorded
+
+
+class ProcessPoolMetricExecutor(MetricExecutor):
+    """
+    Runs metrics in a pool of processes. Where the platform supports fork, workers inherit the data source from
+    the parent so the DataFrame is shared zero-copy and only results are sent back. Elsewhere the metrics (and their
+    data) are pickled to the workers
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+
+    @property
+    def forks_workers(self) -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def run(self, metrics: List, on_done: Callable[[MetricRun], None] = None) -> List[MetricRun]:
+        if "fork" not in multiprocessing.get_all_start_methods():
+            pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            futures = [pool.submit(_instrumented_call, m) for m in metrics]
+        else:
+            # handed to this run's workers alone, so runs at the same time (eg in threads of the web server) can't
+            # see each other's metrics
+            pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_forked_worker,
+                initargs=(list(metrics),),
+            )
+            futures = [pool.submit(_run_forked_metric, i) for i in range(len(metrics))]
+        index = {future: i for i, future in enumerate(futures)}
+        try:
+            for future in as_completed(futures):
+                m = metrics[index[future]]
+                run, recorded = future.result()
+                instrumentation.merge(recorded)
+                run.metric = m
+                if run.succeeded:
+                    m.result = run.result
+                if on_done is not None:
+                    on_done(run)
+        finally:
+            # by hand rather than with shutdown(cancel_futures=True), which needs Python 3.9
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=True)
+        return [future.result()[0] for future in futures]
+
+
+def executor_factory(name: str, max_workers: Optional[int] = None) -> MetricExecutor:
+    if name == "serial":
+        return SerialExecutor()
+    elif name == "thread":
+        return ThreadPoolMetricExecutor(max_workers)
+    elif name == "process":
+        return ProcessPoolMetricExecutor(max_workers)
+    else:
+        raise ValueError('Please choose an executor from "serial", "thread" or "process"')
@@ -0,0 +1,216 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple, Union
+
+UK_POSTCODE_PATTERN = r"([Gg][Ii][Rr] 0[Aa]{2})|((([A-Za-z][0-9]{1,2})|(([A-Za-z][A-Ha-hJ-Yj-y][0-9]{1,2})|(([A-Za-z][0-9][A-Za-z])|([A-Za-z][A-Ha-hJ-Yj-y][0-9][A-Za-z]?))))\s?[0-9][A-Za-z]{2})|([0-9][0-9][0-9][0-9][0-9])"
+# UK landline or mobile, national (0...) or international (+44 / 0044) form, optionally spaced
+UK_PHONE_PATTERN = r"(?:\+44|0044|0)\s?(?:\d\s?){9,10}"
+# two prefix letters (excluding the unallocated combinations), six digits and a suffix A-D, optionally spaced in pairs
+NI_NUMBER_PATTERN = r"(?!BG|GB|KN|NK|NT|TN|ZZ)[A-CEGHJ-PR-TW-Z][A-CEGHJ-NPR-TW-Z]\s?\d{2}\s?\d{2}\s?\d{2}\s?[A-D]"
+EMAIL_PATTERN = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}"
+
+
+def _factorize_with_nulls(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # pd.factorize(use_na_sentinel=False) needs pandas 1.5; nulls (coded -1) are given a code of their own here
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(uniques), codes)
+        uniques = np.append(uniques, np.nan)
+    return codes, uniques
+
+
+class FormatValidator(object):
+    """
+    Checks a column's values against a regular expression. Each distinct value is checked once, with pandas'
+    vectorised string matching, and the result broadcast back to the rows. Values are compared as str(value), so
+    missing values are invalid unless the pattern accepts "None"/"nan".
+
+    Parameters:
+        pattern (str):regular expression a valid value matches
+        full_match (bool):the whole value must match; otherwise only its start must (as re.match)
+        case_sensitive (bool):whether letters must match the case given in the pattern
+    """
+
+    def __init__(self, pattern: str, full_match: bool = True, case_sensitive: bool = True):
+        self.pattern = pattern
+        self.full_match = full_match
+        self.case_sensitive = case_sensitive
+        self.flags = 0 if case_sensitive else re.IGNORECASE
+        self.regex = re.compile(pattern, self.flags)
+
+    def anchored_pattern(self) -> str:
+        """
+        The pattern as it is applied with re.match, with its flags and end anchor inlined so it can be combined with
+        other validators' patterns (see RuleSet)
+        """
+        pattern = "(?:" + self.pattern + ")"
+        if self.full_match:
+            pattern += r"\Z"
+        if not self.case_sensitive:
+            pattern = "(?i:" + pattern + ")"
+        return pattern
+
+    def is_valid(self, values: pd.Series) -> pd.Series:
+        """
+        Returns:
+            pd.Series:boolean series aligned with values, True where the value is valid
+        """
+        codes, uniques = _factorize_with_nulls(values)
+        distinct = pd.Series(uniques, dtype=object).map(str)
+        if self.full_match:
+            valid = distinct.str.fullmatch(self.regex)
+        else:
+            valid = distinct.str.match(self.regex)
+        return pd.Series(
+            valid.to_numpy(dtype=bool)[codes] if len(codes) else np.zeros(0, dtype=bool),
+            index=values.index,
+        )
+
+    def is_invalid(self, values: pd.Series) -> pd.Series:
+        return ~self.is_valid(values)
+
+
+FORMAT_VALIDATORS: Dict[str, FormatValidator] = {
+    # re.match semantics (a valid postcode at the start of the value) as the original postcode check
+    "uk_postcode": FormatValidator(UK_POSTCODE_PATTERN, full_match=False),
+    "uk_phone": FormatValidator(UK_PHONE_PATTERN),
+    "ni_number": FormatValidator(NI_NUMBER_PATTERN, case_sensitive=False),
+    "email": FormatValidator(EMAIL_PATTERN),
+}
+
+
+def register_format(name: str, validator: FormatValidator):
+    FORMAT_VALIDATORS[name] = validator
+
+
+def get_format_validator(name: str) -> FormatValidator:
+    if name not in FORMAT_VALIDATORS:
+        raise ValueError(
+            "Unknown format {0}. Please choose from {1}".format(
+                name, ", ".join(sorted(FORMAT_VALIDATORS))
+            )
+        )
+    return FORMAT_VALIDATORS[name]
+
+
+class RuleSet(FormatValidator):
+    """
+    Several formats compiled into a single regular expression: a value is valid if it matches any of them, and each
+    value is matched once however many formats there are (eg a contact column holding phone numbers or emails)
+
+    Parameters:
+        formats (List[str]):names of registered formats (see FORMAT_VALIDATORS)
+    """
+
+    def __init__(self, formats: List[str]):
+        self.formats = list(formats)
+        pattern = "|".join(get_format_validator(f).anchored_pattern() for f in self.formats)
+        super().__init__(pattern, full_match=False)
+
+
+class ValidationSuite(object):
+    """
+    Checks many columns, each against its own formats, and tallies per column the rows checked, the invalid rows and
+    a sample of distinct invalid values. Each column is factorised once per update, and results for distinct values
+    are remembered per column (up to max_cached_values) so repeated values are never matched twice, including across
+    the chunks of a streamed table. Suites over different parts of a table can be merged.
+
+    Parameters:
+        rules (Dict[str, Union[str, List[str]]]):column name -> format name, or list of format names any of which is
+            valid
+        n_samples (int):distinct invalid values kept per column
+        ignore_nulls (bool):skip missing values rather than counting them as invalid
+        max_cached_values (int):distinct values remembered per column
+    """
+
+    def __init__(
+        self,
+        rules: Dict[str, Union[str, List[str]]],
+        n_samples: int = 5,
+        ignore_nulls: bool = True,
+        max_cached_values: int = 100000,
+    ):
+        self.rules = {
+            col: [formats] if isinstance(formats, str) else list(formats)
+            for col, formats in rules.items()
+        }
+        self.n_samples = n_samples
+        self.ignore_nulls = ignore_nulls
+        self.max_cached_values = max_cached_values
+        # compiled once per distinct set of formats, however many columns share it
+        rule_sets = {}
+        self.validators = {}
+        for col, formats in self.rules.items():
+            key = tuple(formats)
+            if key not in rule_sets:
+                rule_sets[key] = RuleSet(formats)
+            self.validators[col] = rule_sets[key]
+        self.distinct_cache = {col: {} for col in self.rules}
+        self.rows_checked = {col: 0 for col in self.rules}
+        self.invalid_counts = {col: 0 for col in self.rules}
+        self.samples = {col: [] for col in self.rules}
+
+    def _check_distinct(self, col: str, distinct: pd.Series) -> np.ndarray:
+        cache = self.distinct_cache[col]
+        valid = distinct.map(cache)
+        unseen = valid.isna().to_numpy()
+        if unseen.any():
+            new_values = distinct[unseen]
+            new_valid = self.validators[col].is_valid(new_values)
+            valid[unseen] = new_valid
+            room = self.max_cached_values - len(cache)
+            if room > 0:
+                cache.update(zip(new_values.iloc[:room], new_valid.iloc[:room]))
+        return valid.to_numpy(dtype=bool)
+
+    def update(self, df: pd.DataFrame):
+        for col in self.rules:
+            values = df[col]
+            if self.ignore_nulls:
+                values = values.dropna()
+            codes, uniques = _factorize_with_nulls(values)
+            if not len(uniques):
+                continue
+            valid = self._check_distinct(col, pd.Series(uniques, dtype=object).map(str))
+            counts = np.bincount(codes, minlength=len(uniques))
+            self.rows_checked[col] += len(values)
+            self.invalid_counts[col] += int(counts[~valid].sum())
+            self._add_samples(col, [str(v) for v in uniques[~valid]])
+        return self
+
+    def _add_samples(self, col: str, values: List[str]):
+        samples = self.samples[col]
+        for v in values:
+            if len(samples) >= self.n_samples:
+                break
+            if v not in samples:
+                samples.append(v)
+
+    def merge(self, other: "ValidationSuite"):
+        for col in self.rules:
+            self.rows_checked[col] += other.rows_checked[col]
+            self.invalid_counts[col] += other.invalid_counts[col]
+            self._add_samples(col, other.samples[col])
+            room = self.max_cached_values - len(self.distinct_cache[col])
+            for value, valid in list(other.distinct_cache[col].items())[: max(room, 0)]:
+                self.distinct_cache[col].setdefault(value, valid)
+        return self
+
+    def finalize(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                "Column": list(self.rules),
+                "Formats": [", ".join(formats) for formats in self.rules.values()],
+                "Rows Checked": [self.rows_checked[col] for col in self.rules],
+                "Invalid Count": [self.invalid_counts[col] for col in self.rules],
+                "Invalid %": [
+                    round(100 * self.invalid_counts[col] / self.rows_checked[col], 2)
+                    if self.rows_checked[col]
+                    else 0.0
+                    for col in self.rules
+                ],
+                "Invalid Samples": [list(self.samples[col]) for col in self.rules],
+            }
+        )
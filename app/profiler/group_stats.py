@@ -0,0 +1,102 @@
+import re
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from typing import List, Tuple, Union
+
+# the values the z-score metrics have always used, kept so existing results don't shift (norm.ppf(0.99) is 2.326)
+LEGACY_CRITICAL_VALUES = {0.99: 2.33, 0.95: 1.645}
+
+
+def critical_value(conf: float) -> float:
+    """
+    One-sided critical value of the standard normal distribution: a z-score above it is flagged at confidence conf
+
+    Parameters:
+        conf (float):confidence level, strictly between 0 and 1
+    """
+    if not 0 < conf < 1:
+        raise ValueError("Confidence level must be between 0 and 1, got " + str(conf))
+    if conf in LEGACY_CRITICAL_VALUES:
+        return LEGACY_CRITICAL_VALUES[conf]
+    return float(norm.ppf(conf))
+
+
+def value_columns(group_value: Union[str, List[str]]) -> List[str]:
+    """
+    The value columns GroupedZScore checks: one column, or a list of them (which must not be empty)
+    """
+    if isinstance(group_value, str):
+        return [group_value]
+    if not len(group_value):
+        raise ValueError("group_value must be a column or a non-empty list of columns")
+    return list(group_value)
+
+
+def clean_group_keys(keys: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group keys as str(key) stripped of non-ASCII characters. Each distinct key is cleaned once; keys that become equal
+    once cleaned share a group. Missing keys form their own group ("nan"/"None")
+
+    Returns:
+        codes (np.ndarray):group number of each row
+        labels (np.ndarray):cleaned key of each group
+    """
+    raw_codes, raw_uniques = pd.factorize(keys)
+    raw_uniques = np.asarray(raw_uniques, dtype=object)
+    if (raw_codes < 0).any():
+        # nulls (coded -1) get a key of their own (pd.factorize's use_na_sentinel=False needs pandas 1.5)
+        raw_codes = np.where(raw_codes < 0, len(raw_uniques), raw_codes)
+        raw_uniques = np.append(raw_uniques, np.nan)
+    cleaned = [re.sub(r"[^\x00-\x7F]+", "", str(x)) for x in raw_uniques]
+    group_of_unique, labels = pd.factorize(pd.Series(cleaned, dtype=object))
+    return group_of_unique[raw_codes], np.asarray(labels, dtype=object)
+
+
+def group_moments(codes: np.ndarray, n_groups: int, values: np.ndarray) -> pd.DataFrame:
+    """
+    Count, mean and sum of squared deviations from the mean (m2) of the non-null values of each group, from three
+    bincounts over the rows
+
+    Parameters:
+        codes (np.ndarray):group number of each row (0 to n_groups - 1)
+        n_groups (int):number of groups
+        values (np.ndarray):float values, NaN marking a null
+
+    Returns:
+        pd.DataFrame:one row per group number with count, mean and m2
+    """
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    count = np.bincount(codes, minlength=n_groups).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(codes, weights=values, minlength=n_groups) / count
+    deviations = values - mean[codes]
+    m2 = np.bincount(codes, weights=deviations * deviations, minlength=n_groups)
+    return pd.DataFrame({"count": count, "mean": mean, "m2": m2})
+
+
+def merge_group_moments(current: pd.DataFrame, other: pd.DataFrame) -> pd.DataFrame:
+    """
+    Combine the moments of two parts of the data (Chan et al.), vectorised over groups. Both frames are indexed by
+    group key; groups missing from one side count as empty
+    """
+    current = current.reindex(current.index.union(other.index)).fillna(0.0)
+    other = other.reindex(current.index).fillna(0.0)
+    total = current["count"] + other["count"]
+    delta = other["mean"] - current["mean"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(total > 0, other["count"] / total, 0.0)
+    return pd.DataFrame(
+        {
+            "count": total,
+            "mean": current["mean"] + delta * share,
+            "m2": current["m2"] + other["m2"] + delta * delta * current["count"] * share,
+        }
+    )
+
+
+def group_std(moments: pd.DataFrame) -> np.ndarray:
+    # sample standard deviation (ddof=1) as pandas' groupby std; NaN for groups of fewer than two values
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sqrt(moments["m2"].to_numpy() / (moments["count"].to_numpy() - 1))
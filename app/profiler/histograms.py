@@ -0,0 +1,127 @@
+import json
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+from typing import Dict
+
+
+def column_histogram_data(
+    values: pd.Series, profile_row: pd.Series, nbins: int = 75, max_categories: int = 50
+) -> str:
+    """
+    Compact, JSON encoded summary of a column for its column view graph. Its size depends on the number of bins or
+    categories, not the number of rows
+
+    Parameters:
+        values (pd.Series):the column's values
+        profile_row (pd.Series):the column's BasicProfile row
+        nbins (int):number of histogram bins for numeric and datetime columns
+        max_categories (int):text columns with more distinct values than this get a bar chart of their counts instead
+            of one bar per value. Other columns (eg bool, category or string dtypes) get a bar for each of their
+            max_categories - 1 most common values and one for all the rest ("Other")
+
+    Returns:
+        hist_data (str):JSON object with "kind" ("histogram", "time_histogram", "categories" or "counts"), "column" and
+            the bars
+    """
+    col = profile_row["01. Column Name"]
+    if profile_row["02. Data Type"] == "object" and profile_row["06. No. Unique Values"] > max_categories:
+        hist_data = {
+            "kind": "counts",
+            "labels": [
+                "Null Values",
+                "Total Non-Null Values",
+                "Total Values inc. Nulls",
+                "Distinct Values",
+            ],
+            "values": [
+                int(profile_row["04. Nulls"]),
+                int(profile_row["05. Non-Nulls"]),
+                int(profile_row["03. Row Count"]),
+                int(profile_row["06. No. Unique Values"]),
+            ],
+        }
+    elif pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        finite = values.to_numpy(dtype=np.float64)
+        finite = finite[np.isfinite(finite)]
+        if len(finite):
+            counts, edges = np.histogram(finite, bins=nbins)
+        else:
+            counts, edges = np.array([], dtype=np.int64), np.array([])
+        hist_data = {"kind": "histogram", "counts": counts.tolist(), "edges": edges.tolist()}
+    elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+        # binned by time, as nanoseconds since the epoch
+        times = values.dropna()
+        if pd.api.types.is_datetime64tz_dtype(times.dtype):
+            times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+        if len(times):
+            counts, edges = np.histogram(times.to_numpy(dtype="datetime64[ns]").view(np.int64), bins=nbins)
+            edges = pd.to_datetime(edges.round().astype(np.int64)).strftime("%Y-%m-%dT%H:%M:%S.%f").tolist()
+        else:
+            counts, edges = np.array([], dtype=np.int64), []
+        hist_data = {"kind": "time_histogram", "counts": counts.tolist(), "edges": edges}
+    else:
+        counts = values.value_counts(sort=False)
+        if len(counts) > max_categories:
+            counts = counts.sort_values(ascending=False, kind="stable")
+            rest = counts.iloc[max_categories - 1 :].sum()
+            counts = counts.iloc[: max_categories - 1]
+            counts = pd.Series(counts.tolist() + [rest], index=[str(x) for x in counts.index] + ["Other"])
+        hist_data = {
+            "kind": "categories",
+            "labels": [str(x) for x in counts.index],
+            "values": [int(v) for v in counts],
+        }
+    hist_data["column"] = str(col)
+    return json.dumps(hist_data)
+
+
+@lru_cache(maxsize=1024)
+def histogram_figure_json(hist_data: str) -> str:
+    """
+    Plotly figure (as JSON) drawn from column_histogram_data's summary. Memoised, so each column's figure is only
+    built the first time it is viewed
+    """
+    hist_data: Dict = json.loads(hist_data)
+    if hist_data["kind"] == "histogram":
+        edges = np.asarray(hist_data["edges"])
+        fig = go.Figure(
+            go.Bar(
+                x=(edges[:-1] + edges[1:]) / 2,
+                y=hist_data["counts"],
+                width=np.diff(edges),
+            )
+        )
+        fig.update_layout(bargap=0, xaxis_title=hist_data["column"], yaxis_title="count")
+    elif hist_data["kind"] == "time_histogram":
+        edges = pd.to_datetime(hist_data["edges"])
+        fig = go.Figure(
+            go.Bar(
+                x=edges[:-1] + (edges[1:] - edges[:-1]) / 2,
+                y=hist_data["counts"],
+                # widths on a date axis are in milliseconds
+                width=(edges[1:] - edges[:-1]).total_seconds() * 1000,
+            )
+        )
+        fig.update_layout(bargap=0, xaxis_title=hist_data["column"], yaxis_title="count")
+    elif hist_data["kind"] == "categories":
+        fig = go.Figure(go.Bar(x=hist_data["labels"], y=hist_data["values"]))
+        fig.update_layout(xaxis_title=hist_data["column"], yaxis_title="count")
+    else:
+        fig = go.Figure(go.Bar(x=hist_data["labels"], y=hist_data["values"]))
+        fig.update_layout(xaxis_title="col_names", yaxis_title="value")
+    return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def add_histogram_json(column_view: str) -> str:
+    """
+    Swap the compact histogram data in a column view (JSON records from BasicProfile.get_result_for_column) for the
+    plotly figure the page draws
+    """
+    records = json.loads(column_view)
+    for record in records:
+        if "histogram_data" in record:
+            record["histogram_json"] = histogram_figure_json(record.pop("histogram_data"))
+    return json.dumps(records)
@@ -0,0 +1,183 @@
+import os
+import pickle
+import sqlite3
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple
+from .row_hashing import hash_rows
+
+
+class IncrementalStateStore(object):
+    """
+    Persistent store of the state of incrementally profiled metrics (see SQLDataSource's watermark_column): for each
+    metric over a table, the highest watermark value it has seen and its partial aggregates over the rows up to it.
+    Metrics counting rows by their hash (see DuplicateRows) keep those counts in a table of their own, a row per hash,
+    so a refresh only writes the hashes of the new rows rather than rewriting every hash seen. Backed by a SQLite
+    file, which is safe to share between the threads and processes calculating dashboards.
+
+    Parameters:
+        path (str):the SQLite database file (created if missing)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("pragma journal_mode=wal")
+            conn.execute(
+                "create table if not exists metric_state ("
+                "state_key text primary key, watermark blob not null, state blob not null)"
+            )
+            conn.execute(
+                "create table if not exists row_hash_counts ("
+                "state_key text not null, hash integer not null, count integer not null, "
+                "primary key (state_key, hash)) without rowid"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # sqlite3's own context manager commits but doesn't close the connection
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[Tuple[object, object]]:
+        """
+        Returns:
+            watermark:the highest watermark value included in the state
+            state:the metric's partial aggregates
+            (or None if nothing is stored under key)
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "select watermark, state from metric_state where state_key = ?", [key]
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), pickle.loads(row[1])
+
+    def put(self, key: str, watermark, state):
+        with self._connect() as conn:
+            self._put(conn, key, watermark, state)
+
+    @staticmethod
+    def _put(conn: sqlite3.Connection, key: str, watermark, state):
+        conn.execute(
+            "insert or replace into metric_state (state_key, watermark, state) values (?, ?, ?)",
+            [key, pickle.dumps(watermark, protocol=4), pickle.dumps(state, protocol=4)],
+        )
+
+    def add_hash_counts(
+        self, key: str, watermark, hashes: np.ndarray, counts: np.ndarray, reset: bool = False
+    ) -> Dict[str, int]:
+        """
+        Add the number of rows with each hash (see row_hash_counts) to those stored under key, and store the new
+        watermark along with the total number of rows and of distinct hashes, in one transaction. Only the given
+        hashes are read and written, so the time taken grows with them rather than with the hashes stored
+
+        Parameters:
+            key (str):the metric's state key
+            watermark:the highest watermark of the rows counted
+            hashes (np.ndarray):uint64 hash of each distinct new row
+            counts (np.ndarray):number of new rows with each hash
+            reset (bool):drop the counts stored under key first (eg as the table was reloaded)
+
+        Returns:
+            state (Dict[str, int]):"rows" and "distinct" (the number of distinct hashes) over every row counted, which
+                is also stored as the key's state
+        """
+        # stored as SQLite's signed 64 bit integers
+        rows = list(zip(hashes.astype(np.uint64).view(np.int64).tolist(), np.asarray(counts).tolist()))
+        with self._connect() as conn:
+            state = {"rows": 0, "distinct": 0}
+            if reset:
+                conn.execute("delete from row_hash_counts where state_key = ?", [key])
+            else:
+                stored = conn.execute("select state from metric_state where state_key = ?", [key]).fetchone()
+                if stored is not None:
+                    state = pickle.loads(stored[0])
+            new = conn.executemany(
+                "insert or ignore into row_hash_counts (state_key, hash, count) values (?, ?, 0)",
+                ([key, h] for h, _ in rows),
+            ).rowcount
+            conn.executemany(
+                "update row_hash_counts set count = count + ? where state_key = ? and hash = ?",
+                ([c, key, h] for h, c in rows),
+            )
+            state = {"rows": state["rows"] + int(np.sum(counts)), "distinct": state["distinct"] + new}
+            self._put(conn, key, watermark, state)
+        return state
+
+    def get_hash_counts(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Every hash stored under key (sorted) and its number of rows
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "select hash, count from row_hash_counts where state_key = ?", [key]
+            ).fetchall()
+        hashes = np.array([r[0] for r in rows], dtype=np.int64).view(np.uint64)
+        counts = np.array([r[1] for r in rows], dtype=np.int64)
+        order = np.argsort(hashes)
+        return hashes[order], counts[order]
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("delete from metric_state where state_key = ?", [key])
+            conn.execute("delete from row_hash_counts where state_key = ?", [key])
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("select count(*) from metric_state").fetchone()[0]
+
+
+def add_aggregates(state: Dict, partial: Dict) -> Dict:
+    """
+    Merge additive aggregates (counts and sums) of two sets of rows. A sum over no rows is null, so counts as 0
+    """
+    return {
+        name: (state.get(name) or 0) + (value or 0) for name, value in partial.items()
+    }
+
+
+def row_hash_counts(
+    chunks: Iterator[pd.DataFrame], numeric_columns: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Distinct rows of the chunks, as sorted 64 bit row hashes (see hash_rows) with the number of rows having each
+
+    Returns:
+        hashes (np.ndarray):uint64 hash of each distinct row
+        counts (np.ndarray):number of rows with each hash
+    """
+    hashes = [np.empty(0, dtype=np.uint64)]
+    for chunk in chunks:
+        hashes.append(hash_rows(chunk, numeric_columns))
+    return np.unique(np.concatenate(hashes), return_counts=True)
+
+
+def merge_hash_counts(
+    state: Tuple[np.ndarray, np.ndarray], partial: Tuple[np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row hash counts (see row_hash_counts) of two sets of rows combined. Both are sorted, so each new hash is found by
+    binary search and only the hashes not seen before are inserted
+    """
+    hashes, counts = state
+    new_hashes, new_counts = partial
+    positions = np.searchsorted(hashes, new_hashes)
+    found = positions < len(hashes)
+    found[found] = hashes[positions[found]] == new_hashes[found]
+    counts = counts.copy()
+    np.add.at(counts, positions[found], new_counts[found])
+    unseen = ~found
+    return (
+        np.insert(hashes, positions[unseen], new_hashes[unseen]),
+        np.insert(counts, positions[unseen], new_counts[unseen]),
+    )
@@ -0,0 +1,107 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .score_cache import ScoreCache
+
+# the model used by inference worker processes, set once per worker by the pool initializer (with fork it is inherited
+# rather than pickled)
+_worker_model = None
+
+
+def _set_worker_model(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _predict_proba_batch(batch: pd.Series) -> np.ndarray:
+    return _worker_model.predict_proba(batch)
+
+
+def batched_predict_proba(
+    model, inp: pd.Series, batch_size: int = 50000, n_jobs: int = 1
+) -> np.ndarray:
+    """
+    model.predict_proba over inp in batches of rows, so only one batch's features (eg a sparse bag-of-words matrix) are
+    held in memory at a time. With n_jobs > 1 the batches are scored in a pool of processes. Rows are scored
+    independently, so the result is the same as a single predict_proba call
+
+    Parameters:
+        model:fitted model or pipeline with a predict_proba method
+        inp (pd.Series):the model's input, one row per value
+        batch_size (int):rows scored at once (None for a single batch)
+        n_jobs (int):number of processes to score batches in
+
+    Returns:
+        np.ndarray:class probabilities, one row per input row
+    """
+    if batch_size is None or len(inp) <= batch_size:
+        batches = [inp]
+    else:
+        batches = [inp.iloc[i : i + batch_size] for i in range(0, len(inp), batch_size)]
+    if n_jobs == 1 or len(batches) == 1:
+        return np.concatenate([model.predict_proba(batch) for batch in batches])
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=context,
+        initializer=_set_worker_model,
+        initargs=(model,),
+    ) as pool:
+        return np.concatenate(list(pool.map(_predict_proba_batch, batches)))
+
+
+def normalise_text(inp: pd.Series) -> pd.Series:
+    """
+    Lower case with runs of whitespace collapsed. Doesn't change the score of lowercasing, word-level bag-of-words
+    models (such as the address and client note pipelines), so rows equal after normalising share a score
+    """
+    return inp.str.lower().str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def deduplicated_predict_proba(
+    model,
+    inp: pd.Series,
+    batch_size: int = 50000,
+    n_jobs: int = 1,
+    normalise: bool = True,
+    score_cache: ScoreCache = None,
+    model_hash: str = None,
+) -> np.ndarray:
+    """
+    As batched_predict_proba, but each distinct (normalised) text is scored once and its score broadcast back to every
+    row holding it. With a score cache, texts the model (identified by model_hash) scored in earlier runs are looked
+    up rather than scored, and new scores are added to the cache
+
+    Parameters:
+        model:fitted model or pipeline with a predict_proba method
+        inp (pd.Series):text to score
+        batch_size (int):distinct texts scored at once
+        n_jobs (int):number of processes to score batches in
+        normalise (bool):normalise text (see normalise_text) before deduplicating
+        score_cache (ScoreCache):persistent cache of earlier scores
+        model_hash (str):identifies the model in the score cache, eg a hash of its file
+
+    Returns:
+        np.ndarray:class probabilities, one row per input row
+    """
+    if not len(inp):
+        return batched_predict_proba(model, inp, batch_size, n_jobs)
+    keys = normalise_text(inp.astype(str)) if normalise else inp.astype(str)
+    codes, uniques = pd.factorize(keys)
+    uniques = pd.Series(uniques, dtype=object)
+    if score_cache is None:
+        return batched_predict_proba(model, uniques, batch_size, n_jobs)[codes]
+    if model_hash is None:
+        raise ValueError("A model hash is needed to use the score cache")
+    found, probas = score_cache.get_many(model_hash, uniques.tolist())
+    missing = uniques[~found]
+    if len(missing):
+        scores = batched_predict_proba(model, missing, batch_size, n_jobs)
+        score_cache.put_many(model_hash, missing.tolist(), scores)
+        for i, score in zip(np.flatnonzero(~found), scores):
+            probas[i] = score
+    return np.vstack(probas)[codes]
@@ -0,0 +1,265 @@
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where memory deltas aren't recorded
+    resource = None
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name: (type, help, histogram buckets)
+FAMILIES = {
+    "profiler_metric_calls_total": ("counter", "Metric calculations by outcome (ok, error or cached)", None),
+    "profiler_metric_duration_seconds": ("histogram", "Time taken to calculate a metric", SECONDS_BUCKETS),
+    "profiler_metric_rows_total": (
+        "counter",
+        "Rows read by metric calculations (for SQL, rows fetched). Passes shared by batched metrics are counted once, "
+        "under metric=\"batch\"",
+        None,
+    ),
+    "profiler_metric_cache_lookups_total": ("counter", "Metric result cache lookups by outcome", None),
+    "profiler_reader_loads_total": ("counter", "Tables loaded by tabular readers", None),
+    "profiler_reader_load_duration_seconds": ("histogram", "Time taken to load a table", SECONDS_BUCKETS),
+    "profiler_reader_rows_total": ("counter", "Rows loaded by tabular readers", None),
+    "profiler_sql_queries_total": ("counter", "SQL queries run, by outcome", None),
+    "profiler_sql_query_duration_seconds": (
+        "histogram",
+        "Time taken to run a SQL query and fetch its results",
+        SECONDS_BUCKETS,
+    ),
+    "profiler_sql_rows_fetched_total": ("counter", "Rows fetched by SQL queries", None),
+    "profiler_dashboard_duration_seconds": ("histogram", "Time taken to calculate a dashboard", SECONDS_BUCKETS),
+}
+
+# the measurements each span collects
+SPAN_FIELDS = ("rows", "queries", "query_seconds")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    The process's peak resident memory so far (None where the platform doesn't record it)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+    labels = labels + extra
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in labels
+    )
+    return "{" + ",".join('{0}="{1}"'.format(k, v) for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Instrumentation(object):
+    """
+    Process-wide counters and histograms of the work done calculating metrics: metric calls and their durations,
+    rows read, metric cache lookups, table loads and SQL queries. render() exposes them in the
+    Prometheus text format.
+
+    Work is also collected per call: a span (see span()) gathers the rows read and queries run by the thread that
+    opened it while it is open, giving each MetricRun its stats. Worker processes send their share back as a
+    diff() of snapshot()s, which the parent merge()s.
+
+    Memory isn't recorded per call: the process's peak resident memory only ever grows, so once one large calculation
+    has run every later call would report none
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+        if hasattr(os, "register_at_fork"):
+            # a child forked while another thread holds the lock would otherwise never get it
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            # counters: (name, labels) -> value; histograms: (name, labels) -> [bucket counts..., sum, count]
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = FAMILIES[name][2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            state = self.histograms.get(key)
+            if state is None:
+                state = self.histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: list(v) for k, v in self.histograms.items()},
+            }
+
+    def diff(self, before: Dict) -> Dict:
+        """
+        What has been recorded since the snapshot before was taken
+        """
+        now = self.snapshot()
+        counters = {}
+        for key, value in now["counters"].items():
+            change = value - before["counters"].get(key, 0)
+            if change:
+                counters[key] = change
+        histograms = {}
+        for key, state in now["histograms"].items():
+            previous = before["histograms"].get(key, [0] * len(state))
+            if state[-1] != previous[-1]:
+                histograms[key] = [a - b for a, b in zip(state, previous)]
+        return {"counters": counters, "histograms": histograms}
+
+    def merge(self, delta: Dict):
+        """
+        Add a diff (eg from a worker process) to the totals
+        """
+        with self._lock:
+            for key, value in delta["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, change in delta["histograms"].items():
+                state = self.histograms.get(key)
+                if state is None:
+                    self.histograms[key] = list(change)
+                else:
+                    self.histograms[key] = [a + b for a, b in zip(state, change)]
+
+    def render(self) -> str:
+        """
+        Every counter and histogram in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, (kind, description, buckets) in FAMILIES.items():
+            lines.append("# HELP {0} {1}".format(name, description))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            if kind == "counter":
+                for (family, labels), value in sorted(snapshot["counters"].items()):
+                    if family == name:
+                        lines.append(name + _format_labels(labels) + " " + _format_value(value))
+                continue
+            for (family, labels), state in sorted(snapshot["histograms"].items()):
+                if family != name:
+                    continue
+                for bound, count in zip(buckets + (math.inf,), state[:-2] + [state[-1]]):
+                    le = (("le", _format_value(bound)),)
+                    lines.append(name + "_bucket" + _format_labels(labels, le) + " " + str(count))
+                lines.append(name + "_sum" + _format_labels(labels) + " " + _format_value(state[-2]))
+                lines.append(name + "_count" + _format_labels(labels) + " " + str(state[-1]))
+        return "\n".join(lines) + "\n"
+
+    def _spans(self):
+        if not hasattr(self._local, "spans"):
+            self._local.spans = []
+        return self._local.spans
+
+    @contextmanager
+    def span(self) -> Iterator[Dict]:
+        """
+        Collect the work done in this thread while the span is open. Yields its stats, filled in as the span closes:
+        seconds, rows, queries and query_seconds
+        """
+        stats = dict.fromkeys(SPAN_FIELDS, 0)
+        spans = self._spans()
+        spans.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats["seconds"] = time.perf_counter() - start
+            spans.remove(stats)
+
+    def add(self, field: str, value: float):
+        """
+        Add to a measurement of every span open in this thread
+        """
+        for stats in self._spans():
+            stats[field] += value
+
+    @contextmanager
+    def metric_call(self, metric: str, source: str) -> Iterator[Dict]:
+        """
+        A span around a metric's calculation, recorded against the metric when it closes. Set its cache_hit to True
+        when the result came from the metric cache
+        """
+        status, stats = "error", None
+        try:
+            with self.span() as stats:
+                stats["cache_hit"] = False
+                yield stats
+                status = "ok"
+        finally:
+            # recorded once the span has closed and filled in its stats
+            if stats is not None:
+                self.record_metric(metric, source, "cached" if stats["cache_hit"] else status, stats)
+
+    def record_metric(self, metric: str, source: str, status: str, stats: Dict):
+        """
+        Record a metric's calculation from its stats (as collected by a span). A batched metric's rows are those of the
+        pass it shared, which is recorded once by record_batch
+        """
+        self.inc("profiler_metric_calls_total", metric=metric, source=source, status=status)
+        if status == "cached":
+            return
+        self.observe("profiler_metric_duration_seconds", stats["seconds"], metric=metric, source=source)
+        if stats.get("rows") and not stats.get("batched"):
+            self.inc("profiler_metric_rows_total", stats["rows"], metric=metric, source=source)
+
+    def record_batch(self, source: str, stats: Dict):
+        """
+        Record the rows read by one pass over a source shared by several batched metrics
+        """
+        if stats.get("rows"):
+            self.inc("profiler_metric_rows_total", stats["rows"], metric="batch", source=source)
+
+    def record_query(self, seconds: float, rows: int, status: str = "ok"):
+        self.inc("profiler_sql_queries_total", status=status)
+        self.observe("profiler_sql_query_duration_seconds", seconds)
+        self.inc("profiler_sql_rows_fetched_total", rows)
+        self.add("queries", 1)
+        self.add("query_seconds", seconds)
+        self.add("rows", rows)
+
+    def record_read(self, reader: str, seconds: float, rows: int):
+        self.inc("profiler_reader_loads_total", reader=reader)
+        self.observe("profiler_reader_load_duration_seconds", seconds, reader=reader)
+        self.inc("profiler_reader_rows_total", rows, reader=reader)
+
+
+instrumentation = Instrumentation()
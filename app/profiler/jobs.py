@@ -0,0 +1,186 @@
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from typing import Callable, Dict
+from .instrumentation import instrumentation
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _run_job(job_id: str, build_fn: Callable, args, kwargs, progress, cancelled, result_store):
+    """
+    Runs in a worker process: builds the dashboard, calculates it while reporting each finished metric and returns
+    the calculated dashboard to the parent (or, with a result store, saves it there and returns its id), along with
+    what the instrumentation recorded meanwhile
+    """
+    if cancelled.get(job_id):
+        raise JobCancelled(job_id)
+    before = instrumentation.snapshot()
+    dashboard = build_fn(*args, **kwargs)
+    completed = []
+    progress[job_id] = {"completed": completed, "total": len(dashboard.metrics)}
+
+    def report(run):
+        completed.append(type(run.metric).__name__)
+        # manager dicts only see assignments, not changes to the objects inside them
+        progress[job_id] = {"completed": completed, "total": len(dashboard.metrics)}
+        if cancelled.get(job_id):
+            raise JobCancelled(job_id)
+
+    dashboard.progress_callback = report
+    try:
+        dashboard.calculate_dashboard()
+    finally:
+        dashboard.progress_callback = None
+    if result_store is not None:
+        return [result_store.save(dashboard), instrumentation.diff(before)]
+    return [dashboard, instrumentation.diff(before)]
+
+
+class JobQueue(object):
+    """
+    Calculates dashboards in a pool of worker processes so slow profiles don't hold up web workers. A job is submitted
+    as a function that builds the dashboard (it must be importable by the workers, eg a module level function); the
+    queue returns a job id that can be polled for progress, cancelled, and used to fetch the calculated dashboard.
+
+    Cancelling a queued job stops it starting. A running job stops once the metric(s) in progress finish.
+
+    Parameters:
+        max_workers (int):number of dashboards calculated at the same time
+        result_store (DashboardResultStore):if given, workers save calculated dashboards here and a job's result is
+            the stored dashboard's id rather than the dashboard itself
+    """
+
+    def __init__(self, max_workers: int = 2, result_store=None):
+        self.max_workers = max_workers
+        self.result_store = result_store
+        self.futures = {}
+        self._pool = None
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # the pool and the manager process holding progress are only started once there is work
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self._manager = context.Manager()
+        self._progress = self._manager.dict()
+        self._cancelled = self._manager.dict()
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+
+    def submit(self, build_fn: Callable, *args, **kwargs) -> str:
+        """
+        Queue a dashboard build. build_fn(*args, **kwargs) must return an (uncalculated) Dashboard
+
+        Returns:
+            job_id (str):identifies the job in later calls
+        """
+        with self._lock:
+            if self._pool is None:
+                self._start()
+            job_id = uuid.uuid4().hex
+            future = self._pool.submit(
+                _run_job,
+                job_id,
+                build_fn,
+                args,
+                kwargs,
+                self._progress,
+                self._cancelled,
+                self.result_store,
+            )
+            self.futures[job_id] = future
+        # outside the lock: a job that has already finished calls back straight away
+        future.add_done_callback(self._merge_recorded)
+        return job_id
+
+    def _merge_recorded(self, future):
+        """
+        Merge what a finished job's worker recorded into this process's instrumentation, so /metrics covers the
+        workers' work. Called as the job finishes and again by result(), which may see it finish first
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        outcome = future.result()
+        with self._lock:
+            recorded, outcome[1] = outcome[1], None
+        if recorded is not None:
+            instrumentation.merge(recorded)
+
+    def _get_future(self, job_id: str):
+        if job_id not in self.futures:
+            raise KeyError("Unknown job " + str(job_id))
+        return self.futures[job_id]
+
+    def status(self, job_id: str) -> Dict:
+        """
+        Returns:
+            status (Dict):the job's state ("queued", "running", "done", "failed" or "cancelled"), the metrics completed
+                so far, the total number of metrics and, for failed jobs, the error message
+        """
+        future = self._get_future(job_id)
+        progress = self._progress.get(job_id, {"completed": [], "total": None})
+        status = {
+            "job_id": job_id,
+            "state": "queued",
+            "completed": list(progress["completed"]),
+            "total": progress["total"],
+            "error": None,
+        }
+        if future.cancelled():
+            status["state"] = "cancelled"
+        elif future.done():
+            error = future.exception()
+            if error is None:
+                status["state"] = "done"
+            elif isinstance(error, JobCancelled):
+                status["state"] = "cancelled"
+            else:
+                status["state"] = "failed"
+                status["error"] = str(error)
+        elif job_id in self._progress:
+            status["state"] = "running"
+        return status
+
+    def result(self, job_id: str, timeout: float = None):
+        """
+        The calculated dashboard (or its id in the result store), waiting up to timeout seconds (None to wait
+        indefinitely) for the job to finish. Raises the job's error if it failed and JobCancelled if it was cancelled
+        """
+        future = self._get_future(job_id)
+        try:
+            result = future.result(timeout)[0]
+        except CancelledError:
+            raise JobCancelled(job_id)
+        self._merge_recorded(future)
+        return result
+
+    def cancel(self, job_id: str):
+        future = self._get_future(job_id)
+        if not future.cancel():
+            self._cancelled[job_id] = True
+
+    def forget(self, job_id: str):
+        """
+        Drop a finished job and its progress
+        """
+        with self._lock:
+            self.futures.pop(job_id, None)
+            self._progress.pop(job_id, None)
+            self._cancelled.pop(job_id, None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                # queued jobs are cancelled by hand, as shutdown(cancel_futures=True) needs Python 3.9
+                for future in self.futures.values():
+                    future.cancel()
+                self._pool.shutdown(wait=True)
+                self._manager.shutdown()
+                self._pool = None
+                self._manager = None
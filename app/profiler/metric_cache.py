@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from .instrumentation import instrumentation
+
+
+class MetricResultCache(object):
+    """
+    Memoises metric results, keyed on (fingerprint of the data, metric class, resolved metric arguments), so calculating
+    a metric again over unchanged data returns the earlier result rather than recomputing it. Results are held pickled,
+    so each hit returns a fresh copy that callers are free to modify.
+
+    The in-process tier is an LRU bounded by number of entries and total bytes. The optional on-disk tier (one file per
+    result) is shared between processes, eg the job queue's workers, and is bounded by total bytes, evicting the least
+    recently used files. A disk hit is promoted into the in-process tier.
+
+    Parameters:
+        enabled (bool):when False, nothing is cached
+        max_entries (int):results held in process
+        max_bytes (int):total pickled size held in process
+        disk_dir (str):directory of the on-disk tier (None for no disk tier)
+        max_disk_bytes (int):total size the on-disk tier may grow to (None for no limit)
+    """
+
+    suffix = ".pkl"
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_entries: int = 256,
+        max_bytes: int = 256 * 1024 ** 2,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: Optional[int] = 1024 ** 3,
+    ):
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.configure(enabled, max_entries, max_bytes, disk_dir, max_disk_bytes)
+
+    def configure(
+        self,
+        enabled: bool = True,
+        max_entries: int = 256,
+        max_bytes: int = 256 * 1024 ** 2,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: Optional[int] = 1024 ** 3,
+    ):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+        with self._lock:
+            self._evict_memory()
+
+    @staticmethod
+    def make_key(fingerprint: str, metric_cls: type, metric_args: Dict) -> str:
+        # arguments that aren't JSON (eg a model object) are keyed on their repr
+        args = json.dumps(metric_args, sort_keys=True, default=repr)
+        name = metric_cls.__module__ + "." + metric_cls.__qualname__
+        return hashlib.sha256("\0".join([fingerprint, name, args]).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + self.suffix)
+
+    def _evict_memory(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, payload = self.entries.popitem(last=False)
+            self.bytes -= len(payload)
+
+    def _remember(self, key: str, payload: bytes):
+        if key in self.entries:
+            self.bytes -= len(self.entries.pop(key))
+        if len(payload) > self.max_bytes:
+            return
+        self.entries[key] = payload
+        self.bytes += len(payload)
+        self._evict_memory()
+
+    def get(self, key: str) -> Tuple[bool, object]:
+        """
+        Returns:
+            found (bool):whether a result is cached under key
+            result:the cached result (None if not found)
+        """
+        if not self.enabled:
+            return False, None
+        with self._lock:
+            payload = self.entries.get(key)
+            if payload is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                instrumentation.inc("profiler_metric_cache_lookups_total", result="hit")
+        if payload is None and self.disk_dir is not None:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    payload = f.read()
+                # keeps recently used files from being evicted first
+                os.utime(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+            if payload is not None:
+                with self._lock:
+                    self._remember(key, payload)
+                    self.disk_hits += 1
+                instrumentation.inc("profiler_metric_cache_lookups_total", result="disk_hit")
+        if payload is None:
+            with self._lock:
+                self.misses += 1
+            instrumentation.inc("profiler_metric_cache_lookups_total", result="miss")
+            return False, None
+        try:
+            return True, pickle.loads(payload)
+        except Exception as e:
+            # eg a truncated file or a result pickled by other code; recalculated rather than failing
+            logging.warning("Could not read cached metric result %s: %s", key, e)
+            self.delete(key)
+            return False, None
+
+    def put(self, key: str, result):
+        if not self.enabled:
+            return
+        try:
+            payload = pickle.dumps(result, protocol=4)
+        except Exception as e:
+            logging.warning("Could not cache metric result %s: %s", key, e)
+            return
+        with self._lock:
+            self._remember(key, payload)
+        if self.disk_dir is not None:
+            tmp_path = self._disk_path(key) + ".{0}.{1}.tmp".format(os.getpid(), threading.get_ident())
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, self._disk_path(key))
+            self.evict_disk()
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= len(self.entries.pop(key))
+        if self.disk_dir is not None:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def evict_disk(self):
+        if self.disk_dir is None or self.max_disk_bytes is None:
+            return
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self.entries = OrderedDict()
+            self.bytes = 0
+        if self.disk_dir is not None:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(self.suffix):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+# off until configured (see routes), so library users always calculate
+metric_cache = MetricResultCache(enabled=False)
@@ -1,16 +1,64 @@
 # from abc import ABC,abstractmethod
 import pandas as pd
 import os
-from .data_sources import InMemoryDataSource, SQLDataSource
+from .data_sources import InMemoryDataSource, SQLDataSource, StreamingDataSource
 from .sql_connectors import SQLViewConnector
+from .accumulators import (
+    MetricAccumulator,
+    TotalBlankCellsAccumulator,
+    TotalRowsColsAccumulator,
+    BasicProfileAccumulator,
+    ChunkResultsAccumulator,
+    GroupedZScoreAccumulator,
+    FormatValidationAccumulator,
+    DuplicateRowsAccumulator,
+)
+from .column_stats import fused_column_profile, ApproximateColumnProfile
+from .sql_planner import run_aggregate_metric
+from .rule_mining import RuleMiner
+from .pii_detection import PIIDetector
+from .group_stats import critical_value, clean_group_keys, group_moments, group_std, value_columns
+from .histograms import column_histogram_data, add_histogram_json
+from .model_registry import model_registry
+from .metric_cache import metric_cache
+from .instrumentation import instrumentation
+from .incremental import add_aggregates, row_hash_counts, merge_hash_counts
+from .row_hashing import RECORD
+from .inference import batched_predict_proba, deduplicated_predict_proba
+from .score_cache import ScoreCache
+from .format_validators import UK_POSTCODE_PATTERN, get_format_validator, ValidationSuite
 from sqlalchemy.sql import text
-from joblib import load
-from typing import Tuple, Callable, List
+from typing import Tuple, Callable, List, Dict, Optional, Union
+import inspect
 import numpy as np
 import re
 import json
-import plotly.express as px
-import plotly
+
+
+def predict_text_proba(
+    model_path: str,
+    inp: pd.Series,
+    batch_size: int,
+    n_jobs: int,
+    dedupe: Optional[bool],
+    score_cache_path: str = None,
+) -> np.ndarray:
+    # shared by the text classification metrics. Normalising text is only safe for models known to ignore case and
+    # whitespace, so unless asked for it is left to those
+    if dedupe is None:
+        dedupe = model_registry.normalises_text(model_path)
+    model = model_registry.get(model_path)
+    if not dedupe and score_cache_path is None:
+        return batched_predict_proba(model, inp, batch_size, n_jobs)
+    return deduplicated_predict_proba(
+        model,
+        inp,
+        batch_size,
+        n_jobs,
+        normalise=dedupe,
+        score_cache=None if score_cache_path is None else ScoreCache(score_cache_path),
+        model_hash=model_registry.get_hash(model_path),
+    )
 
 
 class Metric(object):
@@ -18,8 +66,27 @@ class Metric(object):
     Generic Metric class. Metric calculation is run when the metric is called and the result stored as an attribute.
     Once calculated, the result can be read rather than recalculated every time.
 
+    Metrics with aggregate_pushdown set provide sql_aggregates (name -> aggregate expression) and
+    finalize_sql_aggregates (values -> result) so a SQLAggregatePlanner can compute several of them in one table scan.
+
+    When the metric cache is enabled, results are memoised against the data source's fingerprint, the metric class and
+    the resolved arguments (and, for metrics with a model_path, the model file's mtime and size), so calling a metric
+    over unchanged data (even through a new data source) doesn't recalculate it.
+
+    Metrics with incremental set can be refreshed from just the rows appended to a SQL table since their last run (see
+    SQLDataSource's watermark_column): they provide partial aggregates of some rows (scan_increment, or
+    sql_aggregates for aggregate push-down metrics), a merge of two partial aggregates (merge_increment, applied and
+    persisted by store_increment) and the result from the merged aggregates (finalize_increment).
+
+    Every call is recorded by the instrumentation (time taken, rows read, queries run and whether the result was
+    cached) and its stats kept as last_call_stats.
+
     """
 
+    aggregate_pushdown = False
+    incremental = False
+    last_call_stats = None
+
     def __init__(self, data_source, metric_args={}):
         self.data_source = data_source
         self.metric_args = metric_args
@@ -41,19 +108,138 @@ class Metric(object):
         if kwargs:
             for k, v in kwargs.items():
                 metric_args[k] = v
-        if isinstance(self.data_source, InMemoryDataSource):
-            self.result = self.data_source.run_metric(
-                self.calculate_in_mem, **metric_args
-            )
-        elif isinstance(self.data_source, SQLDataSource):
-            self.result = self.data_source.run_metric(
-                self.calculate_sql_tbl, **metric_args
-            )
-        return self.result
+        with instrumentation.metric_call(
+            type(self).__name__, type(self.data_source).__name__
+        ) as stats:
+            # kept for the MetricRun (see executors), filled in once the call finishes
+            self.last_call_stats = stats
+            cache_key = self.cache_key(metric_args)
+            if cache_key is not None:
+                found, result = metric_cache.get(cache_key)
+                if found:
+                    stats["cache_hit"] = True
+                    self.result = result
+                    return self.result
+            if isinstance(self.data_source, InMemoryDataSource):
+                self.data_source.require_columns(
+                    self.get_required_columns(**self.resolve_args(metric_args))
+                )
+                self.result = self.data_source.run_metric(
+                    self.calculate_in_mem, **metric_args
+                )
+            elif isinstance(self.data_source, SQLDataSource):
+                if self.data_source.is_incremental(self):
+                    run = self.data_source.run_incremental([self], [metric_args])[0]
+                    if not run.succeeded:
+                        raise run.error
+                    self.result = run.result
+                else:
+                    self.result = self.data_source.run_metric(
+                        self.calculate_sql_tbl, **metric_args
+                    )
+            elif isinstance(self.data_source, StreamingDataSource):
+                self.result = self.data_source.run_metric(
+                    self.calculate_streaming, **metric_args
+                )
+            if cache_key is not None:
+                metric_cache.put(cache_key, self.result)
+            return self.result
+
+    def cache_key(self, metric_args: Dict = None) -> Optional[str]:
+        """
+        Key of the metric's result in the metric cache given its arguments: the data source's fingerprint, the metric
+        class and the resolved arguments. None when caching is off or the data can't be fingerprinted
+        """
+        if not metric_cache.enabled:
+            return None
+        fingerprint = self.data_source.fingerprint()
+        if fingerprint is None:
+            return None
+        args = self.resolve_args(metric_args)
+        if args.get("model_path") is not None:
+            # a model retrained and saved to the same path gives different results
+            try:
+                args["model_stamp"] = list(model_registry.stamp(args["model_path"]))
+            except OSError:
+                return None
+        return metric_cache.make_key(fingerprint, type(self), args)
+
+    def resolve_args(self, metric_args: Dict = None) -> Dict:
+        """
+        The full set of arguments calculate_in_mem would be called with, ie metric_args plus defaults for the rest
+        """
+        metric_args = self.metric_args if metric_args is None else metric_args
+        params = list(inspect.signature(self.calculate_in_mem).parameters.values())[1:]
+        resolved = {
+            p.name: p.default for p in params if p.default is not inspect.Parameter.empty
+        }
+        resolved.update(metric_args)
+        return resolved
+
+    @classmethod
+    def get_required_columns(cls, **kwargs) -> Optional[List[str]]:
+        """
+        Columns calculate_in_mem reads given its (resolved) arguments, so in-memory sources only need to load those.
+        None means every column
+        """
+        return None
+
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        """
+        Return an accumulator (init/update/merge/finalize) so the metric can be calculated over a stream of chunks.
+        Override in metrics that support streaming data sources
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def calculate_streaming(cls, chunks, **kwargs):
+        accumulator = cls.create_accumulator(**kwargs)
+        for chunk in chunks:
+            accumulator.update(chunk)
+        return accumulator.finalize()
+
+    @classmethod
+    def scan_increment(
+        cls, sql_view_connector: SQLViewConnector, where: str, params: Dict, **kwargs
+    ):
+        """
+        Partial aggregates of the rows matching where. Override in incremental metrics that aren't aggregate
+        push-down (those get their sql_aggregates over the rows instead)
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def merge_increment(cls, state, partial):
+        """
+        Partial aggregates of two sets of rows combined. By default sql_aggregates are added, so only suits counts
+        and sums
+        """
+        return add_aggregates(state, partial)
+
+    @classmethod
+    def store_increment(cls, state_store, key: str, watermark, state, partial):
+        """
+        Merge the partial aggregates of the new rows into the state (None before any rows) and store the result with
+        the new watermark, returning it. Override where the state is better stored a piece at a time
+        """
+        state = partial if state is None else cls.merge_increment(state, partial)
+        state_store.put(key, watermark, state)
+        return state
+
+    @classmethod
+    def finalize_increment(cls, state, sql_view_connector: SQLViewConnector, **kwargs):
+        return cls.finalize_sql_aggregates(state, sql_view_connector, **kwargs)
 
     def get_label(self):
         return self.label
 
+    def get_headline_result(self):
+        """
+        The result as shown in the dashboard's headline metrics
+        """
+        return self.get_result()
+
     def get_icon(self):
         return self.icon or None
 
@@ -67,98 +253,109 @@ class BasicProfile(Metric):
 
     Parameters:
         inp (pd.DataFrame):input data
-        incl_graph (bool):whether a matplotlib graph should also be drawn
+        incl_graph (bool):whether histogram data should be kept for each column's graph
+        approximate (bool):use HyperLogLog distinct counts and KLL quartiles (bounded memory) instead of exact values.
+            Adds "14. Distinct Count Error" and "15. Quantile Rank Error" columns
+        sketch_k (int):KLL accuracy parameter used when approximate
+        hll_precision (int):HyperLogLog precision used when approximate
 
     Returns:
         pd.DataFrame
     """
 
     label = "Basic Profile"
+    aggregate_pushdown = True
 
     def __init__(self, data_source, metric_args={}):
         super().__init__(data_source, metric_args)
 
     @staticmethod
-    def calculate_in_mem(inp: pd.DataFrame, incl_graph=True) -> pd.DataFrame:
-        def graph_select(row, inp):
-            if row["02. Data Type"] == "object" and row["06. No. Unique Values"] > 50:
-                bar_chart_df = row[
-                    [
-                        "04. Nulls",
-                        "05. Non-Nulls",
-                        "03. Row Count",
-                        "06. No. Unique Values",
-                    ]
-                ]
-                bar_chart_data = pd.DataFrame(
-                    data=bar_chart_df.astype("str").values, columns=["value"]
-                )
-                bar_chart_data["col_names"] = [
-                    "Null Values",
-                    "Total Non-Null Values",
-                    "Total Values inc. Nulls",
-                    "Distinct Values",
-                ]
-                fig = px.bar(bar_chart_data, x="col_names", y="value")
-                return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            else:
-                return json.dumps(
-                    px.histogram(inp, x=row["01. Column Name"], nbins=75),
-                    cls=plotly.utils.PlotlyJSONEncoder,
-                )
-
-        profile = pd.DataFrame(data=inp.columns, columns=["01. Column Name"])
-        profile["02. Data Type"] = inp.dtypes.values
-        profile["04. Nulls"] = inp.isna().sum().values
-        profile["05. Non-Nulls"] = inp.count().values
-        profile["03. Row Count"] = inp.shape[0]
-        profile["06. No. Unique Values"] = inp.nunique().values
-        numeric_cols = inp.select_dtypes(include=["number"])
-        try:
-            stats = numeric_cols.describe()
-            profile = profile.merge(
-                stats.T, how="left", left_on="01. Column Name", right_index=True
-            )
-            profile = profile.rename(
-                columns={
-                    "mean": "07. Average Value",
-                    "std": "08. Standard Deviation",
-                    "min": "09. Minimum",
-                    "max": "10. Maximum",
-                    "25%": "11. 25%",
-                    "50%": "12. 50%",
-                    "75%": "13. 75%",
-                }
+    def calculate_in_mem(
+        inp: pd.DataFrame,
+        incl_graph=True,
+        approximate: bool = False,
+        sketch_k: int = 200,
+        hll_precision: int = 14,
+    ) -> pd.DataFrame:
+        if approximate:
+            profile = (
+                ApproximateColumnProfile(sketch_k, hll_precision).update(inp).finalize()
             )
-        except ValueError:
-            pass
+        else:
+            profile = fused_column_profile(inp)
         if incl_graph:
-            #            profile['histogram_json'] = profile['01. Column Name'].apply(lambda col: json.dumps(px.histogram(inp, x=col, nbins=20), cls=plotly.utils.PlotlyJSONEncoder))
-            profile["histogram_json"] = profile.apply(
-                lambda x: graph_select(x, inp), axis=1
+            # only bin counts are kept here; figures are drawn when a column is viewed (see get_result_for_column)
+            profile["histogram_data"] = profile.apply(
+                lambda row: column_histogram_data(inp[row["01. Column Name"]], row), axis=1
             )
         ordered_cols = profile.columns.sort_values()
         profile = profile[ordered_cols]
         return profile
 
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return BasicProfileAccumulator(**kwargs)
+
     @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
-        if (
-            sql_view_connector.table_name is not None
-        ):  # this will be None if custom sql option is chosen
-            column_info_query = text(
-                """select * from  information_schema.columns where table_schema = :db_name and table_name = :table"""
-            )
-            column_info_params = {
-                "db_name": sql_view_connector.sql_connector.db_creds["dbname"],
-                "table": sql_view_connector.table_name,
+    def sql_aggregates(
+        sql_view_connector: SQLViewConnector, **kwargs
+    ) -> Dict[Tuple[str, str], str]:
+        conn = sql_view_connector.sql_connector
+        numeric_cols = set(sql_view_connector.get_numeric_columns())
+        aggregates = {("", "rows"): "count(*)"}
+        for col in sql_view_connector.column_names:
+            q = conn.quote(col)
+            aggregates[(col, "count")] = "count({0})".format(q)
+            aggregates[(col, "distinct")] = "count(distinct {0})".format(q)
+            if col in numeric_cols:
+                aggregates[(col, "sum")] = "sum({0})".format(q)
+                aggregates[(col, "min")] = "min({0})".format(q)
+                aggregates[(col, "max")] = "max({0})".format(q)
+                aggregates[(col, "var")] = conn.variance_expr(q)
+        return aggregates
+
+    @staticmethod
+    def finalize_sql_aggregates(
+        values: Dict, sql_view_connector: SQLViewConnector, **kwargs
+    ) -> pd.DataFrame:
+        column_types = sql_view_connector.get_column_types()
+        numeric_cols = set(sql_view_connector.get_numeric_columns())
+        rows = int(values[("", "rows")])
+        profile = []
+        for col in sql_view_connector.column_names:
+            count = int(values[(col, "count")])
+            col_profile = {
+                "01. Column Name": col,
+                "02. Data Type": column_types.get(col),
+                "03. Row Count": rows,
+                "04. Nulls": rows - count,
+                "05. Non-Nulls": count,
+                "06. No. Unique Values": int(values[(col, "distinct")]),
             }
-            info_schema_results = sql_view_connector.sql_connector.run_query(
-                column_info_query, column_info_params
-            )
-            return info_schema_results
-        else:
-            raise NotImplementedError
+            if col in numeric_cols:
+                var = values[(col, "var")]
+                col_profile["count"] = float(count)
+                col_profile["07. Average Value"] = (
+                    float(values[(col, "sum")]) / count if count else np.nan
+                )
+                col_profile["08. Standard Deviation"] = (
+                    np.sqrt(max(float(var), 0.0)) if var is not None and not pd.isna(var) else np.nan
+                )
+                col_profile["09. Minimum"] = values[(col, "min")]
+                col_profile["10. Maximum"] = values[(col, "max")]
+            profile.append(col_profile)
+        profile = pd.DataFrame(profile)
+        # quartiles have no portable SQL aggregate; they are left blank rather than costing a sort per column
+        if numeric_cols:
+            for name in ["11. 25%", "12. 50%", "13. 75%"]:
+                profile[name] = np.nan
+        return profile[profile.columns.sort_values()]
+
+    @classmethod
+    def calculate_sql_tbl(
+        cls, sql_view_connector: SQLViewConnector, **kwargs
+    ) -> pd.DataFrame:
+        return run_aggregate_metric(cls, sql_view_connector)
 
     @staticmethod
     def calculate_sql_db(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
@@ -167,21 +364,24 @@ class BasicProfile(Metric):
         """
         raise NotImplementedError
 
-    def get_result_for_column(self, col_name, round_dec=2):
+    def get_result_for_column(self, col_name, round_dec=2, incl_graph=True):
+        """
+        The column's profile as JSON records. With incl_graph its plotly figure is drawn (once per column, see
+        histogram_figure_json) into "histogram_json"; otherwise the compact "histogram_data" is returned as is
+        """
         result = self.get_result()
+        result = result.loc[result["01. Column Name"] == col_name].copy()
         result[result.select_dtypes(include=["number"]).columns] = result.select_dtypes(
             include=["number"]
         ).round(round_dec)
-        result = (
-            result.loc[result["01. Column Name"] == col_name]
-            .dropna(axis=1)
-            .to_json(orient="records")
-        )
+        result = result.dropna(axis=1).to_json(orient="records")
+        if incl_graph:
+            result = add_histogram_json(result)
         return result
 
     def get_tabular_view(self, round_dec=2):
         result = self.get_result()
-        result = result.loc[:, result.columns != "histogram_json"]
+        result = result.loc[:, ~result.columns.isin(["histogram_data", "histogram_json"])]
         result[result.select_dtypes(include=["number"]).columns] = result.select_dtypes(
             include=["number"]
         ).round(round_dec)
@@ -205,6 +405,8 @@ class BasicProfile(Metric):
 
 class TotalBlankCells(Metric):
     label = "Total Blank Cells"
+    aggregate_pushdown = True
+    incremental = True
     icon = "fa-question"
     colour = "text-danger"
 
@@ -221,42 +423,50 @@ class TotalBlankCells(Metric):
             col_count = len(inp.columns)
             return round(total_blank_cells / (row_count * col_count), dp)
 
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return TotalBlankCellsAccumulator(**kwargs)
+
     @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector, pc: bool = True):
-        def create_tot_blank_cell_query(
-            column_names: List[str], db_name: str, tbl_name: str
-        ) -> str:
-            query = "select "
-            for col in column_names:
-                q = (
-                    "sum(case when "
-                    + col
-                    + " is null or "
-                    + col
-                    + " = '' then 1 else 0 end) +"
+    def sql_aggregates(
+        sql_view_connector: SQLViewConnector, **kwargs
+    ) -> Dict[str, str]:
+        conn = sql_view_connector.sql_connector
+        numeric_cols = set(sql_view_connector.get_numeric_columns())
+        blanks = []
+        for col in sql_view_connector.column_names:
+            q = conn.quote(col)
+            if col in numeric_cols:
+                blanks.append("sum(case when {0} is null then 1 else 0 end)".format(q))
+            else:
+                blanks.append(
+                    "sum(case when {0} is null or {0} = '' then 1 else 0 end)".format(q)
                 )
-                query += q
-            query = query[:-1] + " as total_blanks"
-            query += " from " + db_name + "." + tbl_name
-            return text(query)
-
-        if (
-            sql_view_connector.table_name is not None
-        ):  # this will be None if custom sql option is chosen
-            query = create_tot_blank_cell_query(
-                sql_view_connector.column_names,
-                sql_view_connector.sql_connector.db_creds["dbname"],
-                sql_view_connector.table_name,
-            )
-            results = sql_view_connector.sql_connector.run_query(query)
-            # TODO add in pc flag
-            return results
-        else:
-            raise NotImplementedError
+        return {"blanks": " + ".join(blanks), "rows": "count(*)"}
+
+    @staticmethod
+    def finalize_sql_aggregates(
+        values: Dict,
+        sql_view_connector: SQLViewConnector,
+        pc: bool = True,
+        dp: int = 2,
+    ):
+        total_blank_cells = np.int64(values["blanks"] or 0)
+        if not pc:
+            return total_blank_cells
+        row_count = int(values["rows"])
+        col_count = len(sql_view_connector.column_names)
+        return round(total_blank_cells / (row_count * col_count), dp)
+
+    @classmethod
+    def calculate_sql_tbl(cls, sql_view_connector: SQLViewConnector, **kwargs):
+        return run_aggregate_metric(cls, sql_view_connector, **kwargs)
 
 
 class TotalRowsCols(Metric):
     label = ["Total Rows", "Total Columns"]
+    aggregate_pushdown = True
+    incremental = True
     icon = ["fa-table", "fa-columns"]
     colour = ["text-success", "text-info"]
 
@@ -267,24 +477,49 @@ class TotalRowsCols(Metric):
     def calculate_in_mem(inp: pd.DataFrame) -> Tuple[int, int]:
         return len(inp), len(inp.columns)
 
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return TotalRowsColsAccumulator(**kwargs)
+
     @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> Tuple[int, int]:
-        if (
-            sql_view_connector.table_name is not None
-        ):  # this will be None if custom sql option is chosen
-            query = text(
-                """select count(*) from """
-                + sql_view_connector.sql_connector.db_creds["dbname"]
-                + "."
-                + sql_view_connector.table_name
-            )
-            results = sql_view_connector.sql_connector.run_query(query)
-            return results.iat[0, 0], len(sql_view_connector.column_names)
-        else:
-            raise NotImplementedError
+    def sql_aggregates(
+        sql_view_connector: SQLViewConnector, **kwargs
+    ) -> Dict[str, str]:
+        return {"rows": "count(*)"}
+
+    @staticmethod
+    def finalize_sql_aggregates(
+        values: Dict, sql_view_connector: SQLViewConnector, **kwargs
+    ) -> Tuple[int, int]:
+        return values["rows"], len(sql_view_connector.column_names)
+
+    @classmethod
+    def calculate_sql_tbl(
+        cls, sql_view_connector: SQLViewConnector, **kwargs
+    ) -> Tuple[int, int]:
+        return run_aggregate_metric(cls, sql_view_connector)
 
 
 class DuplicateRows(Metric):
+    """
+    Counts the rows that repeat an earlier row (or just its subset columns), from vectorised 64 bit hashes of the rows
+    (see hash_rows). Optionally returns the groups of repeated rows instead.
+
+    Parameters:
+        inp (pd.DataFrame):input data
+        subset (List[str]):columns identifying a row (None for all of them)
+        return_groups (bool):return each group of rows sharing the same values, rather than the count of duplicates
+        max_memory_bytes (int):memory the row hashes may take; beyond it they are spilled to disk in partitions (see
+            HashCounter) so very large tables are checked within a fixed budget (None for no limit)
+        spill_dir (str):directory for spilled hashes (None for the system's temporary directory)
+
+    Returns:
+        np.int64:number of rows repeating an earlier row, or with return_groups
+        pd.DataFrame:the subset columns of each group's first row (indexed as in the input) and the group_size, largest
+            first. Streaming sources keep no row values, so give just the group_size indexed by the first row's
+            position, and SQL tables have no row order, so give no first row
+    """
+
     label = "Duplicate Rows"
     icon = "fa-clone"
     colour = "text-warning"
@@ -292,41 +527,101 @@ class DuplicateRows(Metric):
     def __init__(self, data_source, metric_args={}):
         super().__init__(data_source, metric_args)
 
+    @property
+    def incremental(self) -> bool:
+        # the stored row hashes can't give back the values of each group
+        return not self.resolve_args().get("return_groups")
+
     @staticmethod
-    def calculate_in_mem(inp: pd.DataFrame) -> np.int64:
-        return inp.duplicated().sum()
+    def calculate_in_mem(
+        inp: pd.DataFrame,
+        subset: List[str] = None,
+        return_groups: bool = False,
+        max_memory_bytes: int = None,
+        spill_dir: str = None,
+    ) -> Union[np.int64, pd.DataFrame]:
+        accumulator = DuplicateRowsAccumulator(subset, return_groups, max_memory_bytes, spill_dir)
+        # within a budget the rows are hashed a slice at a time, so the hashes of every row are never held at once
+        step = len(inp) if max_memory_bytes is None else max_memory_bytes // (4 * RECORD.itemsize)
+        step = max(step, 1)
+        for start in range(0, len(inp), step):
+            accumulator.update(inp.iloc[start : start + step])
+        result = accumulator.finalize()
+        if not return_groups:
+            return result
+        keys = inp if subset is None else inp[subset]
+        groups = keys.iloc[result.index.to_numpy()].copy()
+        groups["group_size"] = result["group_size"].to_numpy()
+        return groups
+
+    @classmethod
+    def get_required_columns(cls, subset: List[str] = None, **kwargs) -> Optional[List[str]]:
+        return None if subset is None else list(subset)
+
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return DuplicateRowsAccumulator(**kwargs)
 
     @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> np.int64:
-        def create_duplicate_rows_query(column_names, db_name, table_name):
-            query = "select count(*) from (select "
-            groupby = " group by "
-            for col in column_names:
-                query += col + ","
-                groupby += col + ","
-            query = (
-                query[:-1]
-                + " from "
-                + db_name
-                + "."
-                + table_name
-                + groupby[:-1]
-                + " having count(*) > 1) as t"
-            )
-            return text(query)
-
-        if (
-            sql_view_connector.table_name is not None
-        ):  # this will be None if custom sql option is chosen
-            query = create_duplicate_rows_query(
-                sql_view_connector.column_names,
-                sql_view_connector.sql_connector.db_creds["dbname"],
-                sql_view_connector.table_name,
+    def calculate_sql_tbl(
+        sql_view_connector: SQLViewConnector,
+        subset: List[str] = None,
+        return_groups: bool = False,
+        **kwargs
+    ) -> Union[np.int64, pd.DataFrame]:
+        # grouped by the database, so needs no memory budget
+        conn = sql_view_connector.sql_connector
+        columns = ", ".join(conn.quote(col) for col in (subset or sql_view_connector.column_names))
+        groups_query = "select {0}, count(*) as group_size from {1} group by {0} having count(*) > 1".format(
+            columns, sql_view_connector.get_from_clause()
+        )
+        if return_groups:
+            return conn.run_query(
+                text(groups_query + " order by group_size desc"), sql_view_connector.main_query_params
             )
-            results = sql_view_connector.sql_connector.run_query(query)
-            return results.iat[0, 0]
-        else:
-            raise NotImplementedError
+        results = conn.run_query(
+            text("select coalesce(sum(group_size - 1), 0) from (" + groups_query + ") as t"),
+            sql_view_connector.main_query_params,
+        )
+        return np.int64(results.iat[0, 0])
+
+    @classmethod
+    def scan_increment(
+        cls,
+        sql_view_connector: SQLViewConnector,
+        where: str,
+        params: Dict,
+        subset: List[str] = None,
+        **kwargs
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # the hash of each distinct new row and its number of rows, so rows can be matched with earlier ones
+        conn = sql_view_connector.sql_connector
+        query = text(
+            "select "
+            + ", ".join(conn.quote(col) for col in (subset or sql_view_connector.column_names))
+            + " from "
+            + sql_view_connector.get_from_clause()
+            + " where "
+            + where
+        )
+        return row_hash_counts(
+            conn.iter_query(query, params=params), sql_view_connector.get_numeric_columns()
+        )
+
+    @classmethod
+    def merge_increment(cls, state, partial):
+        return merge_hash_counts(state, partial)
+
+    @classmethod
+    def store_increment(cls, state_store, key: str, watermark, state, partial):
+        # the counts of every hash seen are kept in the store a row per hash, so only the new rows' hashes are written
+        # and the state is just the number of rows and of distinct rows
+        return state_store.add_hash_counts(key, watermark, partial[0], partial[1], reset=state is None)
+
+    @classmethod
+    def finalize_increment(cls, state, sql_view_connector: SQLViewConnector, **kwargs) -> np.int64:
+        # as calculate_sql_tbl, the number of rows repeating an earlier one
+        return np.int64(state["rows"] - state["distinct"])
 
 
 class DetectBadAddress(Metric):
@@ -337,6 +632,13 @@ class DetectBadAddress(Metric):
        inp (pd.DataFrame):input data (including but not limited to id and address columns)
        id_col (int):index of id column
        address_col (List[str]): list of column names to be concatenated to form an address (eg line 1, line 2, city might be [2,3,4]). They will be concatenated in the order provided
+       batch_size (int):rows scored by the model at once, bounding the memory used by its features
+       n_jobs (int):number of processes scoring batches in parallel
+       dedupe (bool):score each distinct address once (after lower casing and collapsing whitespace, which the
+           model must ignore) and copy the score to every row with that address. None (the default) dedupes only
+           for the bundled models known to ignore them (see ModelRegistry.normalises_text)
+       score_cache_path (str):SQLite file of scores from earlier runs, so addresses already scored by this model
+           aren't scored again (None to not use one)
 
     Returns:
         pd.DataFrame:ID Column and address validity score
@@ -353,8 +655,11 @@ class DetectBadAddress(Metric):
         id_col: str = "id",
         address_col: List[str] = ["addr", "city"],
         model_path: str = r"app/models/bow_model_pipeline_v2.joblib",
+        batch_size: int = 50000,
+        n_jobs: int = 1,
+        dedupe: Optional[bool] = None,
+        score_cache_path: str = None,
     ) -> pd.DataFrame:
-        model = load(model_path)
         addr = pd.DataFrame(data=inp[id_col], columns=[id_col])
         addr["addr"] = ""
         for col in address_col[:-1]:
@@ -364,7 +669,9 @@ class DetectBadAddress(Metric):
         addr["addr"] = addr["addr"].apply(
             lambda x: re.sub(r"[^\x00-\x7F]+", "", str(x))
         )
-        preds = model.predict_proba(addr["addr"])
+        preds = predict_text_proba(
+            model_path, addr["addr"], batch_size, n_jobs, dedupe, score_cache_path
+        )
         # preds = model.predict(addresses.values)
         addr["Validity Score"] = preds[:, 1]
         addr = addr.sort_values("Validity Score")
@@ -373,6 +680,12 @@ class DetectBadAddress(Metric):
         addr.to_pickle("addr.pkl", protocol=4)
         return addr
 
+    @classmethod
+    def get_required_columns(
+        cls, id_col: str = "id", address_col: List[str] = ["addr", "city"], **kwargs
+    ) -> Optional[List[str]]:
+        return [id_col, *address_col]
+
     @staticmethod
     def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> np.int64:
         raise NotImplementedError
@@ -390,15 +703,22 @@ class ClassifyClientNotes(Metric):
         id_col: str = "id",
         notes_col: str = "client_notes",
         model_path: str = r"app/models/notification_model.joblib",
+        batch_size: int = 50000,
+        n_jobs: int = 1,
+        dedupe: Optional[bool] = None,
+        score_cache_path: str = None,
     ) -> pd.DataFrame:
         """
-        Segments notes from a free text field based on whether they indicate notification of death or not
+        Segments notes from a free text field based on whether they indicate notification of death or not. Notes are
+        scored in batches of batch_size rows, across n_jobs processes. As for DetectBadAddress, dedupe scores each
+        distinct note once (by default only for the bundled model) and score_cache_path keeps scores between runs
 
         """
-        model = load(model_path)
         df = pd.DataFrame(data=inp[[id_col, notes_col]], columns=[id_col, notes_col])
         df[notes_col] = df[notes_col].fillna("")
-        preds = model.predict_proba(df[notes_col])
+        preds = predict_text_proba(
+            model_path, df[notes_col], batch_size, n_jobs, dedupe, score_cache_path
+        )
         df["Confidence Score"] = preds[:, 1]
         df = df.sort_values("Confidence Score")
         df["Confidence Score"] = df["Confidence Score"].round(2)
@@ -408,12 +728,34 @@ class ClassifyClientNotes(Metric):
         df.to_pickle("client_notes.pkl", protocol=4)
         return df
 
+    @classmethod
+    def get_required_columns(
+        cls, id_col: str = "id", notes_col: str = "client_notes", **kwargs
+    ) -> Optional[List[str]]:
+        return [id_col, notes_col]
+
     @staticmethod
     def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> np.int64:
         raise NotImplementedError
 
 
 class ExtractPIIAttributes(Metric):
+    """
+    Finds the columns holding personal data (emails, phone numbers, postcodes, NI numbers, card numbers, names, dates
+    of birth and addresses) from their names and the format of a stratified sample of their values (see
+    pii_detection.PIIDetector)
+
+    Parameters:
+        inp (pd.DataFrame):input data
+        sample_size (int):rows sampled from larger tables; columns the sample can't decide are scanned in full
+        n_strata (int):number of blocks of rows the sample is drawn from
+        min_match_rate (float):share of values that must have a type's format
+        name_match_rate (float):share of values that must have the format when the column name suggests the type
+
+    Returns:
+        pd.DataFrame:one row per column with its PII type (None if it holds none)
+    """
+
     label = "PII Attributes"
     icon = "fa-user-secret"
     colour = "text-primary"
@@ -422,9 +764,24 @@ class ExtractPIIAttributes(Metric):
         super().__init__(data_source, metric_args)
 
     @staticmethod
-    def calculate_in_mem(inp: pd.DataFrame) -> pd.DataFrame:
-        # TODO Implement this - Illustrative for now
-        return "10/21"
+    def calculate_in_mem(
+        inp: pd.DataFrame,
+        sample_size: int = 10000,
+        n_strata: int = 10,
+        min_match_rate: float = 0.8,
+        name_match_rate: float = 0.5,
+    ) -> pd.DataFrame:
+        detector = PIIDetector(
+            sample_size=sample_size,
+            n_strata=n_strata,
+            min_match_rate=min_match_rate,
+            name_match_rate=name_match_rate,
+        )
+        return detector.detect(inp)
+
+    def get_headline_result(self):
+        result = self.get_result()
+        return "{0}/{1}".format(int(result["PII Type"].notna().sum()), len(result))
 
     @staticmethod
     def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
@@ -432,28 +789,45 @@ class ExtractPIIAttributes(Metric):
 
 
 class ExtractDataRules(Metric):
+    """
+    Extracts rules the data follows: unique columns, null ratios, value domains and ranges, plus association rules
+    between categorical values and columns that imply one another (see rule_mining.RuleMiner)
+
+    Parameters:
+        inp (pd.DataFrame):input data
+        min_support (float):share of rows a combination of values must occur in to give an association rule
+        min_confidence (float):lowest confidence of an association rule
+        sample_rows (int):association rules are mined from a random sample of this many rows (None for all rows)
+        time_budget (float):seconds allowed for association rule mining (None for no limit)
+        miner_args:any other RuleMiner arguments
+
+    Returns:
+        rules (List[str]):column rules
+        ai_rules (List[str]):association and dependency rules
+    """
+
     label = "Extract Data Rules"
 
     def __init__(self, data_source, metric_args={}):
         super().__init__(data_source, metric_args)
 
     @staticmethod
-    def calculate_in_mem(inp: pd.DataFrame) -> pd.DataFrame:
-        # TODO Implement this
-        rules = [
-            '"user_id" is unique',
-            '"Email_Address" is unique',
-            '"product_start_date" contains 94.9% null values',
-            '"dob" can be transformed to exactly match "cleaned_dob" with the following transformation: "Remove elements 2 & 5"',
-            '"gender" takes the values ("M","F")',
-            '"dob" is between "01/01/1950" and "31/12/2001"',
-        ]
-        ai_rules = [
-            'Rows with "Student Credit Card" are 81.5% likely to have "Interest-only Mortgage"',
-            'Rows with "Fixed-rate Mortgage" are 74.3% likely to have "Classic Credit Card"',
-            '"ENGLAND" and "UNITED KINGDOM" always imply "GB" - storage space could be saved by normalising',
-        ]
-        return rules, ai_rules
+    def calculate_in_mem(
+        inp: pd.DataFrame,
+        min_support: float = 0.05,
+        min_confidence: float = 0.7,
+        sample_rows: Optional[int] = 200000,
+        time_budget: Optional[float] = 10.0,
+        **miner_args
+    ) -> Tuple[List[str], List[str]]:
+        miner = RuleMiner(
+            min_support=min_support,
+            min_confidence=min_confidence,
+            sample_rows=sample_rows,
+            time_budget=time_budget,
+            **miner_args
+        )
+        return miner.mine(inp)
 
     @staticmethod
     def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
@@ -468,6 +842,7 @@ class ExtractBadPostcode(Metric):
         inp (pd.DataFrame):input data (including but not limited to id and address columns)
         id_col (int):index of id column
         postcd_col (str): list of indices of columns to be concatenated to form an address (eg line 1, line 2, city might be [2,3,4]). They will be concatenated in the order provided
+        Each distinct postcode is checked once against the "uk_postcode" format (see format_validators)
 
     Returns:
         pd.DataFrame:
@@ -482,16 +857,79 @@ class ExtractBadPostcode(Metric):
     def calculate_in_mem(
         inp: pd.DataFrame, id_col: str = "id", postcd_col: str = "postcode"
     ) -> pd.DataFrame:
+        # kept off the input frame so metrics sharing the data source (possibly concurrently) never see it change
+        invalid_postcode = get_format_validator("uk_postcode").is_invalid(inp[postcd_col])
+        return inp[[id_col, postcd_col]].loc[invalid_postcode]
+
+    @classmethod
+    def get_required_columns(
+        cls, id_col: str = "id", postcd_col: str = "postcode", **kwargs
+    ) -> Optional[List[str]]:
+        return [id_col, postcd_col]
+
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return ChunkResultsAccumulator(
+            cls.calculate_in_mem, input_columns=cls.get_required_columns(**kwargs), **kwargs
+        )
 
-        uk_postcode = re.compile(
-            "([Gg][Ii][Rr] 0[Aa]{2})|((([A-Za-z][0-9]{1,2})|(([A-Za-z][A-Ha-hJ-Yj-y][0-9]{1,2})|(([A-Za-z][0-9][A-Za-z])|([A-Za-z][A-Ha-hJ-Yj-y][0-9][A-Za-z]?))))\s?[0-9][A-Za-z]{2})|([0-9][0-9][0-9][0-9][0-9])"
+    @staticmethod
+    def calculate_sql_tbl(
+        sql_view_connector: SQLViewConnector,
+        id_col: str = "id",
+        postcd_col: str = "postcode",
+    ) -> pd.DataFrame:
+        conn = sql_view_connector.sql_connector
+        postcode = conn.quote(postcd_col)
+        # re.match only anchors at the start, so neither does the SQL pattern. Nulls fail the python check as "None"
+        query = text(
+            "select {0}, {1} from {2} where {1} is null or not ({1} regexp :pattern)".format(
+                conn.quote(id_col), postcode, sql_view_connector.get_from_clause()
+            )
         )
-        inp["invalid_postcode"] = [uk_postcode.match(str(x)) for x in inp[postcd_col]]
-        inp["invalid_postcode"] = inp["invalid_postcode"].isnull()
-        return inp[[id_col, postcd_col]].loc[inp["invalid_postcode"]]
+        params = dict(sql_view_connector.main_query_params or {})
+        params["pattern"] = "^(" + conn.regexp_pattern(UK_POSTCODE_PATTERN) + ")"
+        return conn.run_query(query, params)
+
+
+class ValidateFormats(Metric):
+    """
+    Checks columns against standard formats (UK postcodes, phone numbers, NI numbers, emails, or any format added
+    with format_validators.register_format) in a single pass over the table
+
+    Parameters:
+        inp (pd.DataFrame):input data
+        rules (Dict[str, Union[str, List[str]]]):column name -> format name, or list of format names any of which is
+            valid, eg {"PostCode": "uk_postcode", "contact": ["uk_phone", "email"]}
+        n_samples (int):number of distinct invalid values to return per column
+        ignore_nulls (bool):skip missing values rather than counting them as invalid
+
+    Returns:
+        pd.DataFrame:per column, the formats checked, rows checked, invalid count and percentage and sample invalid
+            values
+    """
+
+    label = "Validate Formats"
+
+    def __init__(self, data_source, metric_args={}):
+        super().__init__(data_source, metric_args)
 
     @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> np.int64:
+    def calculate_in_mem(
+        inp: pd.DataFrame, rules: Dict = {}, n_samples: int = 5, ignore_nulls: bool = True
+    ) -> pd.DataFrame:
+        return ValidationSuite(rules, n_samples, ignore_nulls).update(inp).finalize()
+
+    @classmethod
+    def get_required_columns(cls, rules: Dict = {}, **kwargs) -> Optional[List[str]]:
+        return list(rules)
+
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return FormatValidationAccumulator(**kwargs)
+
+    @staticmethod
+    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
         raise NotImplementedError
 
 
@@ -502,11 +940,14 @@ class GroupedZScore(Metric):
     Parameters:
         inp (pd.DataFrame):input data (including but not limited to id and address columns)
         group_key (str): group within which to search for anomalies
-        group_value (str): values within which to search for anomalies
-        conf (float): must be 0.95 or 0.99
+        group_value (Union[str, List[str]]): values within which to search for anomalies, or a list of value columns
+            to check in one pass
+        conf (float): confidence level (eg 0.95 or 0.99), flagging values whose z-score exceeds the one-sided normal
+            critical value
 
     Returns:
-        pd.DataFrame:
+        pd.DataFrame:anomalous rows with id, group key, group average and value. With a list of value columns, one row
+            per anomalous (row, column) with the column named in "Column" and the value in "Value"
     """
 
     label = "Anomaly Detection"
@@ -519,29 +960,102 @@ class GroupedZScore(Metric):
         inp: pd.DataFrame,
         id_col: str = "id",
         group_key: str = "card_type",
-        group_value: str = "credit_rate",
+        group_value: Union[str, List[str]] = "credit_rate",
         conf: float = 0.99,
     ) -> pd.DataFrame:
+        """
+        Group keys are cleaned once per distinct key, and each value column's group count, mean and variance come
+        from one pass of bincounts, broadcast back to the rows through the group codes
+        """
+        crit_value = critical_value(conf)
+        codes, labels = clean_group_keys(inp[group_key])
+        results = []
+        for value_col in value_columns(group_value):
+            values = inp[value_col].to_numpy(dtype=np.float64)
+            moments = group_moments(codes, len(labels), values)
+            avg = moments["mean"].to_numpy()[codes]
+            std = group_std(moments)[codes]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                above_cv = np.abs((values - avg) / std) > crit_value
+            result = pd.DataFrame(
+                {
+                    id_col: inp[id_col].to_numpy()[above_cv],
+                    group_key: labels[codes[above_cv]],
+                    "avg": avg[above_cv].round(2),
+                    value_col: inp[value_col].to_numpy()[above_cv],
+                },
+                index=inp.index[above_cv],
+            )
+            if isinstance(group_value, str):
+                return result
+            results.append(
+                result.rename(columns={value_col: "Value"}).assign(Column=value_col)[
+                    [id_col, group_key, "Column", "avg", "Value"]
+                ]
+            )
+        return pd.concat(results)
 
-        df = inp[[id_col, group_key, group_value]]
-        df[group_key] = df[group_key].apply(
-            lambda x: re.sub(r"[^\x00-\x7F]+", "", str(x))
-        )
-        grouped_df = df.groupby(group_key)
-        df["avg"] = grouped_df.transform(np.mean)
-        df["std"] = grouped_df.transform(np.std)
-        df["Z_score"] = ((df[group_value] - df["avg"]) / df["std"]).abs()  # 1.645 2.33
-
-        crit_value_lookup = {0.99: 2.33, 0.95: 1.645}
-        crit_value = crit_value_lookup[conf]
-
-        df["above_cv"] = df["Z_score"] > crit_value
-        df["avg"] = df["avg"].round(2)
-        return df.loc[df["above_cv"]][[id_col, group_key, "avg", group_value]]
-
-    @staticmethod
-    def calculate_sql_tbl(sql_view_connector: SQLViewConnector) -> pd.DataFrame:
-        raise NotImplementedError
+    @classmethod
+    def get_required_columns(
+        cls,
+        id_col: str = "id",
+        group_key: str = "card_type",
+        group_value: Union[str, List[str]] = "credit_rate",
+        **kwargs
+    ) -> Optional[List[str]]:
+        return [id_col, group_key, *value_columns(group_value)]
+
+    @classmethod
+    def create_accumulator(cls, **kwargs) -> MetricAccumulator:
+        return GroupedZScoreAccumulator(**kwargs)
+
+    @classmethod
+    def calculate_sql_tbl(
+        cls,
+        sql_view_connector: SQLViewConnector,
+        id_col: str = "id",
+        group_key: str = "card_type",
+        group_value: Union[str, List[str]] = "credit_rate",
+        conf: float = 0.99,
+    ) -> pd.DataFrame:
+        """
+        Group statistics are computed in a derived table and joined back, so only the anomalous rows leave the
+        database. Squares are compared to avoid needing sqrt. Unlike the in-memory version, group keys are not
+        stripped of non-ASCII characters and rows with a null key are not grouped. Each value column in a list is
+        checked with its own query
+        """
+        conn = sql_view_connector.sql_connector
+        key = conn.quote(group_key)
+        from_clause = sql_view_connector.get_from_clause()
+        params = dict(sql_view_connector.main_query_params or {})
+        params["crit_sq"] = critical_value(conf) ** 2
+        results = []
+        for value_col in value_columns(group_value):
+            value = conn.quote(value_col)
+            query = text(
+                "select t.{0} as {0}, t.{1} as {1}, g.avg_value as avg, t.{2} as {2} "
+                "from {3} t join ("
+                "select {1} as group_key, avg({2}) as avg_value, {4} as var_value "
+                "from {3} group by {1}"
+                ") g on t.{1} = g.group_key "
+                "where (t.{2} - g.avg_value) * (t.{2} - g.avg_value) > :crit_sq * g.var_value".format(
+                    conn.quote(id_col),
+                    key,
+                    value,
+                    from_clause,
+                    conn.variance_expr(value),
+                )
+            )
+            df = conn.run_query(query, params)
+            df["avg"] = df["avg"].astype(float).round(2)
+            if isinstance(group_value, str):
+                return df
+            results.append(
+                df.rename(columns={value_col: "Value"}).assign(Column=value_col)[
+                    [id_col, group_key, "Column", "avg", "Value"]
+                ]
+            )
+        return pd.concat(results, ignore_index=True)
 
 
 class SupervisedAnomalyDetection(Metric):
@@ -571,7 +1085,8 @@ class SupervisedAnomalyDetection(Metric):
         model_path: str = r"app/models/premium_model.joblib",
     ) -> pd.DataFrame:
 
-        model = load(model_path)
+        model = model_registry.get(model_path)
+        inp = inp.copy()
         X = inp[x_cols]
         y_test = inp[y_col]
         y_preds = model.predict(X)
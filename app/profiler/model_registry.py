@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+import types
+import numpy as np
+from joblib import load
+from typing import Dict, List, Optional
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+# models shipped in MODELS_DIR whose vectorisers lower case text and split it on runs of non-word characters, so text
+# can be normalised (see inference.normalise_text) before they score it without changing their scores
+TEXT_NORMALISING_MODELS = ("bow_model_pipeline_v2.joblib", "notification_model.joblib")
+
+
+def model_nbytes(model) -> int:
+    """
+    Approximate in-memory size of a loaded model, walking its attributes and containers: the bytes of its numpy arrays
+    plus the size of every other object reached. Memory-mapped arrays aren't in memory, so aren't counted
+    """
+    total = 0
+    seen = set()
+    stack = [model]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(
+            obj, (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, np.memmap)
+        ):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            if obj.base is not None:
+                # a view: the array it views holds the memory
+                stack.append(obj.base)
+                continue
+            total += obj.nbytes
+            if obj.dtype == object:
+                stack.extend(obj.ravel())
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+    return total
+
+
+class ModelRegistry(object):
+    """
+    Process-wide cache of joblib models. Each model file is deserialised once and shared by every metric that uses it;
+    it is reloaded if the file changes on disk (by mtime and size). Models can be preloaded at startup so the first
+    dashboard doesn't pay for loading them, and, when preloaded before job workers are forked, they are shared
+    copy-on-write with the workers.
+
+    Parameters:
+        mmap_mode (str):passed to joblib.load so large numpy arrays in the models are memory-mapped rather than read
+            into memory (eg "r"). Only applies to uncompressed dumps. None loads everything into memory
+    """
+
+    def __init__(self, mmap_mode: Optional[str] = None):
+        self.mmap_mode = mmap_mode
+        self.models = {}
+        self.model_stats = {}
+        self._lock = threading.Lock()
+
+    def stamp(self, model_path: str):
+        """
+        The model file's (mtime, size), which change when the model is saved again
+        """
+        stat = os.stat(model_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, model_path: str, stamp):
+        start = time.perf_counter()
+        model = load(model_path, mmap_mode=self.mmap_mode)
+        seconds = time.perf_counter() - start
+        sha = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        stats = self.model_stats.setdefault(model_path, {"loads": 0, "hits": 0})
+        stats.update(
+            {
+                "loads": stats["loads"] + 1,
+                "load_seconds": seconds,
+                "memory_bytes": model_nbytes(model),
+                "file_bytes": stamp[1],
+                "mmap_mode": self.mmap_mode,
+                "sha256": sha.hexdigest(),
+            }
+        )
+        self.models[model_path] = (stamp, model)
+        logging.info("Loaded model %s in %.2fs", model_path, seconds)
+        return model
+
+    def normalises_text(self, model_path: str) -> bool:
+        """
+        Whether the model at model_path is one of the bundled models known to ignore case and whitespace (see
+        TEXT_NORMALISING_MODELS). Any other model's scores may depend on them
+        """
+        known = {os.path.realpath(os.path.join(MODELS_DIR, name)) for name in TEXT_NORMALISING_MODELS}
+        return os.path.realpath(model_path) in known
+
+    def get(self, model_path: str):
+        """
+        The model saved at model_path, loading it if it isn't cached or the file has changed since it was loaded
+        """
+        stamp = self.stamp(model_path)
+        with self._lock:
+            cached = self.models.get(model_path)
+            if cached is not None and cached[0] == stamp:
+                self.model_stats[model_path]["hits"] += 1
+                return cached[1]
+            return self._load(model_path, stamp)
+
+    def get_hash(self, model_path: str) -> str:
+        """
+        sha256 of the loaded model's file, identifying the model (eg in a ScoreCache)
+        """
+        self.get(model_path)
+        with self._lock:
+            return self.model_stats[model_path]["sha256"]
+
+    def preload(self, model_paths: List[str]):
+        for model_path in model_paths:
+            self.get(model_path)
+
+    def stats(self) -> Dict[str, Dict]:
+        """
+        Per model: number of loads and cache hits, the time and memory the last load took, the file size and hash
+        """
+        with self._lock:
+            return {path: dict(stats) for path, stats in self.model_stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self.models = {}
+            self.model_stats = {}
+
+
+model_registry = ModelRegistry()
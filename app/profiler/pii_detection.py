@@ -0,0 +1,234 @@
+import re
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional
+from .format_validators import (
+    FormatValidator,
+    UK_POSTCODE_PATTERN,
+    UK_PHONE_PATTERN,
+    NI_NUMBER_PATTERN,
+    EMAIL_PATTERN,
+)
+
+CARD_NUMBER_PATTERN = r"(?:\d[ -]?){12,18}\d"
+DATE_PATTERN = r"\d{1,2}[/.-]\d{1,2}[/.-](?:\d{2}|\d{4})|\d{4}[/.-]\d{1,2}[/.-]\d{1,2}(?:[ T][\d:.]+)?"
+PERSON_NAME_PATTERN = r"[A-Za-z][A-Za-z'’. -]{0,60}"
+STREET_ADDRESS_PATTERN = r"\d+[A-Za-z]?,?\s+[A-Za-z].*"
+
+
+def luhn_valid(numbers: pd.Series) -> np.ndarray:
+    """
+    Luhn checksum of each value's digits (other characters are ignored), vectorised over the values of each length
+
+    Returns:
+        np.ndarray:boolean array aligned with numbers
+    """
+    digits = numbers.astype(str).str.replace(r"[^0-9]", "", regex=True)
+    lengths = digits.str.len().to_numpy()
+    valid = np.zeros(len(digits), dtype=bool)
+    for length in np.unique(lengths):
+        if length == 0:
+            continue
+        rows = np.flatnonzero(lengths == length)
+        block = np.frombuffer("".join(digits.iloc[rows]).encode("ascii"), dtype=np.uint8)
+        # digits right to left, every second one doubled (and 9 subtracted if that gives two digits)
+        block = (block.reshape(len(rows), length) - ord("0"))[:, ::-1].astype(np.int64)
+        block[:, 1::2] *= 2
+        block[block > 9] -= 9
+        valid[rows] = block.sum(axis=1) % 10 == 0
+    return valid
+
+
+def _normalise_name(col) -> str:
+    # "Email_Address", "emailAddress" and "email address" all become "email_address"
+    name = re.sub(r"([a-z])([A-Z])", r"\1_\2", str(col))
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+class PIIType(object):
+    """
+    A kind of personal data, recognised by the values' format and the column's name
+
+    Parameters:
+        validator (FormatValidator):format of a value of this type
+        name_pattern (str):regular expression searched for in the normalised (snake case) column name
+        requires_name_match (bool):only detect the type in columns whose name matches, as the format alone is too
+            loose (eg names)
+        numeric (bool):the type can be stored in integer columns (eg card numbers)
+        check (Callable):further test of values with the right format (eg a checksum), returning a boolean array
+    """
+
+    def __init__(
+        self,
+        validator: FormatValidator,
+        name_pattern: str,
+        requires_name_match: bool = False,
+        numeric: bool = False,
+        check: Optional[Callable[[pd.Series], np.ndarray]] = None,
+    ):
+        self.validator = validator
+        self.name_regex = re.compile(name_pattern)
+        self.requires_name_match = requires_name_match
+        self.numeric = numeric
+        self.check = check
+
+    def name_matches(self, col) -> bool:
+        return self.name_regex.search(_normalise_name(col)) is not None
+
+    def is_valid(self, values: pd.Series) -> np.ndarray:
+        valid = self.validator.is_valid(values).to_numpy()
+        if self.check is not None and valid.any():
+            valid[valid] = self.check(values[valid])
+        return valid
+
+
+PII_TYPES: Dict[str, PIIType] = {
+    "email": PIIType(FormatValidator(EMAIL_PATTERN), r"e_?mail"),
+    "phone": PIIType(FormatValidator(UK_PHONE_PATTERN), r"phone|mobile|(^|_)tel($|_)|telephone|(^|_)fax"),
+    "postcode": PIIType(FormatValidator(UK_POSTCODE_PATTERN, case_sensitive=False), r"post_?code|postal|(^|_)zip"),
+    "ni_number": PIIType(
+        FormatValidator(NI_NUMBER_PATTERN, case_sensitive=False), r"(^|_)(ni|nino)($|_)|national_?insurance"
+    ),
+    "card_number": PIIType(
+        FormatValidator(CARD_NUMBER_PATTERN),
+        r"card_?(no|num)|(^|_)(pan|ccn)($|_)",
+        numeric=True,
+        check=luhn_valid,
+    ),
+    "name": PIIType(
+        FormatValidator(PERSON_NAME_PATTERN),
+        r"(^|_)(first|last|middle|full|given|family|sur|fore)_?name|^name$|(^|_)(customer|client|person)_name",
+        requires_name_match=True,
+    ),
+    "dob": PIIType(FormatValidator(DATE_PATTERN), r"(^|_)dob($|_)|birth", requires_name_match=True),
+    "address": PIIType(
+        FormatValidator(STREET_ADDRESS_PATTERN), r"address|street|(^|_)addr($|_)", requires_name_match=True
+    ),
+}
+
+
+class PIIDetector(object):
+    """
+    Finds the columns holding personal data. Each column's non-null values are matched against the PII_TYPES formats
+    a distinct value at a time, first over a stratified sample of rows (an equal number of random rows from each of
+    n_strata consecutive blocks of the table, so data that changes along the table is represented). A column is only
+    scanned in full when the sample can't decide: when a type's match rate in the sample is within z standard errors
+    of the rate needed. Matching the column name to a type lowers the rate needed.
+
+    Parameters:
+        sample_size (int):rows sampled from tables with more rows than this
+        n_strata (int):number of blocks the sample is drawn from
+        min_match_rate (float):share of values that must match a type's format
+        name_match_rate (float):share of values that must match when the column's name suggests the type
+        z (float):standard errors from the rate needed within which the sample is inconclusive
+        random_state (int):seed for the sample
+    """
+
+    def __init__(
+        self,
+        sample_size: int = 10000,
+        n_strata: int = 10,
+        min_match_rate: float = 0.8,
+        name_match_rate: float = 0.5,
+        z: float = 3.0,
+        random_state: int = 0,
+    ):
+        self.sample_size = sample_size
+        self.n_strata = n_strata
+        self.min_match_rate = min_match_rate
+        self.name_match_rate = name_match_rate
+        self.z = z
+        self.random_state = random_state
+
+    def sample_rows(self, n_rows: int) -> Optional[np.ndarray]:
+        """
+        Positions of the stratified sample, in order (None if every row is used)
+        """
+        if n_rows <= self.sample_size:
+            return None
+        rng = np.random.default_rng(self.random_state)
+        bounds = np.linspace(0, n_rows, self.n_strata + 1).astype(np.int64)
+        per_stratum = np.diff(np.linspace(0, self.sample_size, self.n_strata + 1).astype(np.int64))
+        return np.concatenate(
+            [
+                start + rng.choice(stop - start, k, replace=False)
+                for start, stop, k in zip(bounds[:-1], bounds[1:], per_stratum)
+            ]
+        )
+
+    @staticmethod
+    def match_rates(values: pd.Series, types: List[str]) -> Dict[str, float]:
+        """
+        Share of the non-null values matching each type, each distinct value being matched once
+        """
+        values = values.dropna()
+        if not len(values):
+            return {t: 0.0 for t in types}
+        codes, uniques = pd.factorize(values)
+        counts = np.bincount(codes, minlength=len(uniques))
+        distinct = pd.Series(uniques, dtype=object).map(str)
+        return {t: counts[PII_TYPES[t].is_valid(distinct)].sum() / len(values) for t in types}
+
+    def _candidate_types(self, col, dtype) -> Dict[str, bool]:
+        # type -> whether the column name matches it
+        types = pd.api.types
+        if types.is_bool_dtype(dtype) or types.is_float_dtype(dtype) or types.is_complex_dtype(dtype):
+            return {}
+        candidates = {}
+        for name, pii_type in PII_TYPES.items():
+            named = pii_type.name_matches(col)
+            if pii_type.requires_name_match and not named:
+                continue
+            if pd.api.types.is_integer_dtype(dtype) and not (pii_type.numeric or named):
+                continue
+            candidates[name] = named
+        return candidates
+
+    def detect_column(self, col, values: pd.Series, rows: Optional[np.ndarray]) -> Dict:
+        candidates = self._candidate_types(col, values.dtype)
+        result = {
+            "Column": col,
+            "PII Type": None,
+            "Match %": 0.0,
+            "Name Match": False,
+            "Scan": "full" if rows is None else "sample",
+        }
+        if not candidates:
+            return result
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            # dates are only personal data if the name says so (a date of birth)
+            if candidates.get("dob"):
+                result.update({"PII Type": "dob", "Match %": 100.0, "Name Match": True})
+            return result
+        needed = {t: self.name_match_rate if named else self.min_match_rate for t, named in candidates.items()}
+        sample = values if rows is None else values.iloc[rows]
+        rates = self.match_rates(sample, list(candidates))
+        if rows is not None:
+            n = sample.notna().sum()
+            inconclusive = [
+                t
+                for t, rate in rates.items()
+                if n == 0 or abs(rate - needed[t]) <= self.z * np.sqrt(rate * (1 - rate) / n)
+            ]
+            if inconclusive:
+                rates.update(self.match_rates(values, inconclusive))
+                result["Scan"] = "full"
+        found = [t for t, rate in rates.items() if rate > 0 and rate >= needed[t]]
+        if found:
+            best = max(found, key=lambda t: (candidates[t], rates[t]))
+            result.update(
+                {"PII Type": best, "Match %": round(100 * rates[best], 2), "Name Match": candidates[best]}
+            )
+        return result
+
+    def detect(self, inp: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame:one row per column with its PII type (None if it holds none), the share of values matching
+                the type, whether the column's name suggested it and whether the sample or the whole column decided
+        """
+        rows = self.sample_rows(len(inp))
+        return pd.DataFrame(
+            [self.detect_column(col, inp[col], rows) for col in inp.columns],
+            columns=["Column", "PII Type", "Match %", "Name Match", "Scan"],
+        )
@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from .histograms import add_histogram_json
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # frames are stored as JSON without it
+    feather = None
+
+
+def _to_json_value(x):
+    # numpy scalars from metric results (eg counts) aren't JSON serialisable
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError("Cannot store value of type " + type(x).__name__)
+
+
+class DashboardResultStore(object):
+    """
+    Server-side store of calculated dashboard results, so the session only carries a dashboard id and each view
+    request reads just the result it displays rather than unpickling the whole dashboard (and its source data).
+
+    Each dashboard gets a directory holding a small JSON summary (column names, headline metrics and the breakdown of
+    the time taken to calculate them), one JSON file per column view (holding histogram bin counts, drawn when the
+    column is viewed) and one file per table view, in Feather format where pyarrow is installed and JSON otherwise.
+    Dashboards not viewed for max_age_seconds are removed.
+
+    Parameters:
+        store_dir (str):directory holding the stored dashboards
+        max_age_seconds (float):how long a dashboard may go unviewed before it is removed (None for no limit)
+    """
+
+    table_views = {
+        "tabular": "get_tabular_view",
+        "targets": "get_targets_view",
+        "anomaly": "get_anomaly_view",
+        "ml_address": "get_ml_address_view",
+        "postcode": "get_postcode_view",
+        "client_notes": "get_client_notes_view",
+    }
+
+    def __init__(self, store_dir: str, max_age_seconds: Optional[float] = 24 * 3600):
+        self.store_dir = store_dir
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _dashboard_dir(self, dashboard_id: str) -> str:
+        # ids come back from the client in the session, so only ones this store could have made are accepted
+        if not (len(dashboard_id) == 32 and all(c in "0123456789abcdef" for c in dashboard_id)):
+            raise KeyError("Unknown dashboard " + str(dashboard_id))
+        return os.path.join(self.store_dir, dashboard_id)
+
+    def _write_json(self, path: str, value):
+        with open(path, "w") as f:
+            json.dump(value, f, default=_to_json_value)
+
+    def _read_json(self, path: str):
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_frame(self, path: str, df: pd.DataFrame):
+        df = df.reset_index(drop=True)
+        if feather is not None:
+            try:
+                feather.write_feather(df, path + ".feather", compression="uncompressed")
+                return
+            except Exception:
+                # eg mixed-type object columns Arrow can't represent
+                if os.path.exists(path + ".feather"):
+                    os.remove(path + ".feather")
+        df.to_json(path + ".json", orient="table", index=False)
+
+    def _read_frame(self, path: str) -> pd.DataFrame:
+        if os.path.exists(path + ".feather"):
+            return feather.read_feather(path + ".feather")
+        return pd.read_json(path + ".json", orient="table")
+
+    def save(self, dashboard) -> str:
+        """
+        Store the results of a calculated StandardDashboard
+
+        Returns:
+            dashboard_id (str):identifies the stored results
+        """
+        dashboard_id = uuid.uuid4().hex
+        final_dir = self._dashboard_dir(dashboard_id)
+        tmp_dir = final_dir + ".tmp"
+        os.makedirs(os.path.join(tmp_dir, "columns"))
+        columns = [str(c) for c in dashboard.get_column_names()]
+        results, labels, icons, colours = dashboard.get_headline_metrics()
+        self._write_json(
+            os.path.join(tmp_dir, "summary.json"),
+            {
+                "columns": columns,
+                "headline_metrics": {
+                    "results": list(results),
+                    "labels": list(labels),
+                    "icons": list(icons),
+                    "colours": list(colours),
+                },
+                "timings": dashboard.get_timing_breakdown(),
+            },
+        )
+        for i, col in enumerate(columns):
+            with open(os.path.join(tmp_dir, "columns", str(i) + ".json"), "w") as f:
+                f.write(dashboard.get_columnwise_view(col, incl_graph=False))
+        for view, getter in self.table_views.items():
+            self._write_frame(os.path.join(tmp_dir, view), getattr(dashboard, getter)())
+        data_rules, ai_rules = dashboard.get_data_rules_view()
+        self._write_json(
+            os.path.join(tmp_dir, "data_rules.json"),
+            {"data_rules": list(data_rules), "ai_rules": list(ai_rules)},
+        )
+        # readers never see a partly written dashboard
+        os.rename(tmp_dir, final_dir)
+        self.evict()
+        return dashboard_id
+
+    def exists(self, dashboard_id: str) -> bool:
+        try:
+            return os.path.isdir(self._dashboard_dir(dashboard_id))
+        except KeyError:
+            return False
+
+    def _path(self, dashboard_id: str, *parts) -> str:
+        dashboard_dir = self._dashboard_dir(dashboard_id)
+        if not os.path.isdir(dashboard_dir):
+            raise KeyError("Unknown dashboard " + str(dashboard_id))
+        # viewing a dashboard keeps it from expiring
+        os.utime(dashboard_dir)
+        return os.path.join(dashboard_dir, *parts)
+
+    def get_summary(self, dashboard_id: str) -> Dict:
+        return self._read_json(self._path(dashboard_id, "summary.json"))
+
+    def get_column_names(self, dashboard_id: str) -> List[str]:
+        return self.get_summary(dashboard_id)["columns"]
+
+    def get_headline_metrics(self, dashboard_id: str):
+        headline = self.get_summary(dashboard_id)["headline_metrics"]
+        return headline["results"], headline["labels"], headline["icons"], headline["colours"]
+
+    def get_timing_breakdown(self, dashboard_id: str) -> Dict:
+        # stored by earlier versions without one
+        return self.get_summary(dashboard_id).get("timings")
+
+    def get_columnwise_view(self, dashboard_id: str, col_name: str) -> str:
+        columns = self.get_column_names(dashboard_id)
+        if col_name not in columns:
+            raise KeyError("Unknown column " + str(col_name))
+        with open(self._path(dashboard_id, "columns", str(columns.index(col_name)) + ".json")) as f:
+            return add_histogram_json(f.read())
+
+    def get_table_view(self, dashboard_id: str, view: str) -> pd.DataFrame:
+        if view not in self.table_views:
+            raise KeyError("Unknown view " + str(view))
+        return self._read_frame(self._path(dashboard_id, view))
+
+    def get_data_rules_view(self, dashboard_id: str):
+        rules = self._read_json(self._path(dashboard_id, "data_rules.json"))
+        return rules["data_rules"], rules["ai_rules"]
+
+    def delete(self, dashboard_id: str):
+        shutil.rmtree(self._dashboard_dir(dashboard_id), ignore_errors=True)
+
+    def evict(self):
+        if self.max_age_seconds is None:
+            return
+        now = time.time()
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            try:
+                expired = now - os.stat(path).st_mtime > self.max_age_seconds
+            except FileNotFoundError:
+                continue
+            if expired:
+                shutil.rmtree(path, ignore_errors=True)
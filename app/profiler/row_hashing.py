@@ -0,0 +1,260 @@
+import numbers
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Iterator, List, Optional
+
+# one record per distinct hash: the hash, its number of rows and the position of its first row
+RECORD = np.dtype([("hash", "<u8"), ("count", "<i8"), ("first_row", "<i8")])
+
+# every null hashes to this, whatever its column's type in the chunk it's read in
+NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+# each level of partitioning (see HashCounter) splits on its own 16 bits of the hash
+_PARTITION_BITS = 16
+_MAX_LEVEL = 64 // _PARTITION_BITS
+
+
+def _hash_numbers(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.float64)
+    hashes = pd.util.hash_array(values)
+    hashes[np.isnan(values)] = NULL_HASH
+    return hashes
+
+
+def _hash_objects(values: np.ndarray) -> np.ndarray:
+    # pandas hashes non-strings by their string form, so 1 and "1" would hash alike. Strings are hashed as they are,
+    # numbers by value (as in numeric columns, and as 1 == 1.0 == True) and anything else with its type mixed in
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        return pd.util.hash_array(values, categorize=False)
+    hashes = np.empty(len(values), dtype=np.uint64)
+    codes, kinds = pd.factorize(pd.Series(values, dtype=object).map(type))
+    for k, kind in enumerate(kinds):
+        part = codes == k
+        if issubclass(kind, str):
+            hashes[part] = pd.util.hash_array(values[part], categorize=False)
+        elif issubclass(kind, (numbers.Real, np.bool_)):
+            hashes[part] = _hash_numbers(values[part])
+        else:
+            tag = pd.util.hash_array(np.array([kind.__module__ + "." + kind.__qualname__], dtype=object))[0]
+            hashes[part] = (pd.util.hash_array(values[part], categorize=False) ^ tag) * _FNV_PRIME
+    return hashes
+
+
+def _hash_column(values: pd.Series, numeric: bool) -> np.ndarray:
+    if numeric:
+        return _hash_numbers(pd.to_numeric(values).to_numpy(dtype=np.float64, na_value=np.nan))
+    values = values.to_numpy(dtype=object)
+    # hashing each distinct value once pays off unless most values are distinct (judged from a sample). Either way
+    # a value gets the same hash
+    sample = values[:: max(len(values) // 10000, 1)]
+    if len(pd.unique(sample)) > 0.95 * len(sample):
+        nulls = pd.isna(values)
+        if not nulls.any():
+            return _hash_objects(values)
+        # nulls are left out, as pandas only hashes non-strings after converting every value to a string
+        hashes = np.full(len(values), NULL_HASH, dtype=np.uint64)
+        hashes[~nulls] = _hash_objects(values[~nulls])
+        return hashes
+    codes, uniques = pd.factorize(values)
+    if not len(uniques):
+        return np.full(len(values), NULL_HASH, dtype=np.uint64)
+    hashes = _hash_objects(np.asarray(uniques, dtype=object))[codes]
+    hashes[codes < 0] = NULL_HASH
+    return hashes
+
+
+def hash_rows(df: pd.DataFrame, numeric_columns: Optional[List[str]] = None) -> np.ndarray:
+    """
+    64 bit hash of each row, from pandas' vectorised hashing of each column in turn. Values are normalised first so a
+    row hashes the same whichever chunk it is read in: numeric columns are hashed as floats (so an integer column read
+    as floats in a chunk with nulls still matches) and nulls all hash alike (so a column that is entirely null in a
+    chunk, and read as floats there, still matches). Values of different types hash differently (so 1 and "1" don't
+    match), except numbers, which are compared by value as in Python (so 1, 1.0 and True do). Equal rows always hash
+    the same; two different rows collide with a chance of about 1 in 2^64
+
+    Parameters:
+        df (pd.DataFrame):rows to hash
+        numeric_columns (List[str]):columns hashed as numbers (None for those with a numeric dtype)
+
+    Returns:
+        hashes (np.ndarray):uint64 hash of each row
+    """
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for i in range(len(df.columns)):
+        values = df.iloc[:, i]
+        if numeric_columns is None:
+            numeric = pd.api.types.is_numeric_dtype(values)
+        else:
+            numeric = df.columns[i] in numeric_columns
+        # FNV-style combination; uint64 arithmetic wraps
+        hashes = (hashes ^ _hash_column(values, numeric)) * _FNV_PRIME
+    return hashes
+
+
+def compact_records(records: np.ndarray) -> np.ndarray:
+    """
+    Combine records of the same hash, summing their counts and keeping the earliest first row. The result is sorted
+    by hash
+    """
+    if len(records) == 0:
+        return np.empty(0, dtype=RECORD)
+    # sorted and gathered field by field, which is far quicker than moving whole records
+    hashes = np.ascontiguousarray(records["hash"])
+    order = np.argsort(hashes)
+    hashes = hashes[order]
+    starts = np.flatnonzero(np.concatenate([[True], hashes[1:] != hashes[:-1]]))
+    compacted = np.empty(len(starts), dtype=RECORD)
+    compacted["hash"] = hashes[starts]
+    compacted["count"] = np.add.reduceat(records["count"][order], starts)
+    compacted["first_row"] = np.minimum.reduceat(records["first_row"][order], starts)
+    return compacted
+
+
+class HashCounter(object):
+    """
+    Counts the rows with each 64 bit hash (eg of rows, see hash_rows) and the position of the first of them, so
+    duplicate rows can be found in a single pass over data of any size.
+
+    Without max_memory_bytes everything is counted in memory. With it, once the distinct hashes outgrow the budget
+    they are spilled to disk, split into partitions by their bits, and each partition is counted on its own at the
+    end. A partition too big for the budget is split again on further bits, so memory stays within (roughly) the
+    budget however many rows are counted; sorting briefly needs about as much again. Only the 24 byte record of each
+    distinct hash is kept or spilled, never the rows themselves.
+
+    Parameters:
+        max_memory_bytes (int):memory the counts may take before they are spilled (None to never spill)
+        partitions (int):number of partitions spilled counts are split into (at most 2^16)
+        spill_dir (str):directory spilled partitions are written under (None for the system's temporary directory)
+        level (int):times the hashes counted have already been partitioned (set by the counter for its partitions)
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: Optional[int] = None,
+        partitions: int = 64,
+        spill_dir: Optional[str] = None,
+        level: int = 0,
+    ):
+        if not 1 < partitions <= 2 ** _PARTITION_BITS:
+            raise ValueError("partitions must be between 2 and " + str(2 ** _PARTITION_BITS))
+        self.max_memory_bytes = max_memory_bytes
+        self.partitions = partitions
+        self.spill_dir = spill_dir
+        self.level = level
+        self.rows = 0
+        self.records = np.empty(0, dtype=RECORD)
+        self.pending = []
+        self.pending_bytes = 0
+        self.spill_path = None
+
+    def add(self, hashes: np.ndarray):
+        """
+        Count the next rows, given their hashes
+        """
+        records = np.empty(len(hashes), dtype=RECORD)
+        records["hash"] = hashes
+        records["count"] = 1
+        records["first_row"] = np.arange(self.rows, self.rows + len(hashes))
+        self.rows += len(hashes)
+        self.add_records(records)
+
+    def add_records(self, records: np.ndarray):
+        """
+        Count records (eg of another counter). Doesn't change the number of rows counted
+        """
+        self.pending.append(records)
+        self.pending_bytes += records.nbytes
+        if self.max_memory_bytes is None:
+            # compacted once there are as many new records as distinct hashes, so compacting takes linear time overall
+            if self.pending_bytes >= max(self.records.nbytes, 2 ** 26):
+                self.compact()
+        elif self.pending_bytes + self.records.nbytes > self.max_memory_bytes // 2:
+            self.compact()
+            if self.records.nbytes > self.max_memory_bytes // 4 and self.level < _MAX_LEVEL:
+                self.spill()
+
+    def compact(self):
+        if self.pending:
+            self.records = compact_records(np.concatenate([self.records] + self.pending))
+            self.pending = []
+            self.pending_bytes = 0
+
+    def _partition_of(self, hashes: np.ndarray) -> np.ndarray:
+        window = (hashes >> np.uint64(_PARTITION_BITS * self.level)) & np.uint64(2 ** _PARTITION_BITS - 1)
+        return (window % np.uint64(self.partitions)).astype(np.int64)
+
+    def _partition_path(self, i: int) -> str:
+        return os.path.join(self.spill_path, str(i) + ".bin")
+
+    def spill(self):
+        """
+        Append the counts held in memory to the partition files
+        """
+        self.compact()
+        if self.spill_path is None:
+            if self.spill_dir is not None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self.spill_path = tempfile.mkdtemp(prefix="hash_counter_", dir=self.spill_dir)
+        parts = self._partition_of(self.records["hash"])
+        order = np.argsort(parts, kind="stable")
+        bounds = np.cumsum(np.bincount(parts, minlength=self.partitions))
+        for i, chunk in enumerate(np.split(self.records[order], bounds[:-1])):
+            if len(chunk):
+                with open(self._partition_path(i), "ab") as f:
+                    chunk.tofile(f)
+        self.records = np.empty(0, dtype=RECORD)
+
+    def iter_counts(self) -> Iterator[np.ndarray]:
+        """
+        Yield the counts, one record per distinct hash, a part at a time (each within the memory budget) so they can
+        be summarised without holding them all. Spilled partitions are removed as they are read, so the counts can
+        only be read once
+        """
+        self.compact()
+        if self.spill_path is None:
+            if len(self.records):
+                yield self.records
+            return
+        self.spill()
+        block = max(self.max_memory_bytes // (4 * RECORD.itemsize), 1)
+        try:
+            for i in range(self.partitions):
+                path = self._partition_path(i)
+                if not os.path.exists(path):
+                    continue
+                # counted by a counter splitting on the next bits, should the partition itself outgrow the budget
+                partition = HashCounter(self.max_memory_bytes, self.partitions, self.spill_path, self.level + 1)
+                with open(path, "rb") as f:
+                    while True:
+                        records = np.fromfile(f, dtype=RECORD, count=block)
+                        if not len(records):
+                            break
+                        partition.add_records(records)
+                os.remove(path)
+                for records in partition.iter_counts():
+                    yield records
+        finally:
+            self.close()
+
+    def merge(self, other: "HashCounter"):
+        """
+        Add the counts of another counter, whose rows follow this one's
+        """
+        for records in other.iter_counts():
+            records = records.copy()
+            records["first_row"] += self.rows
+            self.add_records(records)
+        self.rows += other.rows
+        return self
+
+    def close(self):
+        """
+        Remove any spilled partitions
+        """
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.spill_path = None
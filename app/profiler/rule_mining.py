@@ -0,0 +1,285 @@
+import itertools
+import logging
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Set, Tuple
+
+# number of set bits in each 16 bit value, to count the rows in a packed bitset
+_POPCOUNT = np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+
+def _bitset(mask: np.ndarray) -> np.ndarray:
+    bits = np.packbits(mask)
+    if len(bits) % 2:
+        bits = np.append(bits, np.uint8(0))
+    return bits.view(np.uint16)
+
+
+def _count(bits: np.ndarray) -> int:
+    return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+def _format_value(x) -> str:
+    if isinstance(x, (pd.Timestamp, np.datetime64)):
+        return '"' + str(pd.Timestamp(x)) + '"'
+    if isinstance(x, (bool, np.bool_)):
+        return str(bool(x))
+    if isinstance(x, (int, np.integer)):
+        return str(int(x))
+    if isinstance(x, (float, np.floating)):
+        return str(round(float(x), 4))
+    return '"' + str(x) + '"'
+
+
+def _format_item(col, value) -> str:
+    return '"{0}" = {1}'.format(col, _format_value(value))
+
+
+class RuleMiner(object):
+    """
+    Extracts data rules from a DataFrame. Each column is factorised once (a single hash pass) and everything else works
+    on the codes.
+
+    Column rules, over every row: uniqueness, null ratios, low-cardinality value domains and min/max ranges.
+    Association rules, over a sample of rows: frequent combinations of categorical values are mined depth first over
+    one packed bitset of rows per (column, value) item, so the support of a combination is the popcount of an AND of
+    bitsets, and rules "rows with X are p% likely to have y" are read off the frequent itemsets. Columns whose value
+    always implies another column's are also reported. Mining stops, with a warning and the rules found so far, once
+    time_budget is spent.
+
+    Parameters:
+        max_domain_size (int):report the values of columns with at most this many distinct values
+        max_cardinality (int):columns with more distinct values than this are not used in association rules
+        min_support (float):share of rows a combination of values must occur in to be mined
+        min_confidence (float):lowest confidence of an association rule
+        min_lift (float):lowest ratio of a rule's confidence to how common its consequent is overall
+        min_improvement (float):how much more confident a rule must be than any rule with a subset of its conditions
+        max_itemset_size (int):most values in a combination (antecedent plus consequent)
+        max_rules (int):most association rules reported, highest confidence first
+        sample_rows (int):association rules are mined from a random sample of this many rows (None for all rows)
+        time_budget (float):seconds allowed for association and dependency mining (None for no limit)
+        random_state (int):seed for the sample
+    """
+
+    def __init__(
+        self,
+        max_domain_size: int = 10,
+        max_cardinality: int = 50,
+        min_support: float = 0.05,
+        min_confidence: float = 0.7,
+        min_lift: float = 1.1,
+        min_improvement: float = 0.05,
+        max_itemset_size: int = 3,
+        max_rules: int = 25,
+        sample_rows: Optional[int] = 200000,
+        time_budget: Optional[float] = 10.0,
+        random_state: int = 0,
+    ):
+        self.max_domain_size = max_domain_size
+        self.max_cardinality = max_cardinality
+        self.min_support = min_support
+        self.min_confidence = min_confidence
+        self.min_lift = min_lift
+        self.min_improvement = min_improvement
+        self.max_itemset_size = max_itemset_size
+        self.max_rules = max_rules
+        self.sample_rows = sample_rows
+        self.time_budget = time_budget
+        self.random_state = random_state
+
+    @staticmethod
+    def factorize_columns(inp: pd.DataFrame) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Codes (-1 marks a null) and distinct values of each column. Columns of unhashable values (eg lists) are left
+        out
+        """
+        columns = {}
+        for col in inp.columns:
+            try:
+                codes, uniques = pd.factorize(inp[col])
+            except TypeError:
+                continue
+            columns[col] = (codes, np.asarray(uniques, dtype=object))
+        return columns
+
+    def column_rules(self, inp: pd.DataFrame, columns: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> List[str]:
+        rules = []
+        n_rows = len(inp)
+        for col, (codes, uniques) in columns.items():
+            n_null = int((codes < 0).sum())
+            if n_rows and n_null == n_rows:
+                rules.append('"{0}" is always null'.format(col))
+                continue
+            if n_null:
+                rules.append('"{0}" contains {1:.1f}% null values'.format(col, 100 * n_null / n_rows))
+            dtype = inp[col].dtype
+            # continuous measurements are distinct by chance rather than being keys
+            if len(uniques) == n_rows - n_null > 1 and not pd.api.types.is_float_dtype(dtype):
+                rules.append('"{0}" is unique'.format(col))
+            elif len(uniques) == 1:
+                rules.append('"{0}" always takes the value {1}'.format(col, _format_value(uniques[0])))
+            elif len(uniques) <= self.max_domain_size:
+                domain = sorted(uniques, key=str)
+                rules.append(
+                    '"{0}" takes the values ({1})'.format(col, ",".join(_format_value(v) for v in domain))
+                )
+            elif (
+                pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+            ) or pd.api.types.is_datetime64_any_dtype(dtype):
+                # the range of the distinct values is the range of the column
+                distinct = pd.Series(uniques, dtype=dtype)
+                rules.append(
+                    '"{0}" is between {1} and {2}'.format(
+                        col, _format_value(distinct.min()), _format_value(distinct.max())
+                    )
+                )
+        return rules
+
+    def _categorical_codes(
+        self, columns: Dict[str, Tuple[np.ndarray, np.ndarray]], rows: Optional[np.ndarray]
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        # codes of the sampled rows (None for all rows) of each low-cardinality column
+        return {
+            col: (codes if rows is None else codes[rows], uniques)
+            for col, (codes, uniques) in columns.items()
+            if 1 < len(uniques) <= self.max_cardinality
+        }
+
+    def _frequent_itemsets(self, items: List[Tuple], min_count: int, deadline: float) -> Dict[Tuple[int, ...], int]:
+        # depth-first (Eclat) search over the row bitsets of the items; values of the same column never co-occur so
+        # aren't combined
+        supports = {(i,): item[2] for i, item in enumerate(items)}
+        stack = [((i,), items[i][3]) for i in range(len(items) - 1, -1, -1)]
+        while stack:
+            if time.perf_counter() > deadline:
+                logging.warning("Data rule mining stopped at its time budget; association rules may be incomplete")
+                break
+            itemset, bits = stack.pop()
+            if len(itemset) >= self.max_itemset_size:
+                continue
+            used_cols = {items[i][0] for i in itemset}
+            for j in range(itemset[-1] + 1, len(items)):
+                if items[j][0] in used_cols:
+                    continue
+                joined = bits & items[j][3]
+                count = _count(joined)
+                if count >= min_count:
+                    supports[itemset + (j,)] = count
+                    stack.append((itemset + (j,), joined))
+        return supports
+
+    def association_rules(
+        self, columns: Dict[str, Tuple[np.ndarray, np.ndarray]], deadline: float, dependencies=frozenset()
+    ) -> List[str]:
+        """
+        Parameters:
+            columns (Dict[str, Tuple[np.ndarray, np.ndarray]]):codes and distinct values of the low-cardinality
+                columns, over the rows to mine
+            deadline (float):time.perf_counter() value at which to stop
+            dependencies (Set[Tuple[str, str]]):(a, b) column pairs where a implies b (see dependency_rules). Rules
+                predicting b from a value of a are left out as they follow from the dependency
+        """
+        n_rows = len(next(iter(columns.values()))[0]) if columns else 0
+        if not n_rows:
+            return []
+        min_count = max(int(np.ceil(self.min_support * n_rows)), 1)
+        items = []
+        for col, (codes, uniques) in columns.items():
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            for k in np.flatnonzero(counts >= min_count):
+                items.append((col, uniques[k], int(counts[k]), _bitset(codes == k)))
+        supports = self._frequent_itemsets(items, min_count, deadline)
+
+        rules = []
+        for itemset, count in supports.items():
+            if len(itemset) < 2:
+                continue
+            for consequent in itemset:
+                antecedent = tuple(i for i in itemset if i != consequent)
+                if any((items[i][0], items[consequent][0]) in dependencies for i in antecedent):
+                    continue
+                # every subset of a frequent itemset is frequent, so the supports a rule needs are all known unless
+                # mining stopped at the time budget (the search is depth first, so it may have found an itemset before
+                # its subsets). Rules that can't be checked are left out
+                if antecedent not in supports:
+                    continue
+                confidence = count / supports[antecedent]
+                lift = confidence / (items[consequent][2] / n_rows)
+                if confidence < self.min_confidence or lift < self.min_lift:
+                    continue
+                # the rules with a subset of the antecedent as conditions, as (conditions, itemset) pairs
+                simpler = [
+                    (sub, tuple(sorted(sub + (consequent,))))
+                    for size in range(1, len(antecedent))
+                    for sub in itertools.combinations(antecedent, size)
+                ]
+                if any(sub not in supports or key not in supports for sub, key in simpler):
+                    continue
+                best = max((supports[key] / supports[sub] for sub, key in simpler), default=None)
+                if best is not None and confidence - best < self.min_improvement:
+                    continue
+                rules.append((confidence, count, antecedent, consequent))
+        rules.sort(key=lambda r: (-r[0], -r[1]))
+
+        formatted = []
+        for confidence, _, antecedent, consequent in rules[: self.max_rules]:
+            conditions = " and ".join(_format_item(items[i][0], items[i][1]) for i in antecedent)
+            outcome = _format_item(items[consequent][0], items[consequent][1])
+            if confidence == 1:
+                formatted.append("Rows with {0} always have {1}".format(conditions, outcome))
+            else:
+                formatted.append(
+                    "Rows with {0} are {1:.1f}% likely to have {2}".format(conditions, 100 * confidence, outcome)
+                )
+        return formatted
+
+    def dependencies(self, columns: Dict[str, Tuple[np.ndarray, np.ndarray]], deadline: float) -> Set[Tuple[str, str]]:
+        """
+        (a, b) pairs of low-cardinality columns where a's value always implies b's: the number of distinct (a, b) code
+        pairs, counted in a small table of pairs, equals the number of distinct values of a
+        """
+        # nulls (-1) are shifted to code 0 so they count as a value
+        n_present = {col: np.count_nonzero(np.bincount(codes + 1)) for col, (codes, _) in columns.items()}
+        determines = set()
+        for a, (codes_a, _) in columns.items():
+            for b, (codes_b, uniques_b) in columns.items():
+                if a == b or n_present[b] < 2:
+                    continue
+                if time.perf_counter() > deadline:
+                    logging.warning("Data rule mining stopped at its time budget; dependency rules may be incomplete")
+                    return determines
+                pairs = (codes_a + 1).astype(np.int64) * (len(uniques_b) + 1) + (codes_b + 1)
+                if np.count_nonzero(np.bincount(pairs)) == n_present[a]:
+                    determines.add((a, b))
+        return determines
+
+    @staticmethod
+    def dependency_rules(determines: Set[Tuple[str, str]]) -> List[str]:
+        rules = []
+        for a, b in sorted(determines):
+            if (b, a) in determines:
+                if a < b:
+                    rules.append('"{0}" and "{1}" map one to one - one of them could be dropped'.format(a, b))
+            else:
+                rules.append(
+                    '"{0}" always implies "{1}" - storage space could be saved by normalising'.format(a, b)
+                )
+        return rules
+
+    def mine(self, inp: pd.DataFrame) -> Tuple[List[str], List[str]]:
+        """
+        Returns:
+            rules (List[str]):column rules
+            ai_rules (List[str]):association and dependency rules
+        """
+        deadline = time.perf_counter() + (self.time_budget if self.time_budget is not None else np.inf)
+        columns = self.factorize_columns(inp)
+        rows = None
+        if self.sample_rows is not None and len(inp) > self.sample_rows:
+            rng = np.random.default_rng(self.random_state)
+            rows = np.sort(rng.choice(len(inp), self.sample_rows, replace=False))
+        categorical = self._categorical_codes(columns, rows)
+        dependencies = self.dependencies(categorical, deadline)
+        ai_rules = self.association_rules(categorical, deadline, dependencies) + self.dependency_rules(dependencies)
+        return self.column_rules(inp, columns), ai_rules
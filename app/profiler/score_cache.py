@@ -0,0 +1,86 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import contextmanager
+import numpy as np
+from typing import Iterator, List, Sequence, Tuple
+
+
+class ScoreCache(object):
+    """
+    Persistent store of model scores for text, keyed on (model hash, text hash), so text scored by a model in an
+    earlier run is never scored by that model again. Backed by a SQLite file, which is safe to share between the
+    threads and processes calculating dashboards.
+
+    Parameters:
+        path (str):the SQLite database file (created if missing)
+    """
+
+    # keeps each IN (...) lookup below SQLite's bound parameter limit
+    lookup_batch_size = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("pragma journal_mode=wal")
+            conn.execute(
+                "create table if not exists scores ("
+                "model_hash text not null, text_hash blob not null, proba blob not null, "
+                "primary key (model_hash, text_hash)) without rowid"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # sqlite3's own context manager commits but doesn't close the connection
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, model_hash: str, texts: Sequence[str]) -> Tuple[np.ndarray, List]:
+        """
+        Returns:
+            found (np.ndarray):boolean mask of the texts with a cached score
+            probas (List):the cached score for each text (None where there is none)
+        """
+        hashes = [self.text_hash(t) for t in texts]
+        cached = {}
+        with self._connect() as conn:
+            for i in range(0, len(hashes), self.lookup_batch_size):
+                batch = hashes[i : i + self.lookup_batch_size]
+                rows = conn.execute(
+                    "select text_hash, proba from scores where model_hash = ? and text_hash in ("
+                    + ",".join("?" * len(batch))
+                    + ")",
+                    [model_hash, *batch],
+                )
+                cached.update(rows)
+        probas = [
+            np.frombuffer(cached[h], dtype=np.float64) if h in cached else None
+            for h in hashes
+        ]
+        return np.array([p is not None for p in probas], dtype=bool), probas
+
+    def put_many(self, model_hash: str, texts: Sequence[str], probas: np.ndarray):
+        rows = [
+            (model_hash, self.text_hash(t), np.ascontiguousarray(p, dtype=np.float64).tobytes())
+            for t, p in zip(texts, probas)
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "insert or ignore into scores (model_hash, text_hash, proba) values (?, ?, ?)",
+                rows,
+            )
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("select count(*) from scores").fetchone()[0]
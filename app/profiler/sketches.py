@@ -0,0 +1,203 @@
+import base64
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorised int.bit_length() for uint64 arrays
+    """
+    x = x.copy()
+    length = np.zeros(x.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = x >= (np.uint64(1) << np.uint64(shift))
+        length[mask] += shift
+        x[mask] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+def hash_values(values: pd.Series) -> np.ndarray:
+    """
+    64-bit hashes of the non-null values of a series. Numeric values are hashed as float64 so the same number hashes
+    identically whether a chunk happened to be read as ints or floats
+    """
+    values = values.dropna()
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        values = pd.Series(values.to_numpy(dtype=np.float64))
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog distinct count sketch. Memory is fixed at 2^precision bytes regardless of how many values are added,
+    and two sketches built over different chunks can be merged into the sketch of the combined data.
+
+    Parameters:
+        precision (int):number of bits used to pick a register. The relative standard error is 1.04/sqrt(2^precision)
+    """
+
+    def __init__(self, precision: int = 14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series):
+        return self.update_hashes(hash_values(values))
+
+    def update_hashes(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return self
+        p = np.uint64(self.precision)
+        idx = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        rank = (64 - self.precision) - _bit_length(rest).astype(np.int64) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("Can only merge HyperLogLog sketches with the same precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / np.sqrt(len(self.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is much more accurate while most registers are still empty
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict:
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(self.registers.tobytes()).decode("ascii"),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "HyperLogLog":
+        sketch = cls(state["precision"])
+        sketch.registers = np.frombuffer(
+            base64.b64decode(state["registers"]), dtype=np.uint8
+        ).copy()
+        return sketch
+
+
+class KLLSketch(object):
+    """
+    KLL quantile sketch. Values are kept in a hierarchy of compactors where an item at level h stands for 2^h original
+    values; when a level overflows, half its (sorted) items are promoted to the level above. Memory is O(k log(n/k))
+    and sketches are mergeable. Until the first compaction the sketch holds every value and quantiles are exact.
+
+    Parameters:
+        k (int):accuracy parameter. The normalised rank error is roughly 1.65% at k=200
+        seed (int):seed for the random choice of which half is promoted
+    """
+
+    def __init__(self, k: int = 200, seed: int = None):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.compactors = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(8, int(np.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+        return self
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                items = np.sort(self.compactors[level])
+                keep = items[len(items) - len(items) % 2 :]
+                items = items[: len(items) - len(items) % 2]
+                promoted = items[self._rng.integers(2) :: 2]
+                self.compactors[level + 1] = np.concatenate(
+                    [self.compactors[level + 1], promoted]
+                )
+                self.compactors[level] = keep
+            level += 1
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, items in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], items])
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        self._compress()
+        return self
+
+    @property
+    def is_exact(self) -> bool:
+        return len(self.compactors) == 1
+
+    @property
+    def rank_error(self) -> float:
+        """
+        Normalised rank error of quantile estimates (0 while the sketch is still exact)
+        """
+        if self.is_exact:
+            return 0.0
+        return 2.296 / self.k ** 0.9723
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return np.nan
+        if self.is_exact:
+            return float(np.quantile(self.compactors[0], q))
+        if q <= 0:
+            return float(self.min)
+        if q >= 1:
+            return float(self.max)
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate(
+            [np.full(len(c), 2 ** level, dtype=np.int64) for level, c in enumerate(self.compactors)]
+        )
+        order = np.argsort(items, kind="mergesort")
+        cumulative = np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return float(items[order][min(idx, len(items) - 1)])
+
+    def to_dict(self) -> Dict:
+        return {
+            "k": self.k,
+            "n": self.n,
+            "min": None if np.isnan(self.min) else float(self.min),
+            "max": None if np.isnan(self.max) else float(self.max),
+            "compactors": [c.tolist() for c in self.compactors],
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "KLLSketch":
+        sketch = cls(state["k"])
+        sketch.n = state["n"]
+        sketch.min = np.nan if state["min"] is None else state["min"]
+        sketch.max = np.nan if state["max"] is None else state["max"]
+        sketch.compactors = [np.asarray(c, dtype=np.float64) for c in state["compactors"]]
+        return sketch
@@ -1,21 +1,90 @@
+import logging
+import os
+import re
+import time
 import pandas as pd
-from sqlalchemy import create_engine
-from typing import Dict
+from sqlalchemy import event, inspect
+from sqlalchemy import types as sqltypes
+from typing import Dict, Iterator, Optional
 from sqlalchemy.sql import text
+from .engine_registry import engine_registry
+from .instrumentation import instrumentation
+
+
+def strip_statement_terminator(query) -> str:
+    # custom SQL is often written ending in ";", which isn't valid once the query is wrapped as a derived table
+    return re.sub(r"[\s;]+$", "", str(query))
+
+
+def _register_regexp(dbapi_conn, conn_record):
+    dbapi_conn.create_function(
+        "regexp",
+        2,
+        lambda pattern, value: value is not None
+        and re.search(pattern, str(value)) is not None,
+    )
 
 
 class SQLConnector(object):
+    # sample variance aggregate for the dialect; None where the database has none (it is then built from sums)
+    variance_function = None
+    # what python's \s becomes in a REGEXP pattern. MySQL 5.7's regex engine has no \s but, like MySQL 8's, has the
+    # POSIX class
+    regexp_whitespace = "[[:space:]]"
+
     @staticmethod
     def sql_connector_factory(prefix, db_creds):
         # TODO Add other SQL dialects
         class MySQLConnector(SQLConnector):
             prefix = "mysql+pymysql"
+            variance_function = "var_samp"
+            # no table_version: information_schema's update_time is cached for up to a day (MySQL 8), only has one
+            # second resolution and is null for InnoDB after a restart, and CHECKSUM TABLE reads the whole table. Give
+            # the SQLViewConnector a version_column to cache results of MySQL tables
+
+            def __init__(self, db_creds: Dict[str, str]):
+                super().__init__(db_creds)
+
+        class SQLiteConnector(SQLConnector):
+            # db_creds needs "path" (the database file) and "dbname", which for sqlite is the schema, usually "main"
+            prefix = "sqlite"
+            # REGEXP is python's re here (see _register_regexp), which has no POSIX classes
+            regexp_whitespace = r"\s"
 
             def __init__(self, db_creds: Dict[str, str]):
                 super().__init__(db_creds)
 
+            def create_conn_string(self, prefix: str, db_creds: Dict[str, str]):
+                return "{0}:///{1}".format(prefix, db_creds["path"])
+
+            def get_engine_options(self) -> Dict:
+                # pooled connections are handed to whichever thread checks them out
+                return {
+                    "encoding": "utf8",
+                    "connect_args": {"check_same_thread": False},
+                }
+
+            def table_version(self, schema: str, table_name: str) -> Optional[str]:
+                # sqlite keeps no modification times, so the database file's (and its write-ahead log's) are used
+                stamps = []
+                for path in [self.db_creds["path"], self.db_creds["path"] + "-wal"]:
+                    if os.path.exists(path):
+                        stat = os.stat(path)
+                        stamps.append("{0}:{1}".format(stat.st_size, stat.st_mtime_ns))
+                return "file:" + ",".join(stamps) if stamps else None
+
+            def create_db_engine(self):
+                super().create_db_engine()
+
+                # sqlite parses REGEXP but leaves the implementation to the application. Registered once per shared
+                # engine
+                if not event.contains(self.engine, "connect", _register_regexp):
+                    event.listen(self.engine, "connect", _register_regexp)
+
         if prefix == "mysql":
             return MySQLConnector(db_creds)
+        elif prefix == "sqlite":
+            return SQLiteConnector(db_creds)
         else:
             raise ValueError("Please specify desired SQL dialect...")
 
@@ -37,26 +106,122 @@ class SQLConnector(object):
             db_creds["dbname"],
         )
 
+    def get_engine_options(self) -> Dict:
+        return {"encoding": "utf8"}
+
     def create_db_engine(self):
+        # engines (and their connection pools) are shared by every connector to the same database
         conn_str = self.create_conn_string(self.prefix, self.db_creds)
-        self.engine = create_engine(conn_str, encoding="utf8")
+        self.engine = engine_registry.get_engine(conn_str, **self.get_engine_options())
+
+    def table_version(self, schema: str, table_name: str) -> Optional[str]:
+        """
+        Cheaply identifies the current contents of a table, changing whenever the table does. None where the dialect
+        has no cheap way to tell
+        """
+        return None
+
+    def column_version(self, schema: str, table_name: str, column: str) -> Optional[str]:
+        """
+        Identifies the current contents of a table from its row count and the highest value of a column that grows
+        with every change (eg an auto-increment key or a last modified time), so inserts, updates and deletes all
+        change it. Only as cheap as the database can count the rows and find the column's maximum (eg from an index)
+        """
+        row = self.run_query(
+            text(
+                "select count(*) as n, max({0}) as version from {1}.{2}".format(
+                    self.quote(column), self.quote(schema), self.quote(table_name)
+                )
+            )
+        ).iloc[0]
+        return "column:{0}:{1}:{2}".format(column, row["n"], row["version"])
+
+    def quote(self, identifier: str) -> str:
+        return self.engine.dialect.identifier_preparer.quote(identifier)
+
+    @classmethod
+    def regexp_pattern(cls, pattern: str) -> str:
+        """
+        A python regular expression (using no other escapes than \\s) as the dialect's REGEXP understands it
+        """
+        return pattern.replace(r"\s", cls.regexp_whitespace)
+
+    def variance_expr(self, expr: str) -> str:
+        if self.variance_function is not None:
+            return "{0}({1})".format(self.variance_function, expr)
+        return "(sum({0} * {0}) - sum({0}) * sum({0}) / count({0})) / (count({0}) - 1)".format(
+            expr
+        )
 
     def run_query(self, query, params=None):
-        with self.engine.connect() as conn:
-            if params is None:
-                results = conn.execute(query)
-                keys = conn.execute(query).keys()
-            else:
-                results = conn.execute(query, params)
-                keys = conn.execute(query, params).keys()
-        return pd.DataFrame(results.fetchall(), columns=keys)
+        start = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                if params is None:
+                    results = conn.execute(query)
+                else:
+                    results = conn.execute(query, params)
+                # fetched while the connection is open; only buffering drivers (eg pymysql) allow it afterwards
+                df = pd.DataFrame(results.fetchall(), columns=list(results.keys()))
+        except Exception:
+            instrumentation.record_query(time.perf_counter() - start, 0, "error")
+            raise
+        instrumentation.record_query(time.perf_counter() - start, len(df))
+        return df
+
+    def iter_query(self, query, params=None, chunksize: int = 100000) -> Iterator[pd.DataFrame]:
+        """
+        Run a query and yield its results as DataFrames of at most chunksize rows. Rows are streamed through a
+        server-side cursor where the driver supports one, so memory is bounded by the chunk size rather than the
+        size of the result
+
+        Parameters:
+            query:the query to run
+            params (Dict):bound parameters for the query
+            chunksize (int):rows per DataFrame
+        """
+        # the query's time excludes the time the caller spends on each chunk
+        seconds, rows, status = 0.0, 0, "error"
+        start = time.perf_counter()
+        try:
+            with self.engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                if params is None:
+                    results = conn.execute(query)
+                else:
+                    results = conn.execute(query, params)
+                keys = list(results.keys())
+                empty = True
+                for partition in results.partitions(chunksize):
+                    empty = False
+                    chunk = pd.DataFrame(partition, columns=keys)
+                    rows += len(chunk)
+                    seconds += time.perf_counter() - start
+                    start = None
+                    yield chunk
+                    start = time.perf_counter()
+                if empty:
+                    yield pd.DataFrame(columns=keys)
+            status = "ok"
+        except GeneratorExit:
+            # the caller stopped early
+            status = "ok"
+            raise
+        finally:
+            if start is not None:
+                seconds += time.perf_counter() - start
+            instrumentation.record_query(seconds, rows, status)
 
     def get_query_metadata(self, query, params=None):
+        """
+        Column names of a query's results, found by running it wrapped in a LIMIT 0 so no rows are produced
+        """
+        metadata_query = text("select * from (" + strip_statement_terminator(query) + ") as q limit 0")
         with self.engine.connect() as conn:
             if params is None:
-                return conn.execute(query).keys()
+                return list(conn.execute(metadata_query).keys())
             else:
-                return conn.execute(query, params).keys()
+                return list(conn.execute(metadata_query, params).keys())
 
 
 class SQLViewConnector(object):
@@ -67,8 +232,12 @@ class SQLViewConnector(object):
         table_name: str = None,
         custom_sql: str = None,
         custom_sql_params: str = None,
+        version_column: str = None,
     ):
         self.sql_connector = SQLConnector.sql_connector_factory(sql_dialect, db_creds)
+        self.version_column = version_column
+        self.column_types = None
+        self.numeric_columns = None
         if table_name is not None and custom_sql is not None:
             logging.warning("Both table name and sql provided. Table name is used")
         elif custom_sql is None and table_name is None:
@@ -82,8 +251,70 @@ class SQLViewConnector(object):
             self.main_query_params = None
             self.table_name = table_name
         elif custom_sql is not None:
-            self.main_query_sql = custom_sql
+            # metrics select from the custom query as a derived table
+            self.main_query_sql = strip_statement_terminator(custom_sql)
             self.main_query_params = custom_sql_params
-        self.column_names = self.sql_connector.get_query_metadata(
-            self.main_query_sql, params=self.main_query_params
-        )
+            self.table_name = None
+        if self.table_name is not None:
+            # from the table definition (information schema) rather than by running the query
+            self.column_names = list(self.get_column_types())
+        else:
+            self.column_names = self.sql_connector.get_query_metadata(
+                self.main_query_sql, params=self.main_query_params
+            )
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Identifies the table and its current contents (see SQLConnector.table_version, or column_version where the
+        connector has a version_column), or None for custom SQL, whose source tables aren't known
+        """
+        if self.table_name is None:
+            return None
+        schema = self.sql_connector.db_creds["dbname"]
+        if self.version_column is not None:
+            version = self.sql_connector.column_version(schema, self.table_name, self.version_column)
+        else:
+            version = self.sql_connector.table_version(schema, self.table_name)
+        if version is None:
+            return None
+        url = self.sql_connector.engine.url.render_as_string(hide_password=True)
+        return "sql:{0}:{1}.{2}:{3}".format(url, schema, self.table_name, version)
+
+    def get_from_clause(self) -> str:
+        """
+        The table (or custom query, as a derived table) metrics should select from
+        """
+        if self.table_name is not None:
+            return self.sql_connector.db_creds["dbname"] + "." + self.table_name
+        return "(" + str(self.main_query_sql) + ") as q"
+
+    def get_column_types(self) -> Dict[str, str]:
+        """
+        Column name -> type name, from the table definition where there is one and otherwise from the types pandas
+        infers for a sample of the custom query's rows
+        """
+        if self.column_types is None:
+            if self.table_name is not None:
+                columns = inspect(self.sql_connector.engine).get_columns(
+                    self.table_name, schema=self.sql_connector.db_creds["dbname"]
+                )
+                self.column_types = {c["name"]: str(c["type"]) for c in columns}
+                self.numeric_columns = [
+                    c["name"]
+                    for c in columns
+                    if isinstance(c["type"], (sqltypes.Integer, sqltypes.Numeric))
+                ]
+            else:
+                sample = self.sql_connector.run_query(
+                    text("select * from " + self.get_from_clause() + " limit 1000"),
+                    params=self.main_query_params,
+                )
+                self.column_types = {c: str(t) for c, t in sample.dtypes.items()}
+                self.numeric_columns = sample.select_dtypes(
+                    include=["number"]
+                ).columns.tolist()
+        return self.column_types
+
+    def get_numeric_columns(self):
+        self.get_column_types()
+        return self.numeric_columns
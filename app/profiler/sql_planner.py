@@ -0,0 +1,67 @@
+from typing import Dict
+from sqlalchemy.sql import text
+from .sql_connectors import SQLViewConnector
+
+
+class SQLAggregatePlanner(object):
+    """
+    Combines the aggregates several metrics need from one table into a single select, so they share one table scan.
+
+    Each metric registers a dict of name -> aggregate expression. Identical expressions (eg the count(*) needed by
+    both the row count and the blank cell percentage) are only computed once. After execute(), each metric gets back
+    a dict of name -> value for the expressions it registered.
+    """
+
+    def __init__(self, sql_view_connector: SQLViewConnector):
+        self.sql_view_connector = sql_view_connector
+        self.aliases = {}
+        self.requests = {}
+
+    def add(self, key, aggregates: Dict[str, str]):
+        request = {}
+        for name, expr in aggregates.items():
+            if expr not in self.aliases:
+                self.aliases[expr] = "a" + str(len(self.aliases))
+            request[name] = self.aliases[expr]
+        self.requests[key] = request
+
+    def build_query(self, where: str = None):
+        select_list = ", ".join(
+            expr + " as " + alias for expr, alias in self.aliases.items()
+        )
+        query = "select " + select_list + " from " + self.sql_view_connector.get_from_clause()
+        if where is not None:
+            query += " where " + where
+        return text(query)
+
+    def execute(self, where: str = None, params: Dict = None) -> Dict:
+        """
+        Parameters:
+            where (str):condition restricting the rows aggregated (eg to those past a watermark)
+            params (Dict):bound parameters of the condition
+        """
+        if not self.aliases:
+            return {key: {} for key in self.requests}
+        if params is not None:
+            params = {**(self.sql_view_connector.main_query_params or {}), **params}
+        else:
+            params = self.sql_view_connector.main_query_params
+        results = self.sql_view_connector.sql_connector.run_query(
+            self.build_query(where), params=params
+        )
+        # taken from itertuples rather than iloc so each value keeps its column's type
+        row = dict(zip(results.columns, next(results.itertuples(index=False, name=None))))
+        return {
+            key: {name: row[alias] for name, alias in request.items()}
+            for key, request in self.requests.items()
+        }
+
+
+def run_aggregate_metric(metric_cls, sql_view_connector: SQLViewConnector, **kwargs):
+    """
+    Calculate a single aggregate push-down metric on its own
+    """
+    planner = SQLAggregatePlanner(sql_view_connector)
+    planner.add(0, metric_cls.sql_aggregates(sql_view_connector, **kwargs))
+    values = planner.execute()[0]
+    return metric_cls.finalize_sql_aggregates(values, sql_view_connector, **kwargs)
@@ -1,21 +1,84 @@
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import Dict, Iterator, List, Optional
 import pandas as pd
 import os
 import logging
+import time
+from sqlalchemy.sql import text
 from .sql_connectors import SQLViewConnector
+from .columnar_cache import ColumnarCache
+from .instrumentation import instrumentation
+
+
+def file_fingerprint(filepath: str) -> str:
+    """
+    Identifies a version of a file from its path, size and modification time, without reading it
+    """
+    stat = os.stat(filepath)
+    return "{0}:{1}:{2}".format(os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
 
 
 class TabularDataReader(ABC):
+    """
+    Reads a table into memory. Loading is lazy: nothing is read until the data is first asked for, and callers can
+    ask for a subset of columns (a projection) so only those are read from the source
+    """
+
+    cache = None
+    data = None
+    # columns currently held in self.data. None means the whole table has been loaded
+    loaded_columns = None
+
     def __init__(self):
         pass
 
+    def read_file(
+        self, filepath: str, kind: str, read_fn, columns: List[str] = None
+    ) -> pd.DataFrame:
+        """
+        Parse a file with read_fn(columns), going through the reader's columnar cache (if it has one) so unchanged
+        files are only parsed once. The cache stores whole tables, so a miss parses every column
+        """
+        if self.cache is None:
+            return read_fn(columns)
+        return self.cache.get_or_read(filepath, kind, lambda: read_fn(None), columns)
+
+    def has_columns(self, columns: List[str] = None) -> bool:
+        if self.data is None:
+            return False
+        if self.loaded_columns is None:
+            return True
+        return columns is not None and set(columns) <= set(self.loaded_columns)
+
+    def get_data(self, columns: List[str] = None) -> pd.DataFrame:
+        """
+        Return the table, loading it first if needed
+
+        Parameters:
+            columns (List[str]):only these columns are needed (None for all of them)
+        """
+        if not self.has_columns(columns):
+            start = time.perf_counter()
+            self.read_in_data(columns)
+            instrumentation.record_read(type(self).__name__, time.perf_counter() - start, len(self.data))
+            self.loaded_columns = None if columns is None else list(columns)
+        if columns is None or list(self.data.columns) == list(columns):
+            return self.data
+        return self.data[[c for c in self.data.columns if c in set(columns)]]
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Cheaply identifies the data the reader reads, changing whenever the data does (so metric results can be
+        cached against it). None if the data can't be identified
+        """
+        return None
+
     @abstractmethod
-    def get_data(self) -> pd.DataFrame:
+    def get_column_names(self) -> pd.Index:
         pass
 
     @abstractmethod
-    def read_in_data(self):
+    def read_in_data(self, columns: List[str] = None):
         pass
 
 
@@ -27,19 +90,41 @@ class SQLTableReader(SQLViewConnector, TabularDataReader):
         db_creds: Dict[str, str],
         table_name: str = None,
         custom_sql: str = None,
+        chunksize: int = 100000,
+        version_column: str = None,
     ):
         super().__init__(
-            sql_dialect, db_creds, table_name=table_name, custom_sql=custom_sql
+            sql_dialect,
+            db_creds,
+            table_name=table_name,
+            custom_sql=custom_sql,
+            version_column=version_column,
         )
-        self.read_in_data()
+        self.chunksize = chunksize
 
-    def read_in_data(self):
-        self.data = self.sql_connector.run_query(
-            self.main_query_sql, params=self.main_query_params
+    def get_column_names(self) -> pd.Index:
+        return pd.Index(self.column_names)
+
+    def get_query(self, columns: List[str] = None):
+        if columns is None:
+            return self.main_query_sql
+        return text(
+            "select "
+            + ", ".join(self.sql_connector.quote(c) for c in columns)
+            + " from ("
+            + str(self.main_query_sql)
+            + ") as q"
         )
 
-    def get_data(self) -> pd.DataFrame:
-        return self.data
+    def iter_chunks(self, columns: List[str] = None) -> Iterator[pd.DataFrame]:
+        return self.sql_connector.iter_query(
+            self.get_query(columns), params=self.main_query_params, chunksize=self.chunksize
+        )
+
+    def read_in_data(self, columns: List[str] = None):
+        # concat only starts once every chunk has been fetched, so memory peaks at about twice the table (the chunks
+        # and the frame they are copied into). A StreamingDataSource over a ChunkedSQLReader stays within a chunk
+        self.data = pd.concat(self.iter_chunks(columns), ignore_index=True)
 
 
 class DataFrameReader(TabularDataReader):
@@ -47,50 +132,154 @@ class DataFrameReader(TabularDataReader):
         self.data = df
         self.read_in_data()
 
-    def read_in_data(self):
+    def get_column_names(self) -> pd.Index:
+        return self.data.columns
+
+    def read_in_data(self, columns: List[str] = None):
         # TODO add validation checks
         pass
 
-    def get_data(self) -> pd.DataFrame:
-        return self.data
-
 
 class CSVReader(TabularDataReader):
-    def __init__(self, path: str, filename: str):
+    def __init__(self, path: str, filename: str, cache: ColumnarCache = None):
         self.path = path
         self.filename = filename
-        self.read_in_data()
+        self.cache = cache
+
+    def fingerprint(self) -> Optional[str]:
+        return "csv:" + file_fingerprint(os.path.join(self.path, self.filename))
 
-    def read_in_data(self):
-        self.data = pd.read_csv(os.path.join(self.path, self.filename))
+    def get_column_names(self) -> pd.Index:
+        if self.data is not None and self.loaded_columns is None:
+            return self.data.columns
+        return pd.read_csv(os.path.join(self.path, self.filename), nrows=0).columns
 
-    def get_data(self) -> pd.DataFrame:
-        return self.data
+    def read_in_data(self, columns: List[str] = None):
+        filepath = os.path.join(self.path, self.filename)
+        self.data = self.read_file(
+            filepath, "csv", lambda cols: pd.read_csv(filepath, usecols=cols), columns
+        )
 
 
 class ExcelReader(TabularDataReader):
-    def __init__(self, path: str, filename: str):
+    def __init__(self, path: str, filename: str, cache: ColumnarCache = None):
         self.path = path
         self.filename = filename
-        self.read_in_data()
+        self.cache = cache
 
-    def read_in_data(self):
-        self.data = pd.read_excel(
-            os.path.join(self.path, self.filename), engine="openpyxl"
-        )
+    def fingerprint(self) -> Optional[str]:
+        return "excel:" + file_fingerprint(os.path.join(self.path, self.filename))
+
+    def get_column_names(self) -> pd.Index:
+        if self.data is not None and self.loaded_columns is None:
+            return self.data.columns
+        return pd.read_excel(
+            os.path.join(self.path, self.filename), engine="openpyxl", nrows=0
+        ).columns
 
-    def get_data(self) -> pd.DataFrame:
-        return self.data
+    def read_in_data(self, columns: List[str] = None):
+        filepath = os.path.join(self.path, self.filename)
+        self.data = self.read_file(
+            filepath,
+            "excel",
+            lambda cols: pd.read_excel(filepath, engine="openpyxl", usecols=cols),
+            columns,
+        )
 
 
 class JSONReader(TabularDataReader):
-    def __init__(self, path: str, filename: str):
+    def __init__(self, path: str, filename: str, cache: ColumnarCache = None):
         self.path = path
         self.filename = filename
-        self.read_in_data()
+        self.cache = cache
+
+    def fingerprint(self) -> Optional[str]:
+        return "json:" + file_fingerprint(os.path.join(self.path, self.filename))
+
+    def get_column_names(self) -> pd.Index:
+        # JSON has no header to peek at, so the whole file is read (and kept)
+        return self.get_data().columns
+
+    def read_in_data(self, columns: List[str] = None):
+        filepath = os.path.join(self.path, self.filename)
+
+        def read_json(cols):
+            df = pd.read_json(filepath)
+            return df if cols is None else df[cols]
+
+        self.data = self.read_file(filepath, "json", read_json, columns)
+
+
+class ChunkedDataReader(ABC):
+    """
+    Reader for tables too large to hold in memory. Rather than loading the table, it yields it in chunks of rows
+    """
+
+    @abstractmethod
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        pass
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        As TabularDataReader.fingerprint
+        """
+        return None
+
+    @abstractmethod
+    def get_column_names(self):
+        pass
+
+
+class ChunkedSQLReader(SQLViewConnector, ChunkedDataReader):
+    """
+    Streams a table or custom query from a database in chunks of rows, using a server-side cursor where the driver
+    supports one
+    """
+
+    def __init__(
+        self,
+        sql_dialect: str,
+        db_creds: Dict[str, str],
+        table_name: str = None,
+        custom_sql: str = None,
+        chunksize: int = 100000,
+        version_column: str = None,
+    ):
+        super().__init__(
+            sql_dialect,
+            db_creds,
+            table_name=table_name,
+            custom_sql=custom_sql,
+            version_column=version_column,
+        )
+        self.chunksize = chunksize
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        return self.sql_connector.iter_query(
+            self.main_query_sql, params=self.main_query_params, chunksize=self.chunksize
+        )
+
+    def get_column_names(self):
+        return pd.Index(self.column_names)
+
+
+class ChunkedCSVReader(ChunkedDataReader):
+    def __init__(self, path: str, filename: str, chunksize: int = 100000):
+        self.path = path
+        self.filename = filename
+        self.chunksize = chunksize
+
+    def fingerprint(self) -> Optional[str]:
+        return "csv:" + file_fingerprint(os.path.join(self.path, self.filename))
 
-    def read_in_data(self):
-        self.data = pd.read_json(os.path.join(self.path, self.filename))
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        # TextFileReader is only a context manager from pandas 1.2, so it is closed by hand
+        reader = pd.read_csv(os.path.join(self.path, self.filename), chunksize=self.chunksize)
+        try:
+            for chunk in reader:
+                yield chunk
+        finally:
+            reader.close()
 
-    def get_data(self) -> pd.DataFrame:
-        return self.data
+    def get_column_names(self):
+        return pd.read_csv(os.path.join(self.path, self.filename), nrows=0).columns
@@ -19,9 +19,98 @@ from app.profiler.data_sources import InMemoryDataSource
 from app.profiler.tabular_readers import CSVReader
 from app.profiler.metrics import *
 from app.profiler.dashboards import Dashboard, StandardDashboard
+from app.profiler.executors import executor_factory
+from app.profiler.columnar_cache import ColumnarCache
+from app.profiler.engine_registry import engine_registry
+from app.profiler.model_registry import model_registry
+from app.profiler.metric_cache import metric_cache
+from app.profiler.jobs import JobQueue
+from app.profiler.instrumentation import instrumentation
+from app.profiler.result_store import DashboardResultStore
 from .forms import AppHomePageForm
 
 
+columnar_cache = ColumnarCache(
+    app.config["COLUMNAR_CACHE_FOLDER"],
+    max_bytes=app.config["COLUMNAR_CACHE_MAX_BYTES"],
+    max_age_seconds=app.config["COLUMNAR_CACHE_MAX_AGE"],
+)
+
+engine_registry.configure(
+    pool_size=app.config["SQL_POOL_SIZE"],
+    max_overflow=app.config["SQL_POOL_MAX_OVERFLOW"],
+    pool_pre_ping=app.config["SQL_POOL_PRE_PING"],
+    pool_recycle=app.config["SQL_POOL_RECYCLE"],
+)
+
+# configured before the job workers fork; they share the on-disk tier
+metric_cache.configure(
+    enabled=app.config["METRIC_CACHE_ENABLED"],
+    max_entries=app.config["METRIC_CACHE_MAX_ENTRIES"],
+    max_bytes=app.config["METRIC_CACHE_MAX_BYTES"],
+    disk_dir=app.config["METRIC_CACHE_FOLDER"],
+    max_disk_bytes=app.config["METRIC_CACHE_MAX_DISK_BYTES"],
+)
+
+# loaded before the job workers fork so they share the models
+model_registry.mmap_mode = app.config["MODEL_MMAP_MODE"]
+model_registry.preload(app.config["PRELOAD_MODELS"])
+
+result_store = DashboardResultStore(
+    app.config["RESULT_STORE_FOLDER"],
+    max_age_seconds=app.config["RESULT_STORE_MAX_AGE"],
+)
+
+job_queue = JobQueue(max_workers=app.config["JOB_WORKERS"], result_store=result_store)
+
+
+def build_standard_dashboard(
+    data_folder: str, filename: str, executor_name: str, score_cache_path: str = None
+):
+    # run by the job queue's worker processes
+    bcm_data_source = InMemoryDataSource(
+        CSVReader(data_folder, filename, cache=columnar_cache)
+    )
+    return StandardDashboard(
+        BasicProfile(bcm_data_source),
+        ExtractDataRules(bcm_data_source),
+        GroupedZScore(
+            bcm_data_source,
+            {
+                "id_col": "user_id",
+                "group_key": "card_type",
+                "group_value": "credit_rate",
+            },
+        ),
+        ExtractBadPostcode(
+            bcm_data_source, {"id_col": "user_id", "postcd_col": "PostCode"}
+        ),
+        DetectBadAddress(
+            bcm_data_source,
+            {
+                "id_col": "user_id",
+                "address_col": ["address", "city"],
+                "score_cache_path": score_cache_path,
+            },
+        ),
+        [
+            TotalBlankCells(bcm_data_source, {"pc": False}),
+            TotalRowsCols(bcm_data_source),
+            DuplicateRows(bcm_data_source),
+            ExtractPIIAttributes(bcm_data_source),
+        ],
+        ClassifyClientNotes(
+            bcm_data_source,
+            {
+                "id_col": "user_id",
+                "notes_col": "client_notes",
+                "score_cache_path": score_cache_path,
+            },
+        ),
+        executor=executor_factory(executor_name),
+    )
+
+
 @app.route("/error")
 def error():
     return render_template("404.html")
@@ -87,51 +176,94 @@ def profiler_result():
 
 @app.route("/basic_profile", methods=["POST"])
 def basic_profile():
-    time.sleep(3)
-    return json.dumps({"success": True}), 200, {"ContentType": "application/json"}
+    job_id = job_queue.submit(
+        build_standard_dashboard,
+        app.config["DEMO_DATA_SOURCE"],
+        "mortgage_data_v4.csv",
+        app.config["METRIC_EXECUTOR"],
+        app.config["SCORE_CACHE_PATH"],
+    )
+    session["job_id"] = job_id
+    return (
+        json.dumps({"success": True, "job_id": job_id}),
+        200,
+        {"ContentType": "application/json"},
+    )
+
+
+@app.route("/job_status/<job_id>")
+def job_status(job_id):
+    try:
+        return jsonify(job_queue.status(job_id))
+    except KeyError:
+        return jsonify(job_id=job_id, state="unknown"), 404
+
+
+@app.route("/cancel_job/<job_id>", methods=["POST"])
+def cancel_job(job_id):
+    try:
+        job_queue.cancel(job_id)
+    except KeyError:
+        return jsonify(job_id=job_id, state="unknown"), 404
+    return jsonify(job_queue.status(job_id))
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # scraped by Prometheus; covers the work of the job workers, which is merged in as their jobs finish
+    return instrumentation.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.route("/dashboard_timings")
+def dashboard_timings():
+    dashboard_id = request.args.get("dashboard_id") or session.get("dashboard_id")
+    if dashboard_id is None or not result_store.exists(dashboard_id):
+        return jsonify(dashboard_id=dashboard_id, timings=None), 404
+    return jsonify(
+        dashboard_id=dashboard_id, timings=result_store.get_timing_breakdown(dashboard_id)
+    )
+
+
+def stored_dashboard_id():
+    # None when the session has expired or its results are gone, in which case views send the user back to start
+    dashboard_id = session.get("dashboard_id")
+    if dashboard_id is None or not result_store.exists(dashboard_id):
+        return None
+    return dashboard_id
+
+
+def expired_dashboard():
+    # the data views are fetched by the dashboard page, which sends the user back to the index on this response
+    return jsonify(error="expired"), 404
 
 
 @app.route("/output")
 def output():
-    bcm_data_source = InMemoryDataSource(
-        CSVReader(app.config["DEMO_DATA_SOURCE"], "mortgage_data_v4.csv")
-    )
-    dashboard = StandardDashboard(
-        BasicProfile(bcm_data_source),
-        ExtractDataRules(bcm_data_source),
-        GroupedZScore(
-            bcm_data_source,
-            {
-                "id_col": "user_id",
-                "group_key": "card_type",
-                "group_value": "credit_rate",
-            },
-        ),
-        ExtractBadPostcode(
-            bcm_data_source, {"id_col": "user_id", "postcd_col": "PostCode"}
-        ),
-        DetectBadAddress(
-            bcm_data_source, {"id_col": "user_id", "address_col": ["address", "city"]}
-        ),
-        [
-            TotalBlankCells(bcm_data_source, {"pc": False}),
-            TotalRowsCols(bcm_data_source),
-            DuplicateRows(bcm_data_source),
-            ExtractPIIAttributes(bcm_data_source),
-        ],
-        ClassifyClientNotes(
-            bcm_data_source, {"id_col": "user_id", "notes_col": "client_notes"}
-        ),
-    )
-    dashboard.calculate_dashboard()
-    cols = dashboard.get_column_names()
+    job_id = request.args.get("job_id") or session.get("job_id")
+    if job_id in job_queue.futures:
+        status = job_queue.status(job_id)
+        if status["state"] in ("queued", "running"):
+            # not waited on here: the progress page polls the job until it finishes
+            return render_template("calculating.html", job_id=job_id)
+        if status["state"] == "done":
+            # the session only holds the id; results are read from the store view by view
+            session["dashboard_id"] = job_queue.result(job_id)
+        job_queue.forget(job_id)
+        session.pop("job_id", None)
+        if status["state"] == "failed":
+            return render_template("calculating.html", job_failure="Profiling failed: " + str(status["error"]))
+        if status["state"] == "cancelled":
+            return render_template("calculating.html", job_failure="Profiling cancelled")
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return redirect(url_for("index"))
+    cols = result_store.get_column_names(dashboard_id)
     (
         headline_metric_results,
         headline_metric_labels,
         headline_metric_icons,
         headline_metric_colours,
-    ) = dashboard.get_headline_metrics()
-    session["dashboard"] = dashboard
+    ) = result_store.get_headline_metrics(dashboard_id)
     return render_template(
         "dashboard.html",
         no_headline_metrics=len(headline_metric_results),
@@ -146,15 +278,19 @@ def output():
 @app.route("/display_col", methods=["POST"])
 def display_col():
     col_name = request.form.get("col_name")
-    dashboard = session["dashboard"]
-    columnview = dashboard.get_columnwise_view(col_name)
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    columnview = result_store.get_columnwise_view(dashboard_id, col_name)
     return jsonify(col_name=col_name, columnview=columnview)
 
 
 @app.route("/get_tabular_data", methods=["GET", "POST"])
 def get_tabular_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_tabular_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "tabular")
     return jsonify(
         tabular=df.to_html(
             table_id="tabular_table",
@@ -166,8 +302,10 @@ def get_tabular_data():
 
 @app.route("/get_targets_data", methods=["GET", "POST"])
 def get_targets_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_targets_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "targets")
     return jsonify(
         targets=df.to_html(
             table_id="targets_table",
@@ -179,8 +317,10 @@ def get_targets_data():
 
 @app.route("/get_anomaly_data", methods=["GET", "POST"])
 def get_anomaly_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_anomaly_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "anomaly")
     df = df.head(10)
     return jsonify(
         anom_data=df.to_html(
@@ -193,8 +333,10 @@ def get_anomaly_data():
 
 @app.route("/get_ml_address_data", methods=["GET", "POST"])
 def get_ml_address_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_ml_address_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "ml_address")
     # app.logger.debug(df.loc[df["Validity Score"] < 0.5])
     df = df.drop_duplicates(subset=["addr", "Validity Score"]).head(
         20
@@ -210,8 +352,10 @@ def get_ml_address_data():
 
 @app.route("/get_postcode_data", methods=["GET", "POST"])
 def get_postcode_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_postcode_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "postcode")
     df = df.head(10)
     return jsonify(
         postcode_data=df.to_html(
@@ -224,15 +368,19 @@ def get_postcode_data():
 
 @app.route("/get_data_rules_data", methods=["GET", "POST"])
 def get_data_rules_data():
-    dashboard = session["dashboard"]
-    data_rules, ai_rules = dashboard.get_data_rules_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    data_rules, ai_rules = result_store.get_data_rules_view(dashboard_id)
     return jsonify(data_rules_data=data_rules, ai_rules_data=ai_rules)
 
 
 @app.route("/get_client_notes_data", methods=["GET", "POST"])
 def get_client_notes_data():
-    dashboard = session["dashboard"]
-    df = dashboard.get_client_notes_view()
+    dashboard_id = stored_dashboard_id()
+    if dashboard_id is None:
+        return expired_dashboard()
+    df = result_store.get_table_view(dashboard_id, "client_notes")
     df = df.loc[df["client_notes"] != ""]
     df = df.drop_duplicates(
         subset=["client_notes", "Confidence Score"]
@@ -0,0 +1,4 @@
+from app.profiler.metric_cache import metric_cache
+
+# importing app configures the metric cache for the web app; tests always calculate (MetricCacheTest turns it on)
+metric_cache.configure(enabled=False)
@@ -0,0 +1,40 @@
+import unittest
+import os
+import tempfile
+from app.benchmarks.synthetic import SyntheticMortgageData
+from app.benchmarks.runner import BenchmarkSuite, compare_results, read_results, write_results
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+
+class SyntheticDataTest(unittest.TestCase):
+    def test_seeded_and_shaped_like_demo(self):
+        generator = SyntheticMortgageData(2000, n_extra_columns=3, null_rate=0.1, cardinality=25, duplicate_rate=0.05, seed=3)
+        df = generator.generate()
+        assert_frame_equal(df, SyntheticMortgageData(2000, n_extra_columns=3, null_rate=0.1, cardinality=25, duplicate_rate=0.05, seed=3).generate())
+        demo = pd.read_csv(r'app/files/mortgage_data_v4.csv', nrows=5)
+        self.assertListEqual(df.columns.tolist()[:len(demo.columns)], demo.columns.tolist())
+        self.assertEqual(len(df.columns), len(demo.columns) + 3)
+        self.assertAlmostEqual(df["credit_rate"].isna().mean(), 0.1, delta=0.03)
+        self.assertLessEqual(df["city"].nunique(), 25)
+        self.assertGreater(df.duplicated().sum(), 0)
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    def test_run_and_compare(self):
+        suite = BenchmarkSuite(rows=[500], metrics=["total_rows_cols", "duplicate_rows", "data_rules"], repeat=1, isolate=False)
+        results = suite.run()
+        records = {(r["source"], r["metric"]): r for r in results["results"]}
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records[("sql", "data_rules")]["status"], "unsupported")
+        for source in ["in_memory", "sql"]:
+            record = records[(source, "total_rows_cols")]
+            self.assertEqual(record["status"], "ok")
+            self.assertGreater(record["rows_per_sec"], 0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "results.json")
+            write_results(results, path)
+            comparison = compare_results(read_results(path), results)
+        self.assertEqual(len(comparison), 6)
+        self.assertTrue((comparison["time_ratio"].dropna() == 1).all())
+        self.assertListEqual(comparison.loc[comparison["metric"] == "data_rules", "change"].tolist(), ["same", "unsupported"])
@@ -15,10 +15,32 @@ from app.profiler.metrics import (
     SupervisedAnomalyDetection,
 )
 from app.profiler.dashboards import Dashboard, StandardDashboard
+from app.profiler.executors import (
+    SerialExecutor,
+    ThreadPoolMetricExecutor,
+    ProcessPoolMetricExecutor,
+    executor_factory,
+)
+from app.profiler.jobs import JobQueue, JobCancelled
+from app.profiler.result_store import DashboardResultStore
+from app.profiler.instrumentation import instrumentation
+from app.profiler.metric_cache import metric_cache
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
 
+def build_demo_dashboard(delay=0, postcode_col='c'):
+    # module level so job queue workers can find it
+    time.sleep(delay)
+    demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+    dash = Dashboard()
+    dash.add_metrics([TotalRowsCols(demo_data_source),DuplicateRows(demo_data_source),ExtractBadPostcode(demo_data_source,{'id_col':'a','postcd_col':postcode_col})])
+    return dash
+
+
 class BasicCustomDashboardTest(unittest.TestCase):
 
     def test_custom_dashboard(self):
@@ -47,6 +69,150 @@ class BasicCustomDashboardTest(unittest.TestCase):
         self.assertEqual(trc, (3,3))
         self.assertEqual(tb, 0)
 
+    def test_executors_match_serial(self):
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        exp_results = None
+        for executor in [SerialExecutor(), ThreadPoolMetricExecutor(2), ProcessPoolMetricExecutor(2)]:
+            custom_dash = Dashboard(executor)
+            custom_dash.add_metrics([BasicProfile(demo_data_source,{'incl_graph':False}),TotalRowsCols(demo_data_source),DuplicateRows(demo_data_source)])
+            custom_dash.calculate_dashboard()
+            bp,trc,dr = custom_dash.get_all_results()
+            if exp_results is None:
+                exp_results = bp
+            assert_frame_equal(exp_results, bp)
+            self.assertEqual(trc, (3,3))
+            self.assertEqual(dr, 0)
+            self.assertEqual(len(custom_dash.get_metric_timings()), 3)
+
+    def test_process_workers_share_loaded_data(self):
+        # the parent loads the data once before forking rather than each worker loading it
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        custom_dash = Dashboard(executor_factory("process", 3))
+        custom_dash.add_metrics([TotalRowsCols(demo_data_source),TotalBlankCells(demo_data_source),DuplicateRows(demo_data_source)])
+        before = instrumentation.snapshot()
+        custom_dash.calculate_dashboard()
+        loads = instrumentation.diff(before)['counters'][('profiler_reader_loads_total', (('reader', 'CSVReader'),))]
+        self.assertEqual(loads, 1)
+
+    def test_concurrent_process_runs(self):
+        # each run's workers must calculate that run's metrics, whatever runs alongside it
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        metric_lists = [[TotalRowsCols(demo_data_source)] * 4, [TotalBlankCells(demo_data_source,{'pc':False})] * 4] * 2
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda metrics: [run.result for run in ProcessPoolMetricExecutor(2).run(metrics)], metric_lists))
+        self.assertListEqual(results, [[(3,3)] * 4, [0] * 4] * 2)
+
+    def test_executor_collects_errors(self):
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        custom_dash = Dashboard(ThreadPoolMetricExecutor(2))
+        custom_dash.add_metrics([TotalRowsCols(demo_data_source),ExtractBadPostcode(demo_data_source,{'id_col':'a','postcd_col':'missing'})])
+        with self.assertRaises(KeyError):
+            custom_dash.calculate_dashboard()
+        custom_dash.calculate_all_metrics(raise_errors=False)
+        self.assertEqual(custom_dash.metrics[0].get_result(), (3,3))
+        errors = custom_dash.get_metric_errors()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 'ExtractBadPostcode')
+
+
+class JobQueueTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.job_queue = JobQueue(max_workers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.job_queue.shutdown()
+
+    def test_job_result_and_progress(self):
+        job_id = self.job_queue.submit(build_demo_dashboard)
+        dash = self.job_queue.result(job_id, timeout=60)
+        self.assertEqual(dash.get_all_results()[:2], [(3,3), 0])
+        status = self.job_queue.status(job_id)
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['total'], 3)
+        self.assertCountEqual(status['completed'], ['TotalRowsCols', 'DuplicateRows', 'ExtractBadPostcode'])
+        self.job_queue.forget(job_id)
+        with self.assertRaises(KeyError):
+            self.job_queue.status(job_id)
+
+    def test_failed_and_cancelled_jobs(self):
+        failing = self.job_queue.submit(build_demo_dashboard, 0.5, postcode_col='missing')
+        cancelled = self.job_queue.submit(build_demo_dashboard)
+        self.job_queue.cancel(cancelled)
+        with self.assertRaises(KeyError):
+            self.job_queue.result(failing, timeout=60)
+        self.assertEqual(self.job_queue.status(failing)['state'], 'failed')
+        with self.assertRaises(JobCancelled):
+            self.job_queue.result(cancelled, timeout=60)
+        self.assertEqual(self.job_queue.status(cancelled)['state'], 'cancelled')
+
+    def test_worker_instrumentation_merged(self):
+        before = instrumentation.snapshot()
+        job_id = self.job_queue.submit(build_demo_dashboard)
+        self.job_queue.result(job_id, timeout=60)
+        # merged once, whether by result() or as the job finished
+        self.job_queue.result(job_id, timeout=60)
+        recorded = instrumentation.diff(before)
+        self.assertEqual(recorded['counters'][('profiler_metric_calls_total', (('metric', 'TotalRowsCols'), ('source', 'InMemoryDataSource'), ('status', 'ok')))], 1)
+        self.assertEqual(recorded['histograms'][('profiler_dashboard_duration_seconds', (('dashboard', 'Dashboard'),))][-1], 1)
+        self.job_queue.forget(job_id)
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_timing_breakdown(self):
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        for executor in [SerialExecutor(), ProcessPoolMetricExecutor(2)]:
+            before = instrumentation.snapshot()
+            custom_dash = Dashboard(executor)
+            custom_dash.add_metrics([TotalRowsCols(demo_data_source),DuplicateRows(demo_data_source),ExtractBadPostcode(demo_data_source,{'id_col':'a','postcd_col':'missing'})])
+            custom_dash.calculate_all_metrics(raise_errors=False)
+            breakdown = custom_dash.get_timing_breakdown()
+            self.assertGreater(breakdown['seconds'], 0)
+            self.assertCountEqual([m['metric'] for m in breakdown['metrics']], ['TotalRowsCols', 'DuplicateRows', 'ExtractBadPostcode'])
+            self.assertListEqual([m['seconds'] for m in breakdown['metrics']], sorted([m['seconds'] for m in breakdown['metrics']], reverse=True))
+            for m in breakdown['metrics']:
+                self.assertEqual(m['status'], 'error' if m['metric'] == 'ExtractBadPostcode' else 'ok')
+                self.assertEqual(m['rows'], 3)
+                self.assertEqual(m['queries'], 0)
+            # recorded in the worker processes too
+            recorded = instrumentation.diff(before)
+            self.assertEqual(recorded['counters'][('profiler_metric_calls_total', (('metric', 'ExtractBadPostcode'), ('source', 'InMemoryDataSource'), ('status', 'error')))], 1)
+
+    def test_cached_calls(self):
+        demo_data_source = InMemoryDataSource(CSVReader(r'app/files','demo_csv.csv'))
+        metric_cache.configure(enabled=True)
+        try:
+            metric = TotalRowsCols(demo_data_source)
+            metric()
+            self.assertFalse(metric.last_call_stats['cache_hit'])
+            metric()
+            self.assertTrue(metric.last_call_stats['cache_hit'])
+        finally:
+            metric_cache.clear()
+            metric_cache.configure(enabled=False)
+        text = instrumentation.render()
+        self.assertIn('profiler_metric_calls_total{metric="TotalRowsCols",source="InMemoryDataSource",status="cached"}', text)
+        self.assertIn('profiler_metric_cache_lookups_total{result="hit"}', text)
+        self.assertIn('profiler_reader_loads_total{reader="CSVReader"}', text)
+        self.assertIn('profiler_metric_duration_seconds_bucket{metric="TotalRowsCols",source="InMemoryDataSource",le="+Inf"}', text)
+
+    def test_render(self):
+        recorder = type(instrumentation)()
+        recorder.inc('profiler_sql_queries_total', status='ok')
+        recorder.observe('profiler_sql_query_duration_seconds', 0.2)
+        recorder.observe('profiler_sql_query_duration_seconds', 3)
+        other = type(instrumentation)()
+        other.merge(recorder.diff(other.snapshot()))
+        lines = other.render().splitlines()
+        self.assertIn('# TYPE profiler_sql_query_duration_seconds histogram', lines)
+        self.assertIn('profiler_sql_queries_total{status="ok"} 1', lines)
+        self.assertIn('profiler_sql_query_duration_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('profiler_sql_query_duration_seconds_bucket{le="0.25"} 1', lines)
+        self.assertIn('profiler_sql_query_duration_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('profiler_sql_query_duration_seconds_sum 3.2', lines)
+        self.assertIn('profiler_sql_query_duration_seconds_count 2', lines)
 
 
 class StandardDashboardTest(unittest.TestCase):
@@ -88,3 +254,19 @@ class StandardDashboardTest(unittest.TestCase):
     def test_get_columnview(self):
         columnview = self.dashboard.get_columnwise_view("mortgage_rate")
         self.assertIsInstance(columnview, str)
+
+    def test_result_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = DashboardResultStore(tmp_dir)
+            dashboard_id = store.save(self.dashboard)
+            self.assertTrue(store.exists(dashboard_id))
+            self.assertListEqual(store.get_column_names(dashboard_id), self.dashboard.get_column_names().tolist())
+            self.assertListEqual(list(store.get_headline_metrics(dashboard_id)), [list(x) for x in self.dashboard.get_headline_metrics()])
+            self.assertEqual(store.get_columnwise_view(dashboard_id, "mortgage_rate"), self.dashboard.get_columnwise_view("mortgage_rate"))
+            assert_frame_equal(store.get_table_view(dashboard_id, "postcode"), self.dashboard.get_postcode_view().reset_index(drop=True))
+            self.assertEqual(store.get_data_rules_view(dashboard_id), tuple(list(x) for x in self.dashboard.get_data_rules_view()))
+            self.assertEqual(store.get_timing_breakdown(dashboard_id), self.dashboard.get_timing_breakdown())
+            store.delete(dashboard_id)
+            self.assertFalse(store.exists(dashboard_id))
+            with self.assertRaises(KeyError):
+                store.get_summary("../" + dashboard_id[3:])
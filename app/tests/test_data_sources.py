@@ -1,6 +1,16 @@
 import unittest
-from app.profiler.tabular_readers import SQLTableReader, CSVReader, JSONReader, ExcelReader
-from app.profiler.data_sources import InMemoryDataSource
+import os
+import sqlite3
+import tempfile
+from app.profiler.tabular_readers import SQLTableReader, CSVReader, JSONReader, ExcelReader, ChunkedCSVReader
+from app.profiler.data_sources import InMemoryDataSource, StreamingDataSource, SQLDataSource
+from app.profiler.sql_connectors import SQLViewConnector
+from app.profiler.incremental import IncrementalStateStore, merge_hash_counts
+from app.profiler.metrics import TotalBlankCells, TotalRowsCols, BasicProfile, DuplicateRows, ExtractBadPostcode, GroupedZScore, ValidateFormats, ClassifyClientNotes
+from app.profiler.dashboards import Dashboard
+from app.profiler.metric_cache import metric_cache
+from app.profiler.instrumentation import instrumentation
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
@@ -23,6 +33,251 @@ class InMemDataSource(unittest.TestCase):
         res = ds.run_metric(demoMetric)
         self.assertEqual(res, 3)
 
+    def test_lazy_projection(self):
+        csv_reader = CSVReader(r'app/files','demo_csv.csv')
+        ds = InMemoryDataSource(csv_reader)
+        self.assertIsNone(csv_reader.data)
+        dash = Dashboard()
+        dash.add_metrics([ExtractBadPostcode(ds, {'id_col':'a','postcd_col':'c'})])
+        dash.calculate_dashboard()
+        self.assertListEqual(csv_reader.data.columns.tolist(), ['a', 'c'])
+        self.assertEqual(len(dash.metrics[0].get_result()), 3)
+        # a metric needing every column reloads the whole table
+        self.assertEqual(TotalRowsCols(ds)(), (3, 3))
+
+
+
+class StreamingDataSourceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.df = pd.DataFrame({
+                "user_id": ["U%03d" % i for i in range(500)],
+                "card_type": rng.choice(["Gold", "Classic", "Student"], 500),
+                "credit_rate": np.where(rng.random(500) > 0.95, 60.0, rng.normal(20, 2, 500)),
+                "postcode": rng.choice(["SE21 0AA", "RG4 4RF", "BAD", None], 500),
+            })
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.df.to_csv(os.path.join(cls.tmp_dir.name, "stream.csv"), index=False)
+        cls.in_mem = InMemoryDataSource(CSVReader(cls.tmp_dir.name, "stream.csv"))
+        cls.streaming = StreamingDataSource(ChunkedCSVReader(cls.tmp_dir.name, "stream.csv", chunksize=64))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_streaming_matches_in_mem(self):
+        self.assertEqual(TotalBlankCells(self.streaming, {'pc':False})(), TotalBlankCells(self.in_mem, {'pc':False})())
+        self.assertEqual(TotalRowsCols(self.streaming)(), (500, 4))
+        postcode_args = {'id_col':'user_id','postcd_col':'postcode'}
+        assert_frame_equal(ExtractBadPostcode(self.streaming, postcode_args)(), ExtractBadPostcode(self.in_mem, postcode_args)())
+        z_args = {'id_col':'user_id','group_key':'card_type','group_value':'credit_rate'}
+        assert_frame_equal(GroupedZScore(self.streaming, z_args)(), GroupedZScore(self.in_mem, z_args)())
+        z_args.update({'group_value':['credit_rate'],'conf':0.9})
+        assert_frame_equal(GroupedZScore(self.streaming, z_args)(), GroupedZScore(self.in_mem, z_args)())
+        format_args = {'rules':{'postcode':'uk_postcode','user_id':['uk_phone','email']},'n_samples':10}
+        assert_frame_equal(ValidateFormats(self.streaming, format_args)(), ValidateFormats(self.in_mem, format_args)())
+        dup_args = {'subset':['card_type','postcode'],'max_memory_bytes':1000}
+        self.assertEqual(DuplicateRows(self.streaming, dup_args)(), DuplicateRows(self.in_mem, dup_args)())
+        dup_args['return_groups'] = True
+        streamed_groups = DuplicateRows(self.streaming, dup_args)()
+        pd.testing.assert_series_equal(streamed_groups['group_size'], DuplicateRows(self.in_mem, dup_args)()['group_size'], check_names=False, check_index_type=False)
+
+    def test_streaming_edge_cases(self):
+        # a stream without any chunks still gives the usual (empty) result
+        postcode_args = {'id_col':'user_id','postcd_col':'postcode'}
+        accumulator = ExtractBadPostcode.create_accumulator(**postcode_args)
+        self.assertListEqual(accumulator.finalize().columns.tolist(), ['user_id', 'postcode'])
+        self.df.head(0).to_csv(os.path.join(self.tmp_dir.name, "empty.csv"), index=False)
+        empty = StreamingDataSource(ChunkedCSVReader(self.tmp_dir.name, "empty.csv"))
+        self.assertEqual(len(ExtractBadPostcode(empty, postcode_args)()), 0)
+        # graphs and exact profiles can't be streamed, so asking for them is an error rather than ignored
+        for args in [{'incl_graph':True}, {'approximate':False}]:
+            with self.assertRaises(ValueError):
+                BasicProfile(self.streaming, args)()
+
+    def test_dashboard_single_pass(self):
+        chunks_read = []
+        reader = self.streaming.data_reader
+        class CountingReader(ChunkedCSVReader):
+            def iter_chunks(self):
+                for chunk in super().iter_chunks():
+                    chunks_read.append(len(chunk))
+                    yield chunk
+        source = StreamingDataSource(CountingReader(reader.path, reader.filename, chunksize=64))
+        dash = Dashboard()
+        dash.add_metrics([BasicProfile(source), TotalRowsCols(source), TotalBlankCells(source)])
+        before = instrumentation.snapshot()
+        dash.calculate_dashboard()
+        self.assertEqual(sum(chunks_read), 500)
+        # the metrics shared the pass, so each read every row
+        self.assertListEqual([(m['rows'], m['batched']) for m in dash.get_timing_breakdown()['metrics']], [(500, True)] * 3)
+        # but the pass is only counted once
+        rows = {k[1]: v for k, v in instrumentation.diff(before)['counters'].items() if k[0] == 'profiler_metric_rows_total'}
+        self.assertEqual(rows, {(('metric', 'batch'), ('source', 'StreamingDataSource')): 500})
+        profile = dash.metrics[0].get_result().set_index("01. Column Name")
+        self.assertEqual(profile.loc["postcode", "04. Nulls"], self.df["postcode"].isna().sum())
+        self.assertEqual(profile.loc["card_type", "06. No. Unique Values"], 3)
+
         
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
+
+class MetricCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        pd.DataFrame({"a": [1, 2, 3, 3], "b": ["x", None, "y", "y"]}).to_csv(os.path.join(self.tmp_dir.name, "t.csv"), index=False)
+        metric_cache.configure(enabled=True, max_entries=2, disk_dir=os.path.join(self.tmp_dir.name, "cache"))
+
+    def tearDown(self):
+        metric_cache.clear()
+        metric_cache.configure(enabled=False)
+        self.tmp_dir.cleanup()
+
+    def test_unchanged_file_not_recalculated(self):
+        first = BasicProfile(InMemoryDataSource(CSVReader(self.tmp_dir.name, "t.csv")))()
+        reader = CSVReader(self.tmp_dir.name, "t.csv")
+        hits = metric_cache.stats()["hits"]
+        assert_frame_equal(BasicProfile(InMemoryDataSource(reader))(), first)
+        self.assertEqual(metric_cache.stats()["hits"], hits + 1)
+        self.assertIsNone(reader.data)
+        # other arguments are a different result
+        self.assertEqual(TotalBlankCells(InMemoryDataSource(reader), {'pc':True})(), 0.12)
+        self.assertEqual(TotalBlankCells(InMemoryDataSource(reader), {'pc':False})(), 1)
+        # a changed file is recalculated
+        pd.DataFrame({"a": [1], "b": ["x"]}).to_csv(os.path.join(self.tmp_dir.name, "t.csv"), index=False)
+        self.assertEqual(TotalRowsCols(InMemoryDataSource(CSVReader(self.tmp_dir.name, "t.csv")))(), (1, 2))
+
+    def test_lru_and_disk_tier(self):
+        source = InMemoryDataSource(CSVReader(self.tmp_dir.name, "t.csv"))
+        for pc in [True, False]:
+            TotalBlankCells(source, {'pc':pc})()
+        TotalRowsCols(source)()
+        self.assertEqual(metric_cache.stats()["entries"], 2)
+        # evicted from memory but still on disk
+        disk_hits = metric_cache.stats()["disk_hits"]
+        self.assertEqual(TotalBlankCells(source, {'pc':True})(), 0.12)
+        self.assertEqual(metric_cache.stats()["disk_hits"], disk_hits + 1)
+
+    def test_batched_metrics_cached(self):
+        chunks_read = []
+        class CountingReader(ChunkedCSVReader):
+            def iter_chunks(self):
+                for chunk in super().iter_chunks():
+                    chunks_read.append(len(chunk))
+                    yield chunk
+        for _ in range(2):
+            source = StreamingDataSource(CountingReader(self.tmp_dir.name, "t.csv", chunksize=2))
+            dash = Dashboard()
+            dash.add_metrics([TotalRowsCols(source), TotalBlankCells(source, {'pc':False})])
+            dash.calculate_all_metrics()
+            self.assertListEqual(dash.get_all_results(), [(4, 2), 1])
+        self.assertListEqual(chunks_read, [2, 2])
+
+    def test_model_file_in_key(self):
+        model_path = os.path.join(self.tmp_dir.name, "model.joblib")
+        with open(model_path, "wb") as f:
+            f.write(b"model")
+        metric = ClassifyClientNotes(InMemoryDataSource(CSVReader(self.tmp_dir.name, "t.csv")), {"model_path": model_path})
+        key = metric.cache_key()
+        self.assertEqual(metric.cache_key(), key)
+        # retrained and saved to the same path
+        with open(model_path, "wb") as f:
+            f.write(b"retrained model")
+        self.assertNotEqual(metric.cache_key(), key)
+
+    def test_version_column(self):
+        path = os.path.join(self.tmp_dir.name, "t.db")
+        with sqlite3.connect(path) as con:
+            con.execute("create table t (id integer primary key, a text)")
+            con.executemany("insert into t (a) values (?)", [["x"], ["y"]])
+        connector = SQLViewConnector("sqlite", {"path": path, "dbname": "main"}, table_name="t", version_column="id")
+        fingerprints = [connector.fingerprint()]
+        for statement in ["insert into t (a) values ('z')", "delete from t where id = 1"]:
+            with sqlite3.connect(path) as con:
+                con.execute(statement)
+            fingerprints.append(connector.fingerprint())
+        self.assertEqual(len(set(fingerprints)), 3)
+        self.assertEqual(connector.fingerprint(), fingerprints[-1])
+
+
+class IncrementalSQLTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "demo.db")
+        self.append(0, 200)
+        self.connector = SQLViewConnector("sqlite", {"path": self.path, "dbname": "main"}, table_name="demo")
+        self.store = IncrementalStateStore(os.path.join(self.tmp_dir.name, "state.db"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def append(self, start, stop):
+        # load_id is the watermark: each batch of rows is appended with a higher one, and rows repeat within a batch
+        rng = np.random.default_rng(start)
+        df = pd.DataFrame({
+                "load_id": np.arange(start, stop) // 50,
+                "card_type": rng.choice(["Gold", "Classic", None], stop - start),
+                "credit_rate": rng.choice([18.5, 20.0, np.nan], stop - start),
+            })
+        with sqlite3.connect(self.path) as con:
+            df.to_sql("demo", con, index=False, if_exists="append")
+
+    def results(self, source):
+        metrics = [TotalRowsCols(source), TotalBlankCells(source, {'pc':False}), DuplicateRows(source)]
+        dash = Dashboard()
+        dash.add_metrics(metrics)
+        dash.calculate_all_metrics()
+        return [int(r) if np.ndim(r) == 0 else r for r in dash.get_all_results()]
+
+    def test_matches_full_scan(self):
+        source = SQLDataSource(self.connector, watermark_column="load_id", state_store=self.store)
+        full = SQLDataSource(self.connector)
+        self.assertListEqual(self.results(source), self.results(full))
+        self.assertEqual(len(self.store), 3)
+        self.append(200, 330)
+        self.assertListEqual(self.results(source), self.results(full))
+        self.assertEqual(DuplicateRows(source)(), DuplicateRows(full)())
+        self.assertEqual(TotalBlankCells(source)(), TotalBlankCells(full)())
+
+    def test_only_new_rows_read(self):
+        source = SQLDataSource(self.connector, watermark_column="load_id", state_store=self.store)
+        self.assertEqual(TotalRowsCols(source)(), (200, 3))
+        # rows up to the watermark aren't read again, so changes to them (breaking the append-only contract) go unseen
+        with sqlite3.connect(self.path) as con:
+            con.execute("delete from demo where load_id < 2")
+        self.append(200, 250)
+        metric = TotalRowsCols(source)
+        self.assertEqual(metric(), (250, 3))
+        # the highest watermark, then the aggregates of the new rows
+        self.assertEqual(metric.last_call_stats['queries'], 2)
+        # a table whose highest watermark went backwards was reloaded, so is profiled from scratch
+        with sqlite3.connect(self.path) as con:
+            con.execute("delete from demo")
+        self.append(0, 60)
+        self.assertEqual(TotalRowsCols(source)(), (60, 3))
+
+    def test_duplicate_hashes_stored_by_row(self):
+        source = SQLDataSource(self.connector, watermark_column="load_id", state_store=self.store)
+        DuplicateRows(source)()
+        self.append(200, 330)
+        metric = DuplicateRows(source)
+        key = source.state_key(metric)
+        first = self.store.get_hash_counts(key)
+        metric()
+        # the state is just two counts; the hashes are stored a row each, and match a fresh scan of the whole table
+        self.assertDictEqual(self.store.get(key)[1], {"rows": 330, "distinct": len(self.store.get_hash_counts(key)[0])})
+        full = DuplicateRows.scan_increment(self.connector, "1 = 1", {})
+        for stored, expected in zip(self.store.get_hash_counts(key), full):
+            self.assertListEqual(stored.tolist(), expected.tolist())
+        # as merged in memory
+        for merged, expected in zip(merge_hash_counts(first, DuplicateRows.scan_increment(self.connector, "load_id > 3", {})), full):
+            self.assertListEqual(merged.tolist(), expected.tolist())
+        self.store.delete(key)
+        self.assertEqual(len(self.store.get_hash_counts(key)[0]), 0)
+
+    def test_needs_table_and_store(self):
+        with self.assertRaises(ValueError):
+            SQLDataSource(self.connector, watermark_column="load_id")
+        with self.assertRaises(ValueError):
+            SQLDataSource(self.connector, watermark_column="missing", state_store=self.store)
@@ -1,9 +1,30 @@
 import unittest
 from app.profiler.tabular_readers import SQLTableReader, CSVReader
 from app.profiler.data_sources import InMemoryDataSource, SQLDataSource
-from app.profiler.metrics import BasicProfile, TotalBlankCells, TotalRowsCols, DuplicateRows, DetectBadAddress, ExtractBadPostcode, GroupedZScore, SupervisedAnomalyDetection, ClassifyClientNotes
-from app.profiler.sql_connectors import SQLViewConnector
+from app.profiler.metrics import BasicProfile, TotalBlankCells, TotalRowsCols, DuplicateRows, DetectBadAddress, ExtractBadPostcode, ExtractDataRules, ExtractPIIAttributes, GroupedZScore, SupervisedAnomalyDetection, ClassifyClientNotes, ValidateFormats
+from app.profiler.sql_connectors import SQLViewConnector, SQLConnector
+from app.profiler.tabular_readers import DataFrameReader
+from app.profiler.dashboards import Dashboard
+from app.profiler.histograms import histogram_figure_json
+from app.profiler.model_registry import ModelRegistry, model_nbytes
+from app.profiler.inference import deduplicated_predict_proba
+from app.profiler.score_cache import ScoreCache
+from app.profiler.format_validators import get_format_validator, UK_POSTCODE_PATTERN
+from app.profiler.pii_detection import luhn_valid
+from app.profiler.row_hashing import HashCounter, hash_rows
+from app.profiler.rule_mining import RuleMiner
+from app.profiler.group_stats import clean_group_keys
+import joblib
+import itertools
+import datetime
+from unittest import mock
 from typing import Tuple
+import json
+import re
+import os
+import sqlite3
+import tempfile
+import shutil
 import pandas as pd
 import numpy as np
 from pandas.testing import assert_frame_equal
@@ -35,6 +56,70 @@ class StaticMetricTestsInMem(unittest.TestCase):
             })
         assert_frame_equal(ans,exp_results)
 
+    def test_fused_profile_matches_describe(self):
+        df = pd.DataFrame({
+                "symbol": ["A", None, "C", "A", "B", None],
+                "price": [12.5, None, 48, 14, 13, 12.5],
+                "qty": [1, 2, 3, 4, 5, 6],
+            })
+        ans = BasicProfile.calculate_in_mem(df, False).set_index("01. Column Name")
+        self.assertListEqual(ans["04. Nulls"].tolist(), [2, 1, 0])
+        self.assertListEqual(ans["06. No. Unique Values"].tolist(), [3, 4, 6])
+        stats = df.describe().T
+        for col, stat in [("07. Average Value", "mean"), ("08. Standard Deviation", "std"), ("09. Minimum", "min"),
+                          ("10. Maximum", "max"), ("11. 25%", "25%"), ("12. 50%", "50%"), ("13. 75%", "75%")]:
+            np.testing.assert_allclose(ans.loc[["price", "qty"], col].values, stats[stat].values)
+
+    def test_fused_profile_large_int_ids(self):
+        # ids above 2**53 collide once cast to float64, so distinct values are counted on the native dtype
+        ids = 2 ** 53 + np.arange(4, dtype=np.int64)
+        df = pd.DataFrame({
+                "id": ids,
+                "nullable_id": pd.array([ids[0], None, ids[1], ids[1]], dtype="Int64"),
+            })
+        ans = BasicProfile.calculate_in_mem(df, False).set_index("01. Column Name")
+        self.assertListEqual(ans["06. No. Unique Values"].tolist(), [4, 2])
+        self.assertListEqual(ans["04. Nulls"].tolist(), [0, 1])
+
+    def test_lazy_histograms(self):
+        df = pd.DataFrame({
+                "symbol": ["A", None, "C", "A", "B", None] * 100,
+                "price": np.arange(600) / 7,
+                "notes": ["note %d" % i for i in range(600)],
+            })
+        bp = BasicProfile(InMemoryDataSource(DataFrameReader(df)))
+        hist_data = bp().set_index("01. Column Name")["histogram_data"].apply(json.loads)
+        self.assertEqual(hist_data["price"]["kind"], "histogram")
+        self.assertEqual(len(hist_data["price"]["counts"]), 75)
+        self.assertEqual(sum(hist_data["price"]["counts"]), 600)
+        self.assertEqual(dict(zip(hist_data["symbol"]["labels"], hist_data["symbol"]["values"])), {"A": 200, "C": 100, "B": 100})
+        self.assertEqual(hist_data["notes"]["kind"], "counts")
+        self.assertNotIn("histogram_data", bp.get_tabular_view().columns)
+        view = json.loads(bp.get_result_for_column("price"))[0]
+        self.assertNotIn("histogram_data", view)
+        self.assertEqual(sum(json.loads(view["histogram_json"])["data"][0]["y"]), 600)
+        hits = histogram_figure_json.cache_info().hits
+        bp.get_result_for_column("price")
+        self.assertEqual(histogram_figure_json.cache_info().hits, hits + 1)
+
+    def test_histograms_bounded(self):
+        # datetimes are binned by time and other columns capped at max_categories bars, however many distinct values
+        df = pd.DataFrame({
+                "when": pd.to_datetime("2020-01-01") + pd.to_timedelta(np.arange(5000), "min"),
+                "code": pd.Series(["C%d" % (i % 300) for i in range(5000)], dtype="category"),
+                "flag": pd.Series(["y", "n", None] * 1000 + ["y"] * 2000, dtype="string"),
+            })
+        hist_data = BasicProfile(InMemoryDataSource(DataFrameReader(df)))().set_index("01. Column Name")["histogram_data"].apply(json.loads)
+        self.assertEqual(hist_data["when"]["kind"], "time_histogram")
+        self.assertEqual(len(hist_data["when"]["counts"]), 75)
+        self.assertEqual(sum(hist_data["when"]["counts"]), 5000)
+        self.assertEqual(len(hist_data["code"]["labels"]), 50)
+        self.assertEqual(hist_data["code"]["labels"][-1], "Other")
+        self.assertEqual(sum(hist_data["code"]["values"]), 5000)
+        self.assertEqual(dict(zip(hist_data["flag"]["labels"], hist_data["flag"]["values"])), {"y": 3000, "n": 1000})
+        for col in df.columns:
+            histogram_figure_json(json.dumps(hist_data[col]))
+
     def test_static_blanks(self):
         df = pd.DataFrame({
                 "symbol": ["A", "B", "C", "A", "B", "C"],
@@ -77,6 +162,51 @@ class StaticMetricTestsInMem(unittest.TestCase):
             })
         ans = DuplicateRows.calculate_in_mem(df)
         self.assertEqual(ans,1)  
+        self.assertEqual(DuplicateRows.calculate_in_mem(df, subset=["symbol"]), 3)
+        groups = DuplicateRows.calculate_in_mem(df, subset=["symbol"], return_groups=True)
+        self.assertListEqual(groups["symbol"].tolist(), ["A", "B", "C"])
+        self.assertListEqual(groups.index.tolist(), [0, 1, 2])
+        self.assertListEqual(groups["group_size"].tolist(), [2, 2, 2])
+
+    def test_dupe_row_hashing(self):
+        # nulls match whatever type their column is read as, and integers match floats
+        self.assertEqual(hash_rows(pd.DataFrame({"a": [None, None], "b": [1, 2]})).tolist(), hash_rows(pd.DataFrame({"a": [np.nan, np.nan], "b": [1.0, 2.0]})).tolist())
+        # values of different types don't match just because their strings do, but numbers match by value
+        mixed = pd.DataFrame({"a": [1, "1", 2.0, "2.0", 2, True, 1.0, datetime.date(2020, 1, 1), "2020-01-01", b"x", "x"]})
+        self.assertEqual(DuplicateRows.calculate_in_mem(mixed), mixed.duplicated().sum())
+        self.assertEqual(DuplicateRows.calculate_in_mem(mixed.iloc[[0, 1, 2, 3, 7, 8, 9, 10]]), 0)
+        # whether in many distinct values or few
+        many = pd.DataFrame({"a": [str(i) for i in range(3000)] + list(range(3000)) + [float(i) for i in range(3000)]})
+        self.assertEqual(DuplicateRows.calculate_in_mem(many), 3000)
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+                "id": rng.integers(0, 3000, 20000),
+                "name": rng.choice(["Ann", "Bob", None], 20000),
+                "code": np.array(["C%05d" % i for i in rng.integers(0, 5000, 20000)], dtype=object),
+            })
+        self.assertEqual(DuplicateRows.calculate_in_mem(df), df.duplicated().sum())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a budget well below the 24 bytes of each distinct row's record spills to disk
+            spilled = DuplicateRows.calculate_in_mem(df, max_memory_bytes=20000, spill_dir=tmp_dir)
+            self.assertEqual(spilled, df.duplicated().sum())
+            groups = DuplicateRows.calculate_in_mem(df, subset=["id", "name"], return_groups=True, max_memory_bytes=20000, spill_dir=tmp_dir)
+            self.assertListEqual(os.listdir(tmp_dir), [])
+        expected = df.groupby(["id", "name"], dropna=False).size()
+        expected = expected[expected > 1]
+        self.assertEqual(len(groups), len(expected))
+        self.assertEqual(groups["group_size"].sum(), expected.sum())
+        self.assertTrue(groups["group_size"].is_monotonic_decreasing)
+        first_rows = df.duplicated(["id", "name"], keep=False) & ~df.duplicated(["id", "name"])
+        self.assertListEqual(sorted(groups.index), df.index[first_rows].tolist())
+        # partitions outgrowing the budget are partitioned again
+        hashes = rng.integers(0, 2 ** 63, 5000).astype(np.uint64)[rng.integers(0, 5000, 20000)]
+        counter = HashCounter(max_memory_bytes=2000, partitions=4)
+        counter.add(hashes)
+        records = np.sort(np.concatenate(list(counter.iter_counts())), order="hash")
+        expected_hashes, first_rows, counts = np.unique(hashes, return_index=True, return_counts=True)
+        self.assertListEqual(records["hash"].tolist(), expected_hashes.tolist())
+        self.assertListEqual(records["count"].tolist(), counts.tolist())
+        self.assertListEqual(records["first_row"].tolist(), first_rows.tolist())
 
     def test_static_bad_address(self):
         
@@ -97,8 +227,119 @@ class StaticMetricTestsInMem(unittest.TestCase):
             })
         ans = ExtractBadPostcode.calculate_in_mem(df, **{'id_col':'user_id','postcd_col':'postcd'})
         ans = ans.values.tolist()
-        self.assertEqual(ans,[[1, 'DDDDDD'],[4,'453'],[5,'@2BG']]) 
-    
+        self.assertEqual(ans,[[1, 'DDDDDD'],[4,'453'],[5,'@2BG']])
+
+    def test_postcode_check_leaves_input_unchanged(self):
+        df = pd.DataFrame({
+                "user_id": [1, 2, 3, 4, 5, 6],
+                "postcd": ['DDDDDD', None, 'RG44RF', 'DDDDDD', np.nan, 12345],
+            }, index=[10, 11, 12, 13, 14, 15])
+        before = df.copy()
+        ans = ExtractBadPostcode.calculate_in_mem(df, **{'id_col':'user_id','postcd_col':'postcd'})
+        self.assertListEqual(ans['user_id'].tolist(), [1, 2, 4, 5])
+        self.assertListEqual(ans.index.tolist(), [10, 11, 13, 14])
+        assert_frame_equal(df, before)
+
+    def test_format_validators(self):
+        cases = {
+            "email": (["a.b@x.co.uk", "first+tag@example.com"], ["bad@", "x@y", "a b@c.com", None]),
+            "ni_number": (["AB 12 34 56 C", "ab123456d"], ["QQ123456C", "GB123456A", "AB123456E"]),
+            "uk_phone": (["020 7946 0958", "+44 7700 900123", "07700900123"], ["12345", "0207946095812", "phone"]),
+        }
+        for name, (valid, invalid) in cases.items():
+            result = get_format_validator(name).is_valid(pd.Series(valid + invalid))
+            self.assertListEqual(result.tolist(), [True] * len(valid) + [False] * len(invalid), name)
+        with self.assertRaises(ValueError):
+            get_format_validator("zip_code")
+
+    def test_validate_formats(self):
+        df = pd.DataFrame({
+                "postcd": ['SE21 0AA', 'BAD', 'BAD', None, 'RG4 4RF', '453'],
+                "contact": ['07700 900123', 'a@b.com', 'nope', 'nope', None, '+44 20 7946 0958'],
+                "ni": ['AB123456C', 'AB123456C', 'XX', None, None, None],
+            })
+        ans = ValidateFormats.calculate_in_mem(df, rules={'postcd':'uk_postcode','contact':['uk_phone','email'],'ni':'ni_number'})
+        self.assertListEqual(ans['Rows Checked'].tolist(), [5, 5, 3])
+        self.assertListEqual(ans['Invalid Count'].tolist(), [3, 2, 1])
+        self.assertListEqual(ans['Invalid Samples'].tolist(), [['BAD', '453'], ['nope'], ['XX']])
+        self.assertEqual(ans.loc[1, 'Formats'], 'uk_phone, email')
+        self.assertEqual(ans.loc[0, 'Invalid %'], 60.0)
+
+    def test_extract_data_rules(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        card = rng.choice(["Student", "Classic", "Gold"], n)
+        country = rng.choice(["ENGLAND", "SCOTLAND"], n)
+        df = pd.DataFrame({
+                "user_id": ["U%04d" % i for i in range(n)],
+                "gender": rng.choice(["M", "F"], n),
+                "card_type": card,
+                "mortgage_type": np.where(card == "Student", "Interest-only", rng.choice(["Fixed", "Interest-only"], n)),
+                "country": country,
+                "region": np.where(country == "ENGLAND", "ENG", "SCO"),
+                "credit_rate": np.where(rng.random(n) < 0.1, np.nan, rng.uniform(10, 30, n)),
+                "loan_amount": rng.integers(50000, 500000, n),
+            })
+        rules, ai_rules = ExtractDataRules.calculate_in_mem(df)
+        self.assertIn('"user_id" is unique', rules)
+        self.assertIn('"gender" takes the values ("F","M")', rules)
+        self.assertTrue(any(r.startswith('"credit_rate" contains 1') for r in rules))
+        self.assertIn('"loan_amount" is between {0} and {1}'.format(df.loan_amount.min(), df.loan_amount.max()), rules)
+        self.assertIn('Rows with "card_type" = "Student" always have "mortgage_type" = "Interest-only"', ai_rules)
+        self.assertIn('"country" and "region" map one to one - one of them could be dropped', ai_rules)
+        # implied by the one to one mapping, so not repeated value by value
+        self.assertFalse(any('"region" = ' in r for r in ai_rules))
+        sampled = ExtractDataRules.calculate_in_mem(df, sample_rows=500)
+        self.assertListEqual(sampled[0], rules)
+
+    def test_data_rules_time_budget(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        a = rng.choice(["x", "y"], n)
+        b = np.where(rng.random(n) < 0.9, a, "z")
+        df = pd.DataFrame({
+                "a": a,
+                "b": b,
+                "c": np.where((a == "x") & (b == "x"), "p", rng.choice(["p", "q"], n)),
+                "d": rng.choice(["u", "v"], n),
+            })
+        miner = RuleMiner(min_confidence=0.5, min_lift=1.0, min_improvement=0.0, max_rules=1000)
+        columns = miner.factorize_columns(df)
+        full = miner.association_rules(columns, np.inf)
+        self.assertTrue(any(" and " in r for r in full))
+        # a clock that passes the deadline after the given number of steps of the search, which is depth first so
+        # stops having found some itemsets but not all their subsets
+        for steps in range(1, 12):
+            with mock.patch("app.profiler.rule_mining.time") as clock:
+                clock.perf_counter.side_effect = itertools.count()
+                partial = miner.association_rules(columns, steps - 0.5)
+            self.assertTrue(set(partial) <= set(full))
+
+    def test_extract_pii(self):
+        self.assertListEqual(luhn_valid(pd.Series(["4111 1111 1111 1111", "4111111111111112", "5555-5555-5555-4444"])).tolist(), [True, False, True])
+        n = 30000
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+                "id": np.arange(n),
+                "Surname": rng.choice(["Smith", "Jones", "O'Brien"], n),
+                "contact": np.where(np.arange(n) < n // 2, "user@example.com", "07700 900123"),
+                "notes": np.where(rng.random(n) < 0.8, "a@b.com", "n/a"),
+                "PostCode": rng.choice(["SE21 0AA", "RG4 4RF", "BAD"], n),
+                "pan": np.where(rng.random(n) < 0.9, "4111111111111111", "4111111111111112"),
+                "dob": pd.to_datetime("1980-01-01") + pd.to_timedelta(rng.integers(0, 10000, n), "D"),
+                "city": rng.choice(["Leeds", "Bristol"], n),
+                "amount": rng.random(n),
+            })
+        ans = ExtractPIIAttributes.calculate_in_mem(df).set_index("Column")
+        self.assertDictEqual(ans["PII Type"].dropna().to_dict(), {"Surname": "name", "notes": "email", "PostCode": "postcode", "pan": "card_number", "dob": "dob"})
+        # half phone numbers, half emails: neither type is close to the rate needed, so the sample decides
+        self.assertEqual(ans.loc["contact", "Scan"], "sample")
+        # ~80% emails is too close to the 80% needed to trust the sample
+        self.assertEqual(ans.loc["notes", "Scan"], "full")
+        pii = ExtractPIIAttributes(InMemoryDataSource(DataFrameReader(df)))
+        pii()
+        self.assertEqual(pii.get_headline_result(), "5/9")
+
 
 
 
@@ -162,6 +403,183 @@ class CSVMetricTestsBCM(unittest.TestCase):
         #print(csv_groupz())
         self.assertIsInstance(csv_groupz(), pd.DataFrame)
 
+    def test_grouped_z_vectorised(self):
+        df = pd.read_csv("app/files/mortgage_data_v4.csv", nrows=2000)
+        # reference: the original two-transform implementation
+        ref = df[['user_id','card_type','credit_rate']].copy()
+        ref['card_type'] = ref['card_type'].apply(lambda x: re.sub(r"[^\x00-\x7F]+", "", str(x)))
+        grouped = ref.groupby('card_type')['credit_rate']
+        z = ((ref['credit_rate'] - grouped.transform('mean')) / grouped.transform('std')).abs()
+        for conf, crit in [(0.99, 2.33), (0.95, 1.645), (0.975, 1.959964)]:
+            result = GroupedZScore.calculate_in_mem(df, 'user_id', 'card_type', 'credit_rate', conf)
+            self.assertListEqual(result.index.tolist(), ref.index[z > crit].tolist())
+        multi = GroupedZScore.calculate_in_mem(df, 'user_id', 'card_type', ['credit_rate','loan_amount'], 0.95)
+        self.assertListEqual(multi.columns.tolist(), ['user_id','card_type','Column','avg','Value'])
+        single = GroupedZScore.calculate_in_mem(df, 'user_id', 'card_type', 'loan_amount', 0.95)
+        self.assertListEqual(multi[multi['Column'] == 'loan_amount']['user_id'].tolist(), single['user_id'].tolist())
+        with self.assertRaises(ValueError):
+            GroupedZScore.calculate_in_mem(df, 'user_id', 'card_type', 'credit_rate', 1.5)
+        with self.assertRaises(ValueError):
+            GroupedZScore.calculate_in_mem(df, 'user_id', 'card_type', [])
+        # missing keys are a group of their own
+        codes, labels = clean_group_keys(pd.Series(["Gold", None, "Gold", np.nan], dtype=object))
+        self.assertListEqual(codes.tolist(), [0, 1, 0, 1])
+        self.assertListEqual(labels.tolist(), ["Gold", "nan"])
+
+class BatchedInferenceTest(unittest.TestCase):
+    def test_batched_matches_single_call(self):
+        df = pd.read_csv("app/files/mortgage_data_v4.csv", nrows=600)
+        args = {'id_col':'user_id','address_col':['address','city']}
+        whole = DetectBadAddress.calculate_in_mem(df, **args, batch_size=None)
+        assert_frame_equal(whole, DetectBadAddress.calculate_in_mem(df, **args, batch_size=128))
+        assert_frame_equal(whole, DetectBadAddress.calculate_in_mem(df, **args, batch_size=128, n_jobs=2))
+        args = {'id_col':'user_id','notes_col':'client_notes'}
+        whole = ClassifyClientNotes.calculate_in_mem(df, **args, batch_size=None)
+        assert_frame_equal(whole, ClassifyClientNotes.calculate_in_mem(df, **args, batch_size=100, n_jobs=3))
+
+    def test_dedupe_and_score_cache(self):
+        df = pd.read_csv("app/files/mortgage_data_v4.csv", nrows=600)
+        args = {'id_col':'user_id','address_col':['address','city'],'batch_size':None}
+        exact = DetectBadAddress.calculate_in_mem(df, **args, dedupe=False)
+        assert_frame_equal(exact, DetectBadAddress.calculate_in_mem(df, **args, dedupe=True))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "scores.db")
+            assert_frame_equal(exact, DetectBadAddress.calculate_in_mem(df, **args, score_cache_path=path))
+            assert_frame_equal(exact, DetectBadAddress.calculate_in_mem(df, **args, score_cache_path=path))
+
+    def test_dedupe_default_only_for_known_models(self):
+        df = pd.read_csv("app/files/mortgage_data_v4.csv", nrows=200)
+        args = {'id_col':'user_id','notes_col':'client_notes'}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # the same model under another path may not ignore case and whitespace as far as the registry knows
+            path = os.path.join(tmp_dir, "model.joblib")
+            shutil.copy("app/models/notification_model.joblib", path)
+            for model_path, deduped in [("app/models/notification_model.joblib", True), (path, False)]:
+                with mock.patch("app.profiler.metrics.deduplicated_predict_proba", wraps=deduplicated_predict_proba) as dedupe:
+                    ClassifyClientNotes.calculate_in_mem(df, **args, model_path=model_path)
+                self.assertEqual(dedupe.called, deduped)
+
+    def test_cached_text_not_rescored(self):
+        class LengthModel(object):
+            scored = 0
+            def predict_proba(self, X):
+                self.scored += len(X)
+                lengths = X.str.len().to_numpy(dtype=float)
+                return np.column_stack([1 / (1 + lengths), lengths / (1 + lengths)])
+        texts = pd.Series(["a b", "A  b", "ccc", "a b", "dd"])
+        model = LengthModel()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = ScoreCache(os.path.join(tmp_dir, "scores.db"))
+            first = deduplicated_predict_proba(model, texts, score_cache=cache, model_hash="m1")
+            self.assertEqual(model.scored, 3)
+            self.assertEqual(len(cache), 3)
+            second = deduplicated_predict_proba(model, pd.concat([texts, pd.Series(["eeee"])]), score_cache=cache, model_hash="m1")
+            self.assertEqual(model.scored, 4)
+            np.testing.assert_array_equal(first, second[:5])
+            self.assertAlmostEqual(second[5, 1], 0.8)
+
+
+class ModelRegistryTest(unittest.TestCase):
+    def test_load_once_and_reload_on_change(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "model.joblib")
+            joblib.dump({"weights": np.arange(1000.0)}, path)
+            registry = ModelRegistry(mmap_mode="r")
+            model = registry.get(path)
+            self.assertIsInstance(model["weights"], np.memmap)
+            self.assertIs(registry.get(path), model)
+            stats = registry.stats()[path]
+            self.assertEqual((stats["loads"], stats["hits"]), (1, 1))
+            self.assertGreater(stats["file_bytes"], 8000)
+            # the memory-mapped weights aren't in memory
+            self.assertLess(stats["memory_bytes"], 8000)
+            self.assertGreater(model_nbytes(joblib.load(path)), 8000)
+            joblib.dump({"weights": np.arange(10.0)}, path)
+            os.utime(path, ns=(0, 0))
+            self.assertEqual(len(registry.get(path)["weights"]), 10)
+            self.assertEqual(registry.stats()[path]["loads"], 2)
+            registry.clear()
+
+
+class SQLiteMetricTests(unittest.TestCase):
+    ''' push-down SQL metrics against a sqlite stand-in, checked against the in-memory versions '''
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        cls.df = pd.DataFrame({
+                "user_id": ["U%03d" % i for i in range(300)],
+                "card_type": rng.choice(["Gold", "Classic", "Student"], 300),
+                "credit_rate": np.where(rng.random(300) > 0.97, 60.0, rng.normal(20, 2, 300)),
+                "PostCode": rng.choice(["SE21 0AA", "RG4 4RF", "BAD", "453", None], 300),
+            })
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.tmp_dir.name, "demo.db")
+        with sqlite3.connect(path) as con:
+            cls.df.to_sql("demo", con, index=False)
+        connector = SQLViewConnector("sqlite", {"path": path, "dbname": "main"}, table_name="demo")
+        cls.sql_source = SQLDataSource(connector)
+        cls.in_mem_source = InMemoryDataSource(DataFrameReader(cls.df))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_aggregates(self):
+        self.assertEqual(TotalRowsCols(self.sql_source)(), (300, 4))
+        self.assertEqual(TotalBlankCells(self.sql_source, {'pc':False})(), TotalBlankCells(self.in_mem_source, {'pc':False})())
+        sql_profile = BasicProfile(self.sql_source)().set_index("01. Column Name")
+        mem_profile = BasicProfile(self.in_mem_source, {'incl_graph':False})().set_index("01. Column Name")
+        for col in ["04. Nulls", "06. No. Unique Values", "07. Average Value", "08. Standard Deviation", "09. Minimum", "10. Maximum"]:
+            pd.testing.assert_series_equal(sql_profile[col], mem_profile[col], check_dtype=False)
+
+    def test_dashboard_single_scan(self):
+        queries = []
+        connector = self.sql_source.sql_view_connector.sql_connector
+        run_query = connector.run_query
+        def counting_run_query(query, params=None):
+            queries.append(str(query))
+            return run_query(query, params)
+        connector.run_query = counting_run_query
+        try:
+            dash = Dashboard()
+            dash.add_metrics([BasicProfile(self.sql_source), TotalRowsCols(self.sql_source), TotalBlankCells(self.sql_source, {'pc':True})])
+            dash.calculate_dashboard()
+        finally:
+            del connector.run_query
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(dash.metrics[1].get_result(), (300, 4))
+
+    def test_portable_regexp(self):
+        # databases other than sqlite (whose REGEXP is python's re) get POSIX classes in place of \\s
+        pattern = SQLConnector.regexp_pattern(UK_POSTCODE_PATTERN)
+        self.assertNotIn("\\s", pattern)
+        self.assertIn("[[:space:]]?", pattern)
+        sqlite_pattern = self.sql_source.sql_view_connector.sql_connector.regexp_pattern(UK_POSTCODE_PATTERN)
+        self.assertEqual(sqlite_pattern, UK_POSTCODE_PATTERN)
+
+    def test_row_level_pushdown(self):
+        postcode_args = {'id_col':'user_id','postcd_col':'PostCode'}
+        sql_postcodes = ExtractBadPostcode(self.sql_source, postcode_args)()
+        mem_postcodes = ExtractBadPostcode(self.in_mem_source, postcode_args)()
+        self.assertListEqual(sql_postcodes["user_id"].tolist(), mem_postcodes["user_id"].tolist())
+        z_args = {'id_col':'user_id','group_key':'card_type','group_value':'credit_rate'}
+        sql_z = GroupedZScore(self.sql_source, z_args)().sort_values("user_id").reset_index(drop=True)
+        mem_z = GroupedZScore(self.in_mem_source, z_args)().sort_values("user_id").reset_index(drop=True)
+        assert_frame_equal(sql_z, mem_z)
+        z_args.update({'group_value':['credit_rate'],'conf':0.9})
+        sql_z = GroupedZScore(self.sql_source, z_args)().sort_values(["Column","user_id"]).reset_index(drop=True)
+        mem_z = GroupedZScore(self.in_mem_source, z_args)().sort_values(["Column","user_id"]).reset_index(drop=True)
+        assert_frame_equal(sql_z, mem_z, check_dtype=False)
+
+    def test_duplicates(self):
+        self.assertEqual(DuplicateRows(self.sql_source)(), DuplicateRows(self.in_mem_source)())
+        dup_args = {'subset':['card_type','PostCode']}
+        self.assertEqual(DuplicateRows(self.sql_source, dup_args)(), DuplicateRows(self.in_mem_source, dup_args)())
+        dup_args['return_groups'] = True
+        sql_groups = DuplicateRows(self.sql_source, dup_args)().sort_values(['card_type','PostCode']).reset_index(drop=True)
+        mem_groups = DuplicateRows(self.in_mem_source, dup_args)().sort_values(['card_type','PostCode']).reset_index(drop=True)
+        assert_frame_equal(sql_groups, mem_groups, check_dtype=False)
+
 # class CSVMetricTestsIns(unittest.TestCase):
 #     @classmethod
 #     def setUpClass(cls):
@@ -0,0 +1,83 @@
+import unittest
+import json
+from app.profiler.sketches import HyperLogLog, KLLSketch
+from app.profiler.column_stats import ApproximateColumnProfile
+from app.profiler.metrics import BasicProfile
+import pandas as pd
+import numpy as np
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_count_within_error(self):
+        values = pd.Series(np.arange(200000) % 50000)
+        hll = HyperLogLog(12).update(values)
+        self.assertLess(abs(hll.count() - 50000) / 50000, 4 * hll.relative_error)
+
+    def test_small_counts_exact(self):
+        hll = HyperLogLog().update(pd.Series(["a", "b", "c", "a", None]))
+        self.assertEqual(hll.count(), 3)
+
+    def test_merge_and_serialise(self):
+        a = HyperLogLog(12).update(pd.Series(np.arange(0, 30000)))
+        b = HyperLogLog(12).update(pd.Series(np.arange(20000, 50000)))
+        a.merge(HyperLogLog.from_dict(json.loads(json.dumps(b.to_dict()))))
+        self.assertLess(abs(a.count() - 50000) / 50000, 4 * a.relative_error)
+
+
+class KLLSketchTest(unittest.TestCase):
+
+    def test_exact_until_compacted(self):
+        sketch = KLLSketch(200).update([3, 1, 2, 4, np.nan])
+        self.assertEqual(sketch.quantile(0.25), 1.75)
+        self.assertEqual(sketch.rank_error, 0.0)
+
+    def test_quantiles_within_rank_error(self):
+        values = np.random.default_rng(0).permutation(100000).astype(float)
+        sketch = KLLSketch(200, seed=0)
+        for chunk in np.array_split(values, 10):
+            sketch.merge(KLLSketch(200, seed=1).update(chunk))
+        sketch = KLLSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+        self.assertEqual(sketch.n, 100000)
+        for q in [0.25, 0.5, 0.75]:
+            self.assertLess(abs(sketch.quantile(q) / 100000 - q), 3 * sketch.rank_error)
+
+
+class ApproximateProfileTest(unittest.TestCase):
+
+    def test_matches_exact_on_small_data(self):
+        df = pd.DataFrame({
+                "symbol": ["A", "B", "C", "A", "B", None],
+                "price": [12, 24, 48, 14, 13, 20],
+            })
+        exact = BasicProfile.calculate_in_mem(df, False)
+        approx = BasicProfile.calculate_in_mem(df, False, approximate=True)
+        for col in exact.columns:
+            pd.testing.assert_series_equal(exact[col], approx[col], check_dtype=False)
+        self.assertIn("14. Distinct Count Error", approx.columns)
+
+    def test_chunks_merge(self):
+        df = pd.DataFrame({"a": np.arange(1000) % 37, "b": np.where(np.arange(1000) % 10 == 0, None, "x")})
+        whole = ApproximateColumnProfile().update(df).finalize()
+        parts = [ApproximateColumnProfile().update(chunk) for chunk in np.array_split(df, 4)]
+        merged = ApproximateColumnProfile.from_dict(parts[0].to_dict())
+        for p in parts[1:]:
+            merged.merge(ApproximateColumnProfile.from_dict(json.loads(json.dumps(p.to_dict()))))
+        pd.testing.assert_frame_equal(whole, merged.finalize())
+
+    def test_mixed_type_partitions_merge(self):
+        # a column that is numeric in one partition and text in another is profiled as object, as it would be whole
+        numbers = pd.DataFrame({"a": np.arange(100)})
+        text = pd.DataFrame({"a": ["x%d" % i for i in range(50)] + [None] * 5})
+        whole = ApproximateColumnProfile().update(pd.concat([numbers, text], ignore_index=True)).finalize()
+        for first, second in [(numbers, text), (text, numbers)]:
+            merged = ApproximateColumnProfile().update(first).merge(ApproximateColumnProfile().update(second))
+            self.assertFalse(merged.columns["a"].numeric)
+            # ints are hashed by value in an int column but as objects in the whole one, so only the estimates agree
+            distinct = "06. No. Unique Values"
+            self.assertAlmostEqual(merged.finalize()[distinct][0], 151, delta=3)
+            pd.testing.assert_frame_equal(whole.drop(columns=distinct), merged.finalize().drop(columns=distinct))
+
+
+if __name__ == '__main__':
+    unittest.main()
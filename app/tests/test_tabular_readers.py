@@ -1,5 +1,11 @@
 import unittest
-from app.profiler.tabular_readers import SQLTableReader, CSVReader, JSONReader, ExcelReader
+import os
+import tempfile
+import sqlite3
+from app.profiler.tabular_readers import SQLTableReader, CSVReader, JSONReader, ExcelReader, ChunkedSQLReader
+from app.profiler.columnar_cache import ColumnarCache
+from app.profiler.engine_registry import EngineRegistry, engine_registry
+from sqlalchemy.sql import text
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
@@ -37,6 +43,128 @@ class DataFileReadInTest(unittest.TestCase):
                 "c": ["cat", "dog", "apple"],
                 })            
         assert_frame_equal(exp_results, excel_reader.get_data())
+
+    def test_column_projection(self):
+        for reader_cls, filename in [(CSVReader, 'demo_csv.csv'), (JSONReader, 'demo_json.json'), (ExcelReader, 'demo_xlsx.xlsx')]:
+            reader = reader_cls(r'app/files', filename)
+            self.assertListEqual(reader.get_column_names().tolist(), ['a', 'b', 'c'])
+            self.assertListEqual(reader.get_data(['c', 'a']).columns.tolist(), ['a', 'c'])
+            self.assertListEqual(reader.get_data().columns.tolist(), ['a', 'b', 'c'])
+
+
+class SQLiteReadInTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_creds = {'path': os.path.join(self.tmp_dir.name, 'demo.db'), 'dbname': 'main'}
+        self.df = pd.DataFrame({"a": range(10), "b": [x * 0.5 for x in range(10)], "c": list("abcdefghij")})
+        with sqlite3.connect(self.db_creds['path']) as con:
+            self.df.to_sql("demo", con, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def count_queries(self, reader):
+        queries = []
+        run_query, iter_query = reader.sql_connector.run_query, reader.sql_connector.iter_query
+        reader.sql_connector.run_query = lambda q, params=None: queries.append(q) or run_query(q, params)
+        reader.sql_connector.iter_query = lambda q, params=None, chunksize=100000: queries.append(q) or iter_query(q, params, chunksize)
+        return queries
+
+    def test_table_runs_query_once(self):
+        reader = SQLTableReader('sqlite', self.db_creds, table_name='demo', chunksize=3)
+        queries = self.count_queries(reader)
+        self.assertListEqual(reader.get_column_names().tolist(), ['a', 'b', 'c'])
+        assert_frame_equal(self.df, reader.get_data())
+        self.assertEqual(len(queries), 1)
+
+    def test_projection_quotes_columns(self):
+        df = pd.DataFrame({"first name": ["a", "b"], "Order": [1, 2], "c": [0.5, 1.5]})
+        with sqlite3.connect(self.db_creds['path']) as con:
+            df.to_sql("people", con, index=False)
+        reader = SQLTableReader('sqlite', self.db_creds, table_name='people')
+        assert_frame_equal(df[["first name", "Order"]], reader.get_data(["first name", "Order"]))
+
+    def test_custom_sql_metadata(self):
+        reader = SQLTableReader('sqlite', self.db_creds, custom_sql='select c, a from main.demo where a > 4')
+        self.assertListEqual(reader.get_column_names().tolist(), ['c', 'a'])
+        self.assertListEqual(reader.get_data()['a'].tolist(), [5, 6, 7, 8, 9])
+        # a trailing ";" is dropped before the query is wrapped
+        reader = SQLTableReader('sqlite', self.db_creds, custom_sql='select c, a from main.demo where a > 4 ;\n')
+        self.assertListEqual(reader.get_column_names().tolist(), ['c', 'a'])
+        self.assertListEqual(reader.get_data(['a'])['a'].tolist(), [5, 6, 7, 8, 9])
+
+    def test_chunked_sql(self):
+        reader = ChunkedSQLReader('sqlite', self.db_creds, table_name='demo', chunksize=4)
+        chunks = list(reader.iter_chunks())
+        self.assertListEqual([len(c) for c in chunks], [4, 4, 2])
+        assert_frame_equal(self.df, pd.concat(chunks, ignore_index=True))
+
+    def test_readers_share_engine(self):
+        first = SQLTableReader('sqlite', self.db_creds, table_name='demo')
+        second = ChunkedSQLReader('sqlite', self.db_creds, table_name='demo')
+        self.assertIs(first.sql_connector.engine, second.sql_connector.engine)
+        self.assertIn(repr(first.sql_connector.engine.url), engine_registry.stats())
+        engine_registry.dispose('sqlite:///' + self.db_creds['path'])
+
+    def test_registry_pool_stats(self):
+        registry = EngineRegistry(pool_size=2, max_overflow=1)
+        engine = registry.get_engine('sqlite:///' + self.db_creds['path'], connect_args={"check_same_thread": False})
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+            stats = registry.stats()['sqlite:///' + self.db_creds['path']]
+            self.assertEqual(stats['size'], 2)
+            self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(registry.stats()['sqlite:///' + self.db_creds['path']]['checked_in'], 1)
+        registry.dispose()
+        self.assertEqual(registry.stats(), {})
+        with self.assertRaises(ValueError):
+            registry.configure(pool_timeout=5)
+
+    def test_registry_forked_child_gets_own_pool(self):
+        registry = EngineRegistry()
+        engine = registry.get_engine('sqlite:///' + self.db_creds['path'], connect_args={"check_same_thread": False})
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+        pool = engine.pool
+        self.assertEqual(pool.checkedin(), 1)
+        # as run in a forked child
+        registry._after_fork()
+        self.assertIsNot(engine.pool, pool)
+        self.assertEqual(engine.pool.checkedin(), 0)
+        # the parent's connection is left open
+        self.assertEqual(pool.checkedin(), 1)
+        registry.dispose()
+        pool.dispose()
+
+
+@unittest.skipUnless(ColumnarCache.is_available(), "pyarrow is not installed")
+class ColumnarCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ColumnarCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cached_readers_match(self):
+        for reader_cls, filename in [(CSVReader, 'demo_csv.csv'), (JSONReader, 'demo_json.json'), (ExcelReader, 'demo_xlsx.xlsx')]:
+            uncached = reader_cls(r'app/files', filename).get_data()
+            assert_frame_equal(uncached, reader_cls(r'app/files', filename, cache=self.cache).get_data())
+            # second read comes from the cache
+            assert_frame_equal(uncached, reader_cls(r'app/files', filename, cache=self.cache).get_data())
+        self.assertEqual(len(os.listdir(self.tmp_dir.name)), 3)
+
+    def test_cache_hit_skips_parsing(self):
+        CSVReader(r'app/files', 'demo_csv.csv', cache=self.cache).get_data()
+        def fail():
+            raise AssertionError("file was parsed again")
+        df = self.cache.get_or_read(os.path.join(r'app/files', 'demo_csv.csv'), "csv", fail, columns=["c"])
+        self.assertListEqual(df["c"].tolist(), ["cat", "dog", "apple"])
+
+    def test_eviction_by_size(self):
+        cache = ColumnarCache(self.tmp_dir.name, max_bytes=1)
+        CSVReader(r'app/files', 'demo_csv.csv', cache=cache).get_data()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -8,3 +8,25 @@ class Config(object):
     ALLOWED_EXTENSIONS = ["csv"]
     UPLOAD_FOLDER = r"app/uploads"
     DEMO_DATA_SOURCE = r"app/files"
+    COLUMNAR_CACHE_FOLDER = r"app/cache"
+    COLUMNAR_CACHE_MAX_BYTES = 2 * 1024 ** 3
+    COLUMNAR_CACHE_MAX_AGE = 7 * 24 * 3600
+    METRIC_EXECUTOR = os.environ.get("METRIC_EXECUTOR") or "thread"
+    SQL_POOL_SIZE = int(os.environ.get("SQL_POOL_SIZE") or 5)
+    SQL_POOL_MAX_OVERFLOW = int(os.environ.get("SQL_POOL_MAX_OVERFLOW") or 10)
+    SQL_POOL_PRE_PING = True
+    SQL_POOL_RECYCLE = 3600
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS") or 2)
+    RESULT_STORE_FOLDER = r"app/results"
+    RESULT_STORE_MAX_AGE = 24 * 3600
+    MODEL_MMAP_MODE = os.environ.get("MODEL_MMAP_MODE") or None
+    PRELOAD_MODELS = [
+        r"app/models/bow_model_pipeline_v2.joblib",
+        r"app/models/notification_model.joblib",
+    ]
+    SCORE_CACHE_PATH = r"app/cache/scores.db"
+    METRIC_CACHE_ENABLED = (os.environ.get("METRIC_CACHE_ENABLED") or "1") == "1"
+    METRIC_CACHE_MAX_ENTRIES = 512
+    METRIC_CACHE_MAX_BYTES = 256 * 1024 ** 2
+    METRIC_CACHE_FOLDER = r"app/cache/metric_results"
+    METRIC_CACHE_MAX_DISK_BYTES = 1024 ** 3